@@ -0,0 +1,153 @@
+"""
+Concurrent in-flight forward calls sustained by a single event loop:
+AsyncClient vs blocking Client wrapped in run_in_executor,
+server runs in a separate process and resolves each forward after --delay ms
+
+    python benchmarks/async_client.py --concurrency 1 16 64 256 1024 --duration 3
+"""
+import argparse
+import asyncio
+import heapq
+import multiprocessing as mp
+import threading
+import time
+from random import randint
+
+import numpy as np
+
+import tiktorch.serializers  # noqa: registers NDArray serializers
+from tiktorch.rpc import AsyncClient, Client, RPCFuture, RPCInterface, Server, Shutdown, TCPConnConf, Transport, exposed
+from tiktorch.types import NDArray
+
+
+class IBench(RPCInterface):
+    @exposed
+    def forward(self, arr: NDArray) -> RPCFuture[NDArray]:
+        raise NotImplementedError
+
+    @exposed
+    def shutdown(self) -> None:
+        raise NotImplementedError
+
+
+class Bench(IBench):
+    """
+    Resolves futures after a delay without occupying a thread per call
+    """
+
+    def __init__(self, delay: float):
+        self._delay = delay
+        self._timers = []
+        self._cond = threading.Condition()
+        self._stopped = False
+        threading.Thread(target=self._run, name="BenchTimers", daemon=True).start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped and (not self._timers or self._timers[0][0] > time.monotonic()):
+                    self._cond.wait(self._timers[0][0] - time.monotonic() if self._timers else None)
+                if self._stopped:
+                    return
+                _, _, fut, arr = heapq.heappop(self._timers)
+            fut.set_result(arr)
+
+    def forward(self, arr: NDArray) -> RPCFuture[NDArray]:
+        fut = RPCFuture()
+        with self._cond:
+            heapq.heappush(self._timers, (time.monotonic() + self._delay, id(fut), fut, arr))
+            self._cond.notify()
+        return fut
+
+    def shutdown(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        raise Shutdown()
+
+
+def serve(port: int, pub_port: int, delay: float) -> None:
+    Server(Bench(delay), TCPConnConf("127.0.0.1", port, pub_port, timeout=10000)).listen()
+
+
+async def run_async(conf, concurrency, duration, arr):
+    latencies = []
+    async with AsyncClient(IBench(), conf) as client:
+        await client.forward(arr)
+
+        async def _worker(stop_at):
+            while time.perf_counter() < stop_at:
+                start = time.perf_counter()
+                await client.forward(arr)
+                latencies.append(time.perf_counter() - start)
+
+        stop_at = time.perf_counter() + duration
+        await asyncio.gather(*[_worker(stop_at) for _ in range(concurrency)])
+
+        try:
+            await client.shutdown()
+        except Shutdown:
+            pass
+
+    return latencies
+
+
+async def run_executor(conf, concurrency, duration, arr):
+    latencies = []
+    client = Client(IBench(), conf)
+    loop = asyncio.get_running_loop()
+
+    def _forward():
+        return client.forward(arr).result()
+
+    await loop.run_in_executor(None, _forward)
+
+    async def _worker(stop_at):
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            await loop.run_in_executor(None, _forward)
+            latencies.append(time.perf_counter() - start)
+
+    stop_at = time.perf_counter() + duration
+    await asyncio.gather(*[_worker(stop_at) for _ in range(concurrency)])
+
+    try:
+        client.shutdown()
+    except Shutdown:
+        pass
+
+    return latencies
+
+
+def measure(mode, concurrency, duration, delay, tile):
+    port, pub_port = randint(20000, 40000), randint(40001, 60000)
+    # previous runs leave client threads behind, forking with them may deadlock the server
+    srv = mp.get_context("spawn").Process(target=serve, args=(port, pub_port, delay), name="BenchServer")
+    srv.start()
+
+    conf = TCPConnConf("127.0.0.1", port, pub_port, timeout=10000, transport=Transport.Pipelined)
+    arr = NDArray(np.zeros((tile, tile), dtype=np.float32))
+    run = run_async if mode == "async" else run_executor
+    latencies = asyncio.run(run(conf, concurrency, duration, arr))
+    srv.join()
+
+    return len(latencies) / duration, np.percentile(latencies, [50, 99]) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64, 256, 1024])
+    parser.add_argument("--duration", type=float, default=3.0)
+    parser.add_argument("--delay", type=float, default=10.0, help="server side latency of forward in ms")
+    parser.add_argument("--tile", type=int, default=64)
+    args = parser.parse_args()
+
+    print(f"{'in flight':>9} {'client':>9} {'calls/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for concurrency in args.concurrency:
+        for mode in ["async", "executor"]:
+            rate, (p50, p99) = measure(mode, concurrency, args.duration, args.delay / 1000, args.tile)
+            print(f"{concurrency:>9} {mode:>9} {rate:>9.0f} {p50:>8.1f} {p99:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
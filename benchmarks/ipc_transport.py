@@ -0,0 +1,112 @@
+"""
+Compare throughput of forward calls over ipc (unix domain sockets) and tcp loopback,
+server runs in a separate process
+
+Like INeuralNetworkAPI.forward, the tile is sent as request and the prediction of
+the same size comes back through notification channel. Arrays travel inline, shared
+memory (which bypasses the socket for large arrays) is not offered.
+
+    python benchmarks/ipc_transport.py --sizes 256 512 1024 2048 --duration 3
+"""
+import argparse
+import multiprocessing as mp
+import os
+import tempfile
+import time
+from random import randint
+
+import numpy as np
+import zmq
+
+import tiktorch.serializers  # noqa: registers NDArray serializers
+from tiktorch.rpc import Client, IPCConnConf, RPCFuture, RPCInterface, Server, Shutdown, TCPConnConf, exposed
+from tiktorch.rpc.connections import IConnConf
+from tiktorch.types import NDArray
+
+TIMEOUT = 10000  # ms
+
+
+class IBench(RPCInterface):
+    @exposed
+    def forward(self, image: NDArray) -> RPCFuture[NDArray]:
+        raise NotImplementedError
+
+    @exposed
+    def shutdown(self) -> None:
+        raise NotImplementedError
+
+
+class Bench(IBench):
+    def forward(self, image: NDArray) -> RPCFuture[NDArray]:
+        fut = RPCFuture()
+        fut.set_result(NDArray(image.as_numpy(), id_=image.id))
+        return fut
+
+    def shutdown(self) -> None:
+        raise Shutdown()
+
+
+def make_conf(kind: str, address) -> IConnConf:
+    if kind == "ipc":
+        return IPCConnConf(address, timeout=TIMEOUT)
+
+    port, pub_port = address
+    return TCPConnConf("127.0.0.1", port, pub_port, timeout=TIMEOUT)
+
+
+def serve(kind: str, address) -> None:
+    Server(Bench(), make_conf(kind, address)).listen()
+
+
+def measure(kind: str, address, size: int, duration: float) -> float:
+    spawn = mp.get_context("spawn")
+    srv = spawn.Process(target=serve, args=(kind, address), name="BenchServer")
+    srv.start()
+
+    client = Client(IBench(), make_conf(kind, address))
+    tile = NDArray(np.random.rand(size, size).astype(np.float32), id_=(0,))
+    # first call waits for server to start
+    client.forward(tile).result()
+
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration or count < 3:
+        client.forward(tile).result()
+        count += 1
+    elapsed = time.perf_counter() - start
+
+    try:
+        client.shutdown()
+    except Shutdown:
+        pass
+    srv.join()
+
+    return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 512, 1024, 2048], help="edge of float32 tile")
+    parser.add_argument("--duration", type=float, default=3.0)
+    args = parser.parse_args()
+
+    if not zmq.has("ipc"):
+        parser.error("ipc transport is not supported on this platform")
+
+    print(f"{'tile':>12} {'transport':>10} {'calls/s':>10} {'MB/s':>10}")
+    with tempfile.TemporaryDirectory(prefix="tiktorch-bench-") as tmpdir:
+        for size in args.sizes:
+            nbytes = size * size * 4
+            for kind in ["tcp", "ipc"]:
+                if kind == "ipc":
+                    address = os.path.join(tmpdir, f"forward-{size}")
+                else:
+                    address = (randint(20000, 40000), randint(40001, 60000))
+
+                rate = measure(kind, address, size, args.duration)
+                # each call moves the tile twice
+                print(f"{size:>5}x{size:<6} {kind:>10} {rate:>10.1f} {2 * nbytes * rate / 1e6:>10.1f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
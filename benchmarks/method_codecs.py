@@ -0,0 +1,76 @@
+"""
+Per-call overhead of method argument/return (de)serialization:
+inspecting signature on every call vs codec built once per method
+
+    python benchmarks/method_codecs.py --number 20000
+"""
+import argparse
+import timeit
+
+import numpy as np
+
+import tiktorch.serializers  # noqa: registers NDArray serializers
+from tiktorch.rpc import RPCFuture, RPCInterface, exposed
+from tiktorch.rpc.base import (
+    MethodCodec,
+    deserialize_args,
+    deserialize_return,
+    isfutureret,
+    serialize_args,
+    serialize_return,
+)
+from tiktorch.types import NDArray
+
+
+class Api(RPCInterface):
+    @exposed
+    def ping(self) -> bytes:
+        return b"pong"
+
+    @exposed
+    def forward(self, image: NDArray) -> RPCFuture[NDArray]:
+        raise NotImplementedError
+
+    @exposed
+    def remove_data(self, dataset_name: str, ids: list) -> None:
+        raise NotImplementedError
+
+
+def legacy_roundtrip(func, args, ret):
+    isfutureret(func)
+    frames = list(serialize_args(func, args))
+    deserialize_args(func, iter(frames))
+    deserialize_return(func, iter(list(serialize_return(func, ret))))
+
+
+def codec_roundtrip(codec, args, ret):
+    codec.returns_future
+    frames = codec.serialize_args(args)
+    codec.deserialize_args(iter(frames))
+    codec.deserialize_return(iter(list(codec.serialize_return(ret))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    api = Api()
+    image = NDArray(np.zeros((64, 64), dtype=np.float32), id_=(0, 0))
+    cases = {
+        "ping": (api.ping, (), b"pong"),
+        "forward": (api.forward, (image,), image),
+        "remove_data": (api.remove_data, ("training", ["a", "b"]), None),
+    }
+
+    print(f"{'method':>12} {'inspect us/call':>16} {'codec us/call':>14} {'speedup':>8}")
+    for name, (func, call_args, ret) in cases.items():
+        codec = MethodCodec(name, func)
+        legacy = timeit.timeit(lambda: legacy_roundtrip(func, call_args, ret), number=args.number)
+        compiled = timeit.timeit(lambda: codec_roundtrip(codec, call_args, ret), number=args.number)
+        us = 1e6 / args.number
+        print(f"{name:>12} {legacy * us:>16.2f} {compiled * us:>14.2f} {legacy / compiled:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
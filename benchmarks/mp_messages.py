@@ -0,0 +1,100 @@
+"""
+Message rate of MPServer/MPClient over a pipe at various fan-outs
+
+Each round issues --fanout calls without waiting, then waits for all of them,
+like HandlerProcess forwarding a batch to InferenceProcess. Every call is
+two messages, MethodCall and MethodReturn. Calls of "forward" are resolved
+by a separate thread of the server.
+
+    python benchmarks/mp_messages.py --fanout 1 16 128 1024 --duration 3
+"""
+import argparse
+import multiprocessing as mp
+import queue
+import threading
+import time
+
+from tiktorch.rpc import RPCFuture, RPCInterface, Shutdown, exposed
+from tiktorch.rpc.mp import MPServer, create_client
+
+
+class IBench(RPCInterface):
+    @exposed
+    def echo(self, value: int) -> int:
+        raise NotImplementedError
+
+    @exposed
+    def forward(self, value: int) -> RPCFuture[int]:
+        raise NotImplementedError
+
+    @exposed
+    def shutdown(self) -> Shutdown:
+        raise NotImplementedError
+
+
+class Bench(IBench):
+    def __init__(self):
+        self._pending = queue.Queue()
+        threading.Thread(target=self._run, name="BenchResolver", daemon=True).start()
+
+    def _run(self):
+        while True:
+            fut, value = self._pending.get()
+            fut.set_result(value)
+
+    def echo(self, value: int) -> int:
+        return value
+
+    def forward(self, value: int) -> RPCFuture[int]:
+        fut = RPCFuture()
+        self._pending.put((fut, value))
+        return fut
+
+    def shutdown(self) -> Shutdown:
+        return Shutdown()
+
+
+def serve(conn):
+    MPServer(Bench(), conn).listen()
+
+
+def measure(method, fanout, duration):
+    client_conn, server_conn = mp.Pipe()
+    srv = mp.get_context("spawn").Process(target=serve, args=(server_conn,), name="BenchServer")
+    srv.start()
+    client = create_client(IBench, client_conn, timeout=30)
+
+    call = getattr(client, method)
+    call_async = getattr(call, "async_")
+    call_async(0).result()
+
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        futs = [call_async(i) for i in range(fanout)]
+        for fut in futs:
+            fut.result()
+        calls += fanout
+    elapsed = time.perf_counter() - start
+
+    client.shutdown()
+    srv.join()
+
+    return 2 * calls / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fanout", type=int, nargs="+", default=[1, 16, 128, 1024])
+    parser.add_argument("--duration", type=float, default=3.0)
+    args = parser.parse_args()
+
+    print(f"{'fan-out':>8} {'method':>8} {'messages/s':>11}")
+    for fanout in args.fanout:
+        for method in ["echo", "forward"]:
+            rate = measure(method, fanout, args.duration)
+            print(f"{fanout:>8} {method:>8} {rate:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
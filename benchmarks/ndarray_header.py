@@ -0,0 +1,57 @@
+"""
+Encode/decode cost of NDArrayBatch metadata:
+type tag frame with json metadata vs binary header
+
+    python benchmarks/ndarray_header.py --tile 16 --number 2000
+"""
+
+import argparse
+import timeit
+
+import numpy as np
+
+import tiktorch.serializers  # noqa: registers NDArray serializers
+from tiktorch.rpc import BINARY_HEADER_VERSION, WireOptions, deserialize, serialize
+from tiktorch.rpc.serialization import wire_options
+from tiktorch.types import NDArray, NDArrayBatch
+
+BATCH_SIZES = (1, 4, 16, 64, 256)
+
+
+def measure(batch, options, number):
+    with wire_options(options):
+        encode = timeit.timeit(lambda: list(serialize(batch)), number=number)
+        frames = list(serialize(batch))
+
+    decode = timeit.timeit(lambda: deserialize(iter(frames)), number=number)
+    return encode / number, decode / number, len(frames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tile", type=int, default=16, help="edge of square float32 tiles")
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    json_options = WireOptions()
+    binary_options = WireOptions(binary_header=BINARY_HEADER_VERSION)
+
+    print(
+        f"{'arrays':>6} {'json enc us':>12} {'bin enc us':>11} {'json dec us':>12} {'bin dec us':>11}"
+        f" {'enc speedup':>12} {'dec speedup':>12} {'frames':>9}"
+    )
+    for size in BATCH_SIZES:
+        batch = NDArrayBatch(
+            [NDArray(np.zeros((args.tile, args.tile), dtype=np.float32), id_=(i, 0)) for i in range(size)]
+        )
+        number = max(args.number // size, 10)
+        json_enc, json_dec, json_frames = measure(batch, json_options, number)
+        bin_enc, bin_dec, bin_frames = measure(batch, binary_options, number)
+        print(
+            f"{size:>6} {json_enc * 1e6:>12.1f} {bin_enc * 1e6:>11.1f} {json_dec * 1e6:>12.1f} {bin_dec * 1e6:>11.1f}"
+            f" {json_enc / bin_enc:>11.2f}x {json_dec / bin_dec:>11.2f}x {json_frames:>4}/{bin_frames:<4}"
+        )
+
+
+if __name__ == "__main__":
+    main()
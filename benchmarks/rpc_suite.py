@@ -0,0 +1,378 @@
+"""
+End-to-end benchmark suite of the RPC layers, results are written as JSON
+
+Covers Server/Client of tiktorch.rpc.base over inproc, ipc and tcp
+and MPServer/MPClient of tiktorch.rpc.mp over a pipe:
+
+    latency      round trip of empty call, percentiles in us
+    throughput   calls/s and MB/s of echoing NDArray and NDArrayBatch of growing payload size
+    future       round trip of call returning RPCFuture, result comes through notification channel
+    scaling      calls/s and latency of empty call with growing number of concurrent clients
+
+Servers of ipc, tcp and mp run in a separate process, inproc server runs in a thread.
+Throughput counts payload in one direction.
+
+    python benchmarks/rpc_suite.py --output rpc_bench.json
+    python benchmarks/rpc_suite.py --quick --scenarios latency future --transports tcp mp
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from random import randint
+from typing import Any, Callable, Dict, Iterator, List
+
+import numpy as np
+import zmq
+
+import tiktorch.serializers  # noqa: registers NDArray serializers
+from tiktorch.rpc import (
+    Client,
+    InprocConnConf,
+    IPCConnConf,
+    RPCFuture,
+    RPCInterface,
+    Server,
+    Shutdown,
+    TCPConnConf,
+    Transport,
+    WireOptions,
+    exposed,
+)
+from tiktorch.rpc.connections import IConnConf
+from tiktorch.rpc.mp import MPServer, create_client
+from tiktorch.types import NDArray, NDArrayBatch
+
+TRANSPORTS = ("inproc", "ipc", "tcp", "mp")
+SCENARIOS = ("latency", "throughput", "future", "scaling")
+TIMEOUT = 10000  # ms
+BATCH_SIZE = 8
+
+
+class IBench(RPCInterface):
+    @exposed
+    def ping(self) -> bytes:
+        raise NotImplementedError
+
+    @exposed
+    def ping_async(self) -> RPCFuture[bytes]:
+        raise NotImplementedError
+
+    @exposed
+    def echo(self, arr: NDArray) -> NDArray:
+        raise NotImplementedError
+
+    @exposed
+    def echo_batch(self, batch: NDArrayBatch) -> NDArrayBatch:
+        raise NotImplementedError
+
+    @exposed
+    def shutdown(self) -> None:
+        raise NotImplementedError
+
+
+class Bench(IBench):
+    def ping(self) -> bytes:
+        return b"pong"
+
+    def ping_async(self) -> RPCFuture[bytes]:
+        fut = RPCFuture()
+        fut.set_result(b"pong")
+        return fut
+
+    def echo(self, arr: NDArray) -> NDArray:
+        return arr
+
+    def echo_batch(self, batch: NDArrayBatch) -> NDArrayBatch:
+        return batch
+
+    def shutdown(self) -> None:
+        raise Shutdown()
+
+
+class MPBench(Bench):
+    def shutdown(self) -> Shutdown:
+        return Shutdown()
+
+
+def make_conf(kind: str, address: Any, transport: Transport, wire_options: WireOptions) -> IConnConf:
+    if kind == "tcp":
+        port, pub_port = address
+        return TCPConnConf("127.0.0.1", port, pub_port, timeout=TIMEOUT, transport=transport, wire_options=wire_options)
+
+    return IPCConnConf(os.path.join(address, "rpc"), TIMEOUT, transport=transport, wire_options=wire_options)
+
+
+def serve_zmq(kind: str, address: Any, wire_options: WireOptions, workers: int) -> None:
+    conf = make_conf(kind, address, Transport.ReqRep, wire_options)
+    Server(Bench(), conf, max_workers=workers).listen()
+
+
+def serve_mp(conn) -> None:
+    MPServer(MPBench(), conn).listen()
+
+
+@contextmanager
+def target(kind: str, args: argparse.Namespace) -> Iterator[Callable[[], IBench]]:
+    """
+    Run benchmark server reachable over *kind* transport
+
+    :returns factory of clients connected to the server
+    """
+    spawn = mp.get_context("spawn")
+    transport = Transport(args.client_transport)
+    wire_options = WireOptions(binary_header=1)
+
+    if kind == "mp":
+        client_conn, server_conn = spawn.Pipe()
+        proc = spawn.Process(target=serve_mp, args=(server_conn,), name="BenchServer")
+        proc.start()
+        # pipe has a single client end, concurrent callers share it
+        client = create_client(IBench, client_conn, timeout=TIMEOUT / 1000)
+        try:
+            yield lambda: client
+        finally:
+            client.shutdown()
+            proc.join()
+        return
+
+    if kind == "inproc":
+        ctx = zmq.Context()
+        conf = InprocConnConf(
+            "bench", "bench_notify", ctx, timeout=TIMEOUT, transport=transport, wire_options=wire_options
+        )
+        srv = Server(Bench(), conf, max_workers=args.workers)
+        srv_thread = threading.Thread(target=srv.listen, name="BenchServer")
+        srv_thread.start()
+        try:
+            yield lambda: Client(IBench(), conf)
+        finally:
+            _shutdown(conf)
+            srv_thread.join()
+        return
+
+    with tempfile.TemporaryDirectory(prefix="tiktorch-bench-") as tmpdir:
+        address = (randint(20000, 40000), randint(40001, 60000)) if kind == "tcp" else tmpdir
+        # forking after clients of previous targets started their threads may deadlock the server
+        proc = spawn.Process(target=serve_zmq, args=(kind, address, wire_options, args.workers), name="BenchServer")
+        proc.start()
+        conf = make_conf(kind, address, transport, wire_options)
+        try:
+            yield lambda: Client(IBench(), conf)
+        finally:
+            _shutdown(conf)
+            proc.join()
+
+
+def _shutdown(conf: IConnConf) -> None:
+    try:
+        Client(IBench(), conf).shutdown()
+    except Shutdown:
+        pass
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """
+    :param samples: durations in seconds
+    :returns summary in microseconds
+    """
+    us = np.asarray(samples) * 1e6
+    p50, p90, p99, p999 = np.percentile(us, [50, 90, 99, 99.9])
+    return {
+        "min": float(us.min()),
+        "mean": float(us.mean()),
+        "p50": float(p50),
+        "p90": float(p90),
+        "p99": float(p99),
+        "p999": float(p999),
+        "max": float(us.max()),
+    }
+
+
+def time_calls(call: Callable[[], Any], count: int, warmup: int) -> List[float]:
+    for _ in range(warmup):
+        call()
+
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - start)
+
+    return samples
+
+
+def bench_latency(client: IBench, args: argparse.Namespace) -> List[Dict[str, Any]]:
+    samples = time_calls(client.ping, args.calls, args.warmup)
+    return [{"method": "ping", "calls": len(samples), "latency_us": percentiles(samples)}]
+
+
+def bench_future(client: IBench, args: argparse.Namespace) -> List[Dict[str, Any]]:
+    samples = time_calls(lambda: client.ping_async().result(), args.calls, args.warmup)
+    return [{"method": "ping_async", "calls": len(samples), "latency_us": percentiles(samples)}]
+
+
+def bench_throughput(client: IBench, args: argparse.Namespace) -> List[Dict[str, Any]]:
+    results = []
+    for size in args.sizes:
+        arr = NDArray(np.random.rand(max(size // 4, 1)).astype(np.float32), id_=(0,))
+        batch = NDArrayBatch(
+            [
+                NDArray(np.random.rand(max(size // 4 // BATCH_SIZE, 1)).astype(np.float32), id_=(i,))
+                for i in range(BATCH_SIZE)
+            ]
+        )
+
+        for method, payload, nbytes in [
+            ("echo", arr, arr.as_numpy().nbytes),
+            ("echo_batch", batch, sum(a.nbytes for a in batch.as_numpy())),
+        ]:
+            call = getattr(client, method)
+            samples = time_calls(lambda: call(payload), 0, args.warmup)
+            deadline = time.perf_counter() + args.duration
+            # large payloads take long, at least a few calls are made
+            while time.perf_counter() < deadline or len(samples) < 3:
+                start = time.perf_counter()
+                call(payload)
+                samples.append(time.perf_counter() - start)
+
+            elapsed = sum(samples)
+            results.append(
+                {
+                    "method": method,
+                    "payload_bytes": nbytes,
+                    "calls": len(samples),
+                    "calls_per_s": len(samples) / elapsed,
+                    "mb_per_s": nbytes * len(samples) / elapsed / 1e6,
+                    "latency_us": percentiles(samples),
+                }
+            )
+
+    return results
+
+
+def bench_scaling(make_client: Callable[[], IBench], args: argparse.Namespace) -> List[Dict[str, Any]]:
+    results = []
+    for count in args.clients:
+        clients = [make_client() for _ in range(count)]
+        samples: List[List[float]] = [[] for _ in range(count)]
+        start_evt = threading.Event()
+        stop_evt = threading.Event()
+
+        def _worker(idx):
+            client = clients[idx]
+            for _ in range(args.warmup):
+                client.ping()
+
+            start_evt.wait()
+            while not stop_evt.is_set():
+                start = time.perf_counter()
+                client.ping()
+                samples[idx].append(time.perf_counter() - start)
+
+        workers = [threading.Thread(target=_worker, args=(i,), name=f"BenchClient-{i}") for i in range(count)]
+        for w in workers:
+            w.start()
+
+        start_evt.set()
+        started = time.perf_counter()
+        time.sleep(args.duration)
+        stop_evt.set()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - started
+
+        merged = [s for client_samples in samples for s in client_samples]
+        results.append(
+            {
+                "method": "ping",
+                "clients": count,
+                "calls": len(merged),
+                "calls_per_s": len(merged) / elapsed,
+                "latency_us": percentiles(merged),
+            }
+        )
+
+    return results
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "pyzmq": zmq.pyzmq_version(),
+        "libzmq": zmq.zmq_version(),
+        "numpy": np.__version__,
+    }
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    results = []
+    for kind in args.transports:
+        if kind == "ipc" and not zmq.has("ipc"):
+            print(f"{kind}: not supported on this platform, skipping")
+            continue
+
+        with target(kind, args) as make_client:
+            client = make_client()
+            for scenario in args.scenarios:
+                if scenario == "scaling":
+                    entries = bench_scaling(make_client, args)
+                else:
+                    entries = globals()[f"bench_{scenario}"](client, args)
+
+                for entry in entries:
+                    results.append({"scenario": scenario, "transport": kind, **entry})
+                    report(results[-1])
+
+    return {"environment": environment(), "config": vars(args), "results": results}
+
+
+def report(entry: Dict[str, Any]) -> None:
+    lat = entry["latency_us"]
+    line = f"{entry['scenario']:>10} {entry['transport']:>6} {entry['method']:>10}"
+    if "payload_bytes" in entry:
+        line += f" {entry['payload_bytes']:>10}B {entry['mb_per_s']:>9.1f}MB/s"
+    if "clients" in entry:
+        line += f" {entry['clients']:>4} clients {entry['calls_per_s']:>9.0f} calls/s"
+    line += f"  p50 {lat['p50']:>9.1f}us  p99 {lat['p99']:>9.1f}us"
+    print(line, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="rpc_bench.json", help="file results are written to")
+    parser.add_argument("--transports", nargs="+", choices=TRANSPORTS, default=list(TRANSPORTS))
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--calls", type=int, default=5000, help="measured calls of latency scenarios")
+    parser.add_argument("--warmup", type=int, default=100, help="calls made before measuring")
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds per point of throughput and scaling")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1 << 10, 1 << 16, 1 << 20, 1 << 24])
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--workers", type=int, default=4, help="worker threads of zmq server, 0 to serve inline")
+    parser.add_argument("--client-transport", choices=[t.value for t in Transport], default=Transport.ReqRep.value)
+    parser.add_argument("--quick", action="store_true", help="few calls and small payloads, for smoke runs")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.calls, args.warmup, args.duration = 200, 10, 0.2
+        args.sizes, args.clients = [1 << 10, 1 << 20], [1, 4]
+
+    results = run(args)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Compare calls/s of REQ/REP and pipelined DEALER/ROUTER client transports
+
+    python benchmarks/rpc_transport.py --threads 1 4 16 --duration 3
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from random import randint
+
+import zmq
+
+from tiktorch.rpc import Client, RPCFuture, RPCInterface, Server, Shutdown, TCPConnConf, Transport, exposed
+
+
+class IBench(RPCInterface):
+    @exposed
+    def ping(self) -> bytes:
+        raise NotImplementedError
+
+    @exposed
+    def echo_async(self, data: bytes) -> RPCFuture[bytes]:
+        raise NotImplementedError
+
+    @exposed
+    def shutdown(self) -> None:
+        raise NotImplementedError
+
+
+class Bench(IBench):
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=4)
+
+    def ping(self) -> bytes:
+        return b"pong"
+
+    def echo_async(self, data: bytes) -> RPCFuture[bytes]:
+        fut = RPCFuture()
+        fut.set_result(data)
+        return fut
+
+    def shutdown(self) -> None:
+        self._executor.shutdown()
+        raise Shutdown()
+
+
+def run_server(conn_conf):
+    srv = Server(Bench(), conn_conf)
+    t = threading.Thread(target=srv.listen, name="BenchServer")
+    t.start()
+    return t
+
+
+def measure(conn_conf, threads: int, duration: float, method: str) -> float:
+    client = Client(IBench(), conn_conf)
+    stop = threading.Event()
+    counts = [0] * threads
+
+    def _worker(idx):
+        call = getattr(client, method)
+        while not stop.is_set():
+            if method == "echo_async":
+                call(b"x").result()
+            else:
+                call()
+            counts[idx] += 1
+
+    workers = [threading.Thread(target=_worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+
+    time.sleep(duration)
+    stop.set()
+
+    for w in workers:
+        w.join()
+
+    return sum(counts) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--duration", type=float, default=3.0)
+    parser.add_argument("--method", choices=["ping", "echo_async"], default="ping")
+    args = parser.parse_args()
+
+    print(f"{'transport':>10} {'threads':>8} {'calls/s':>12}")
+    for transport in Transport:
+        for threads in args.threads:
+            port, pub_port = randint(20000, 40000), randint(40001, 60000)
+            conf = TCPConnConf("127.0.0.1", port, pub_port, timeout=5000, ctx=zmq.Context(), transport=transport)
+            srv_thread = run_server(conf)
+
+            rate = measure(conf, threads, args.duration, args.method)
+            print(f"{transport.value:>10} {threads:>8} {rate:>12.0f}")
+
+            try:
+                Client(IBench(), conf).shutdown()
+            except Shutdown:
+                pass
+            srv_thread.join()
+
+
+if __name__ == "__main__":
+    main()
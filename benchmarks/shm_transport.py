@@ -0,0 +1,85 @@
+"""
+Compare throughput of NDArray round trips with inline frames and shared memory
+over TCP loopback, server runs in a separate process
+
+    python benchmarks/shm_transport.py --sizes 512 1024 --duration 3
+"""
+import argparse
+import multiprocessing as mp
+import time
+from random import randint
+
+import numpy as np
+
+import tiktorch.serializers  # noqa: registers NDArray serializers
+from tiktorch.rpc import Client, RPCInterface, Server, Shutdown, TCPConnConf, WireOptions, exposed
+from tiktorch.types import NDArray
+
+
+class IBench(RPCInterface):
+    @exposed
+    def echo(self, arr: NDArray) -> NDArray:
+        raise NotImplementedError
+
+    @exposed
+    def shutdown(self) -> None:
+        raise NotImplementedError
+
+
+class Bench(IBench):
+    def echo(self, arr: NDArray) -> NDArray:
+        return arr
+
+    def shutdown(self) -> None:
+        raise Shutdown()
+
+
+def serve(port: int, pub_port: int) -> None:
+    conf = TCPConnConf("127.0.0.1", port, pub_port, timeout=5000, wire_options=WireOptions(shm=True))
+    Server(Bench(), conf).listen()
+
+
+def measure(size: int, use_shm: bool, duration: float) -> float:
+    port, pub_port = randint(20000, 40000), randint(40001, 60000)
+    srv = mp.Process(target=serve, args=(port, pub_port), name="BenchServer")
+    srv.start()
+
+    conf = TCPConnConf("127.0.0.1", port, pub_port, timeout=5000, wire_options=WireOptions(shm=use_shm))
+    client = Client(IBench(), conf)
+    assert client.wire_options.shm == use_shm
+
+    arr = NDArray(np.random.rand(size, size).astype(np.float32))
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        client.echo(arr)
+        count += 1
+    elapsed = time.perf_counter() - start
+
+    try:
+        client.shutdown()
+    except Shutdown:
+        pass
+    srv.join()
+
+    return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024])
+    parser.add_argument("--duration", type=float, default=3.0)
+    args = parser.parse_args()
+
+    print(f"{'tile':>12} {'transport':>10} {'round trips/s':>14} {'MB/s':>10}")
+    for size in args.sizes:
+        nbytes = size * size * 4
+        for use_shm in [False, True]:
+            rate = measure(size, use_shm, args.duration)
+            transport = "shm" if use_shm else "inline"
+            # each round trip moves the tile twice
+            print(f"{f'{size}x{size}':>12} {transport:>10} {rate:>14.1f} {2 * rate * nbytes / 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Wakeup latency of RPC loops: how fast resolved futures reach the client,
+how long it takes until all RPC threads exit on shutdown and how much CPU idle server and client burn
+
+Future is resolved by a server side thread which stamps the result with time.monotonic(),
+client measures time until its future is done. Server and client share the process,
+Server/Client are connected over inproc, MPServer/MPClient over a pipe.
+
+    python benchmarks/wakeup_latency.py --calls 2000 --idle 5
+"""
+import argparse
+import queue
+import threading
+import time
+from multiprocessing import Pipe
+
+import numpy as np
+import zmq
+
+from tiktorch.rpc import Client, InprocConnConf, RPCFuture, RPCInterface, Server, Shutdown, exposed
+from tiktorch.rpc.mp import MPServer, create_client
+
+
+class IBench(RPCInterface):
+    @exposed
+    def stamp(self) -> RPCFuture[float]:
+        raise NotImplementedError
+
+    @exposed
+    def shutdown(self) -> None:
+        raise NotImplementedError
+
+
+class Bench(IBench):
+    """
+    Futures are resolved by a separate thread, same as results of inference
+    """
+
+    def __init__(self):
+        self._pending = queue.Queue()
+        threading.Thread(target=self._run, name="BenchResolver", daemon=True).start()
+
+    def _run(self):
+        while True:
+            fut = self._pending.get()
+            fut.set_result(time.monotonic())
+
+    def stamp(self) -> RPCFuture[float]:
+        fut = RPCFuture()
+        self._pending.put(fut)
+        return fut
+
+    def shutdown(self) -> None:
+        raise Shutdown()
+
+
+class MPBench(Bench):
+    def shutdown(self) -> Shutdown:
+        return Shutdown()
+
+
+def start_zmq():
+    conf = InprocConnConf("bench", "bench_notify", zmq.Context(), timeout=10000)
+    srv = Server(Bench(), conf)
+    threading.Thread(target=srv.listen, name="BenchServer").start()
+    return Client(IBench(), conf)
+
+
+def start_mp():
+    client_conn, server_conn = Pipe()
+    threading.Thread(target=MPServer(MPBench(), server_conn).listen, name="BenchServer").start()
+    return create_client(IBench, client_conn, timeout=10)
+
+
+def measure(start, calls, idle):
+    before = set(threading.enumerate())
+    client = start()
+    done = threading.Event()
+    latencies = []
+
+    def _on_done(fut):
+        latencies.append(time.monotonic() - fut.result())
+        done.set()
+
+    for _ in range(calls):
+        done.clear()
+        client.stamp().add_done_callback(_on_done)
+        done.wait()
+
+    # everything is set up and waiting, any CPU used now is spent by timed polling
+    cpu_start = time.process_time()
+    time.sleep(idle)
+    idle_cpu = (time.process_time() - cpu_start) / idle
+
+    shutdown_start = time.perf_counter()
+    try:
+        client.shutdown()
+    except Shutdown:
+        pass
+    # shutdown is complete once threads of server and client have exited
+    for thread in set(threading.enumerate()) - before:
+        if thread.name != "BenchResolver":
+            thread.join()
+    shutdown = time.perf_counter() - shutdown_start
+
+    return np.percentile(latencies, [50, 99]) * 1e6, idle_cpu * 100, shutdown * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--idle", type=float, default=5.0, help="seconds idle CPU use is measured for")
+    args = parser.parse_args()
+
+    print(f"{'rpc':>4} {'p50 us':>9} {'p99 us':>9} {'idle cpu %':>11} {'shutdown ms':>12}")
+    for name, start in [("zmq", start_zmq), ("mp", start_mp)]:
+        (p50, p99), idle_cpu, shutdown = measure(start, args.calls, args.idle)
+        print(f"{name:>4} {p50:>9.1f} {p99:>9.1f} {idle_cpu:>11.3f} {shutdown:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+from threading import Thread
+
+import pytest
+import zmq
+
+from tiktorch.rpc import RPCFuture, Shutdown, WireOptions
+from tiktorch.rpc.base import Client, Server
+from tiktorch.rpc.connections import InprocConnConf, Transport
+from tiktorch.rpc.interface import RPCInterface, exposed
+from tiktorch.types import NDArray
+
+
+class IArrayRPC(RPCInterface):
+    @exposed
+    def add_one(self, arr: NDArray) -> NDArray:
+        raise NotImplementedError
+
+    @exposed
+    def add_one_async(self, arr: NDArray) -> RPCFuture[NDArray]:
+        raise NotImplementedError
+
+    @exposed
+    def shutdown(self) -> None:
+        raise NotImplementedError
+
+
+class ArrayRPC(IArrayRPC):
+    def add_one(self, arr: NDArray) -> NDArray:
+        return NDArray(arr.as_numpy() + 1, arr.id)
+
+    def add_one_async(self, arr: NDArray) -> RPCFuture[NDArray]:
+        fut = RPCFuture()
+        fut.set_result(self.add_one(arr))
+        return fut
+
+    def shutdown(self) -> None:
+        raise Shutdown()
+
+
+@pytest.fixture(params=[Transport.ReqRep, Transport.Pipelined], ids=["reqrep", "pipelined"])
+def negotiate(request, assert_threads_cleanup):
+    """
+    Connect client and server offering their own wire options, server implements IArrayRPC
+
+    :returns function taking wire options of server and client, returning connected client
+    """
+    ctx = zmq.Context()
+    connected = []
+
+    def _conf(wire_options: WireOptions) -> InprocConnConf:
+        return InprocConnConf(
+            "test_negotiation",
+            "pubsub_test_negotiation",
+            ctx,
+            timeout=2000,
+            transport=request.param,
+            wire_options=wire_options,
+        )
+
+    def _negotiate(server_options: WireOptions, client_options: WireOptions) -> Client:
+        srv = Server(ArrayRPC(), _conf(server_options))
+        t = Thread(target=srv.listen, name="TestServerThread")
+        t.start()
+
+        cl = Client(IArrayRPC(), _conf(client_options))
+        connected.append((cl, t))
+        return cl
+
+    yield _negotiate
+
+    for cl, t in connected:
+        with pytest.raises(Shutdown):
+            cl.shutdown()
+        t.join()
@@ -0,0 +1,176 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+from time import sleep
+from typing import Iterator
+
+import numpy as np
+import pytest
+import zmq
+
+from tiktorch.rpc import (
+    AsyncClient,
+    DeadlineExceeded,
+    RPCFuture,
+    RPCInterface,
+    Server,
+    Shutdown,
+    WireOptions,
+    deadline,
+    exposed,
+)
+from tiktorch.rpc.connections import InprocConnConf
+from tiktorch.rpc.exceptions import CallException
+from tiktorch.types import NDArray
+
+
+class IAsyncRPC(RPCInterface):
+    @exposed
+    def concat(self, a: bytes, b: bytes) -> bytes:
+        raise NotImplementedError
+
+    @exposed
+    def forward(self, arr: NDArray) -> RPCFuture[NDArray]:
+        raise NotImplementedError
+
+    @exposed
+    def pending(self) -> RPCFuture[bytes]:
+        raise NotImplementedError
+
+    @exposed
+    def broken(self) -> bytes:
+        raise NotImplementedError
+
+    @exposed
+    def count(self, n: bytes) -> Iterator[bytes]:
+        raise NotImplementedError
+
+    @exposed
+    def shutdown(self) -> None:
+        raise NotImplementedError
+
+
+class AsyncRPC(IAsyncRPC):
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=4)
+        self.cancelled = threading.Event()
+
+    def concat(self, a: bytes, b: bytes) -> bytes:
+        return a + b
+
+    def forward(self, arr: NDArray) -> RPCFuture[NDArray]:
+        def _forward():
+            sleep(0.01)
+            return NDArray(arr.as_numpy() + 1, id_=arr.id)
+
+        return self._executor.submit(_forward)
+
+    def pending(self) -> RPCFuture[bytes]:
+        fut = RPCFuture()
+        fut.add_done_callback(lambda f: f.cancelled() and self.cancelled.set())
+        return fut
+
+    def broken(self) -> bytes:
+        raise Exception("broken")
+
+    def count(self, n: bytes) -> Iterator[bytes]:
+        for i in range(int(n)):
+            yield b"%d" % i
+
+    def shutdown(self) -> None:
+        self._executor.shutdown()
+        raise Shutdown()
+
+
+@pytest.fixture
+def conn_conf():
+    return InprocConnConf(
+        "test_aio", "pubsub_test_aio", zmq.Context(), timeout=5000, wire_options=WireOptions(binary_header=1)
+    )
+
+
+@pytest.fixture
+def api():
+    return AsyncRPC()
+
+
+@pytest.fixture
+def client(conn_conf, api, assert_threads_cleanup):
+    srv = Server(api, conn_conf)
+    t = Thread(target=srv.listen, name="TestServerThread")
+    t.start()
+
+    yield AsyncClient(IAsyncRPC(), conn_conf)
+
+    async def _shutdown():
+        cl = AsyncClient(IAsyncRPC(), conn_conf)
+        with pytest.raises(Shutdown):
+            await cl.shutdown()
+
+    asyncio.run(_shutdown())
+    t.join()
+
+
+def test_call(client):
+    async def _run():
+        async with client:
+            assert await client.concat(b"foo", b"bar") == b"foobar"
+            assert client.wire_options.binary_header == 1
+
+            with pytest.raises(CallException):
+                await client.broken()
+
+    asyncio.run(_run())
+
+
+def test_concurrent_futures_without_threads(client):
+    async def _run():
+        async with client:
+            arrays = [NDArray(np.full((4, 4), i, dtype=np.float32), id_=(i,)) for i in range(64)]
+            # server starts its threads on first calls
+            await asyncio.gather(*[client.forward(arr) for arr in arrays])
+            threads = threading.active_count()
+
+            results = await asyncio.gather(*[client.forward(arr) for arr in arrays])
+            assert threading.active_count() == threads, "client shouldn't start threads"
+
+        for arr, res in zip(arrays, results):
+            np.testing.assert_array_equal(res.as_numpy(), arr.as_numpy() + 1)
+            assert res.id == arr.id
+
+    asyncio.run(_run())
+
+
+def test_stream(client):
+    async def _run():
+        async with client:
+            stream = await client.count(b"100")
+            return [item async for item in stream]
+
+    assert asyncio.run(_run()) == [b"%d" % i for i in range(100)]
+
+
+def test_closed_client_raises_shutdown(client):
+    async def _run():
+        await client.aclose()
+        with pytest.raises(Shutdown):
+            await client.concat(b"a", b"b")
+
+    asyncio.run(_run())
+
+
+def test_cancelled_task_cancels_call_on_server(client, api):
+    async def _run():
+        async with client:
+            task = client.pending()
+            await asyncio.sleep(0.1)
+            task.cancel()
+            await asyncio.sleep(0.1)
+
+            with deadline(0):
+                with pytest.raises(DeadlineExceeded):
+                    await client.concat(b"a", b"b")
+
+    asyncio.run(_run())
+    assert api.cancelled.wait(timeout=2)
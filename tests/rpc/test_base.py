@@ -1,27 +1,37 @@
+import asyncio
 import logging
 import logging.config
 from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
-from threading import Thread
+from threading import Event, Lock, Thread
 from threading import enumerate as tenum
-from time import sleep
+from time import monotonic, sleep
+from typing import Iterator
 
 import pytest
 import zmq
 
 from tiktorch.rpc.base import (
     Client,
+    MethodCodec,
     RPCFuture,
     Server,
-    deserialize_args,
-    deserialize_return,
+    State,
+    decode_call_options,
+    encode_call_options,
+    error_frames,
     isfutureret,
-    serialize_args,
-    serialize_return,
+    make_call_header,
+    remote_error,
 )
-from tiktorch.rpc.connections import InprocConnConf
-from tiktorch.rpc.exceptions import CallException, Canceled, Shutdown, Timeout
-from tiktorch.rpc.interface import RPCInterface, exposed, get_exposed_methods
+from tiktorch.rpc import WireOptions, deadline
+from tiktorch.rpc.connections import InprocConnConf, Transport
+from tiktorch.rpc.deadline import get_deadline
+from tiktorch.rpc.exceptions import CallException, Canceled, DeadlineExceeded, Overloaded, Shutdown, Timeout
+from tiktorch.rpc.interface import RPCInterface, exposed, get_exposed_methods, get_serial_groups, serial
+from tiktorch.rpc.pool import pool
+from tiktorch.rpc.stream import STREAM_WINDOW
+from tiktorch.rpc.tracing import get_trace_id, traced
 
 
 class Iface(RPCInterface):
@@ -75,10 +85,10 @@ def log_debug():
 def spawn(conn_conf, assert_threads_cleanup):
     d = {"client": None, "thread": None}
 
-    def _spawn(iface, service):
+    def _spawn(iface, service, **server_kwargs):
         def _target():
             api = service()
-            srv = Server(api, conn_conf)
+            srv = Server(api, conn_conf, **server_kwargs)
             srv.listen()
 
         t = Thread(target=_target, name="TestServerThread")
@@ -110,43 +120,97 @@ def test_serialize_deserialize_method_args():
     f = Foo()
     data = {"a": 1}
     a = b"hello"
-    serialized = list(serialize_args(f.func, [data, a]))
+    codec = MethodCodec("func", f.func)
+    serialized = codec.serialize_args([data, a])
 
     for frame in serialized:
         assert isinstance(frame, zmq.Frame)
 
-    deserialized = deserialize_args(f.func, iter(serialized))
+    deserialized = codec.deserialize_args(iter(serialized))
     assert len(deserialized) == 2
     assert deserialized == [data, a]
 
 
 def test_serialize_deserialize_method_return():
     f = Foo()
-    serialized = list(serialize_return(f.func, b"bytes"))
+    codec = MethodCodec("func", f.func)
+    serialized = list(codec.serialize_return(b"bytes"))
 
-    deserialized = deserialize_return(f.func, iter(serialized))
+    deserialized = codec.deserialize_return(iter(serialized))
     assert deserialized == b"bytes"
 
 
+class Bar:
+    def func(self, data: dict, a: bytes, b: bytes = b"default") -> RPCFuture[bytes]:
+        raise NotImplementedError
+
+
+@pytest.mark.parametrize(
+    "args, kwargs",
+    [
+        (({"a": 1}, b"a", b"b"), {}),
+        (({"a": 1},), {"a": b"a", "b": b"b"}),
+    ],
+)
+def test_method_codec_args(args, kwargs):
+    codec = MethodCodec("func", Bar().func)
+
+    serialized = codec.serialize_args(args, kwargs)
+    assert all(isinstance(f, zmq.Frame) for f in serialized)
+    assert codec.deserialize_args(iter(serialized)) == [{"a": 1}, b"a", b"b"]
+
+
+def test_method_codec_unannotated_args():
+    class Baz:
+        def func(self, data, a: dict):
+            raise NotImplementedError
+
+    codec = MethodCodec("func", Baz().func)
+
+    # argument type doesn't match annotation
+    serialized = codec.serialize_args((b"data", b"a"))
+    assert codec.deserialize_args(iter(serialized)) == [b"data", b"a"]
+
+
+def test_method_codec_applies_defaults():
+    codec = MethodCodec("func", Bar().func)
+
+    serialized = codec.serialize_args(({"a": 1}, b"a"))
+    assert codec.deserialize_args(iter(serialized)) == [{"a": 1}, b"a", b"default"]
+
+
+def test_method_codec():
+    codec = MethodCodec("func", Bar().func)
+    assert codec.wire_name == b"func"
+    assert codec.returns_future
+
+    assert codec.deserialize_return(iter(list(codec.serialize_return(b"ret")))) == b"ret"
+
+    with pytest.raises(ValueError):
+        MethodCodec("func", Bar.func)
+
+
 def test_serialize_deserialize_decorated_method_args():
     f = Foo()
     data = {"a": 1}
     a = b"hello"
-    serialized = list(serialize_args(f.func_dec, [data, a]))
+    codec = MethodCodec("func", f.func_dec)
+    serialized = codec.serialize_args([data, a])
 
     for frame in serialized:
         assert isinstance(frame, zmq.Frame)
 
-    deserialized = deserialize_args(f.func_dec, iter(serialized))
+    deserialized = codec.deserialize_args(iter(serialized))
     assert len(deserialized) == 2
     assert deserialized == [data, a]
 
 
 def test_serialize_deserialize_decorated_method_return():
     f = Foo()
-    serialized = list(serialize_return(f.func_dec, b"bytes"))
+    codec = MethodCodec("func", f.func_dec)
+    serialized = list(codec.serialize_return(b"bytes"))
 
-    deserialized = deserialize_return(f.func_dec, iter(serialized))
+    deserialized = codec.deserialize_return(iter(serialized))
     assert deserialized == b"bytes"
 
 
@@ -202,11 +266,15 @@ class ConcatRPCSrv(IConcatRPC):
     def not_exposed(self) -> None:
         pass
 
+    def shutdown(self) -> None:
+        self.executor.shutdown()
+        raise Shutdown()
+
 
-@pytest.fixture
-def conn_conf():
+@pytest.fixture(params=[Transport.ReqRep, Transport.Pipelined], ids=["reqrep", "pipelined"])
+def conn_conf(request):
     ctx = zmq.Context()
-    return InprocConnConf("test", "pubsub_test", ctx, timeout=2000)
+    return InprocConnConf("test", "pubsub_test", ctx, timeout=2000, transport=request.param)
 
 
 def test_server(spawn):
@@ -326,6 +394,37 @@ def test_rpc_interface_metaclass():
     assert Foo.__exposedmethods__ == {"foo", "bar"}
 
 
+def test_serial_groups_apply_to_implementation():
+    class IFoo(RPCInterface):
+        @exposed
+        @serial
+        def foo(self) -> None:
+            return
+
+        @exposed
+        @serial("state")
+        def set_a(self) -> None:
+            return
+
+        @exposed
+        @serial("state")
+        def set_b(self) -> None:
+            return
+
+        @exposed
+        def bar(self) -> None:
+            return
+
+    class Foo(IFoo):
+        def foo(self):
+            return None
+
+        def set_a(self):
+            return None
+
+    assert get_serial_groups(Foo()) == {"foo": "foo", "set_a": "state", "set_b": "state"}
+
+
 def test_futures(spawn, log_debug):
     executor = ThreadPoolExecutor(max_workers=5, thread_name_prefix="superexecutor")
 
@@ -383,8 +482,484 @@ def test_futures_with_exception(spawn):
         assert f.result(timeout=5) == b"42"
 
 
+class IBusyRPC(RPCInterface):
+    @exposed
+    def busy(self) -> bytes:
+        raise NotImplementedError
+
+    @exposed
+    def busy_async(self) -> RPCFuture[bytes]:
+        raise NotImplementedError
+
+    @exposed
+    def broken(self) -> bytes:
+        raise NotImplementedError
+
+    @exposed
+    def shutdown(self) -> None:
+        raise NotImplementedError
+
+
+class BusyRPC(IBusyRPC):
+    def busy(self) -> bytes:
+        raise Overloaded("queue is full")
+
+    def busy_async(self) -> RPCFuture[bytes]:
+        fut = RPCFuture()
+        fut.set_exception(Overloaded("queue is full"))
+        return fut
+
+    def broken(self) -> bytes:
+        raise ValueError("broken")
+
+    def shutdown(self) -> None:
+        raise Shutdown()
+
+
+def test_overloaded_keeps_its_type(spawn):
+    cl = spawn(IBusyRPC, BusyRPC)
+
+    with pytest.raises(Overloaded, match="^queue is full$"):
+        cl.busy()
+
+    with pytest.raises(Overloaded, match="^queue is full$"):
+        cl.busy_async().result(timeout=5)
+
+    with pytest.raises(CallException, match="^broken$") as exc_info:
+        cl.broken()
+    assert type(exc_info.value) is CallException
+
+
+@pytest.mark.parametrize("exc_type", [Overloaded, DeadlineExceeded, Canceled])
+def test_propagated_errors_keep_their_type(exc_type):
+    _state, *frames = error_frames(exc_type("queue is full"))
+    exc = remote_error(iter(zmq.Frame(frame) for frame in frames))
+    assert type(exc) is exc_type
+    assert str(exc) == "queue is full"
+
+
+def test_shutdown_wakes_up_client_threads(conn_conf, assert_threads_cleanup):
+    srv = Server(ConcatRPCSrv(), conn_conf)
+    srv_thread = Thread(target=srv.listen, name="TestServerThread")
+    srv_thread.start()
+
+    cl = Client(IConcatRPC(), conn_conf)
+    assert cl.concat_async(b"4", b"2").result(timeout=5) == b"42"
+
+    with pytest.raises(Shutdown):
+        cl.shutdown()
+    srv_thread.join()
+
+    threads = [cl._listener]
+    if cl._pipeline is not None:
+        threads.append(cl._pipeline._thread)
+
+    # threads are woken up, they don't wait for poll timeout
+    for t in threads:
+        t.join(timeout=0.1)
+        assert not t.is_alive()
+
+
 def test_isfutureret():
     def foo() -> None:
         return
 
     isfutureret(foo)
+
+
+@pytest.mark.parametrize("conn_conf", [Transport.Pipelined], indirect=True)
+def test_pipelined_requests_share_one_connection(spawn):
+    cl = spawn(IConcatRPC, ConcatRPCSrv)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda i: cl.concat(b"%d" % i, b"!"), range(100)))
+
+    assert results == [b"%d!" % i for i in range(100)]
+    assert cl._pipeline is not None
+    assert pool.key(cl._conn_conf) not in pool._idle, "pipelined client should not create REQ sockets"
+
+
+class ISlowRPC(RPCInterface):
+    @exposed
+    def forward(self) -> bytes:
+        raise NotImplementedError
+
+    @exposed
+    def get_model_state(self) -> bytes:
+        raise NotImplementedError
+
+    @exposed
+    def load_model(self) -> bytes:
+        raise NotImplementedError
+
+    @exposed
+    def shutdown(self) -> None:
+        raise NotImplementedError
+
+
+class SlowRPC(ISlowRPC):
+    def __init__(self):
+        self._lock = Lock()
+        self._running = {}
+        self.max_running = {}
+
+    def _track(self, name, duration):
+        with self._lock:
+            self._running[name] = self._running.get(name, 0) + 1
+            self.max_running[name] = max(self.max_running.get(name, 0), self._running[name])
+
+        sleep(duration)
+
+        with self._lock:
+            self._running[name] -= 1
+
+        return b"%d" % self.max_running[name]
+
+    def forward(self) -> bytes:
+        return b"fwd"
+
+    def get_model_state(self) -> bytes:
+        return self._track("get_model_state", 1.0)
+
+    def load_model(self) -> bytes:
+        return self._track("load_model", 0.05)
+
+    def shutdown(self) -> None:
+        raise Shutdown()
+
+
+def test_long_call_doesnt_delay_fast_calls(spawn):
+    state_started = Event()
+    forwarded = Event()
+
+    class BlockingStateRPC(SlowRPC):
+        def forward(self) -> bytes:
+            forwarded.set()
+            return super().forward()
+
+        def get_model_state(self) -> bytes:
+            state_started.set()
+            # finishes only after the fast call got through
+            return b"1" if forwarded.wait(timeout=5) else b"0"
+
+    cl = spawn(ISlowRPC, BlockingStateRPC, max_workers=4)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        state = executor.submit(cl.get_model_state)
+        assert state_started.wait(timeout=5)
+        assert cl.forward() == b"fwd"
+        assert state.result() == b"1"
+
+
+@pytest.mark.parametrize("transport", [Transport.ReqRep, Transport.Pipelined], ids=["reqrep", "pipelined"])
+def test_transports_share_reply_timeout(transport):
+    # timeout of 1 second, load_model takes 0.05 seconds
+    conn_conf = InprocConnConf("test", "pubsub_test", zmq.Context(), timeout=1, transport=transport)
+    srv = Server(SlowRPC(), conn_conf)
+    srv_thread = Thread(target=srv.listen, name="TestServerThread")
+    srv_thread.start()
+
+    cl = Client(ISlowRPC(), conn_conf)
+    try:
+        assert cl.load_model() == b"1"
+    finally:
+        with pytest.raises(Shutdown):
+            cl.shutdown()
+        srv_thread.join()
+
+
+def test_method_concurrency_limits(spawn):
+    cl = spawn(ISlowRPC, SlowRPC, max_workers=8, serial_methods=["load_model"], method_limits={"get_model_state": 2})
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        serial = [executor.submit(cl.load_model) for _ in range(8)]
+        limited = [executor.submit(cl.get_model_state) for _ in range(4)]
+
+        assert max(int(f.result()) for f in serial) == 1
+        assert max(int(f.result()) for f in limited) == 2
+
+
+def test_unknown_method_limit(conn_conf):
+    with pytest.raises(ValueError):
+        Server(SlowRPC(), conn_conf, max_workers=2, serial_methods=["nonexistent"])
+
+
+class IStreamRPC(RPCInterface):
+    @exposed
+    def count(self, n: bytes) -> Iterator[bytes]:
+        raise NotImplementedError
+
+    @exposed
+    def broken(self) -> Iterator[bytes]:
+        raise NotImplementedError
+
+    @exposed
+    def undeclared(self) -> bytes:
+        raise NotImplementedError
+
+    @exposed
+    def not_a_stream(self) -> Iterator[bytes]:
+        raise NotImplementedError
+
+    @exposed
+    def shutdown(self) -> None:
+        raise NotImplementedError
+
+
+class StreamRPC(IStreamRPC):
+    def __init__(self):
+        self.produced = 0
+        self.closed = Event()
+
+    def count(self, n):
+        try:
+            for i in range(int(n)):
+                self.produced += 1
+                yield b"%d" % i
+        finally:
+            self.closed.set()
+
+    def broken(self):
+        yield b"0"
+        raise ValueError("broken stream")
+
+    def undeclared(self):
+        return iter([b"0"])
+
+    def not_a_stream(self):
+        return b"0"
+
+    def shutdown(self) -> None:
+        raise Shutdown()
+
+
+@pytest.mark.parametrize("max_workers", [0, 2])
+def test_stream(spawn, max_workers):
+    cl = spawn(IStreamRPC, StreamRPC, max_workers=max_workers)
+
+    assert list(cl.count(b"100")) == [b"%d" % i for i in range(100)]
+
+
+def test_stream_error(spawn):
+    cl = spawn(IStreamRPC, StreamRPC)
+    stream = cl.broken()
+
+    assert next(stream) == b"0"
+    with pytest.raises(CallException):
+        next(stream)
+
+
+def test_stream_has_to_be_declared(spawn):
+    cl = spawn(IStreamRPC, StreamRPC)
+
+    with pytest.raises(CallException):
+        cl.undeclared()
+
+    with pytest.raises(CallException):
+        list(cl.not_a_stream())
+
+
+def test_stream_backpressure(spawn):
+    srv = StreamRPC()
+    cl = spawn(IStreamRPC, lambda: srv)
+
+    stream = cl.count(b"1000")
+    assert next(stream) == b"0"
+    sleep(0.3)
+    assert srv.produced == STREAM_WINDOW, "producer should not run ahead of consumer"
+
+    stream.close()
+    assert srv.closed.wait(timeout=2), "closing stream should cancel producer"
+    assert list(stream) == []
+
+
+def test_stream_async_iteration(spawn):
+    cl = spawn(IStreamRPC, StreamRPC)
+
+    async def _collect():
+        return [item async for item in cl.count(b"50")]
+
+    assert asyncio.run(_collect()) == [b"%d" % i for i in range(50)]
+
+
+class IDeadlineRPC(RPCInterface):
+    @exposed
+    def slow(self) -> bytes:
+        raise NotImplementedError
+
+    @exposed
+    def budget(self) -> bytes:
+        raise NotImplementedError
+
+    @exposed
+    def pending(self) -> RPCFuture[bytes]:
+        raise NotImplementedError
+
+    @exposed
+    def shutdown(self) -> None:
+        raise NotImplementedError
+
+
+class DeadlineRPC(IDeadlineRPC):
+    def __init__(self):
+        self.budget_calls = 0
+        self.cancelled = Event()
+
+    def slow(self) -> bytes:
+        sleep(0.3)
+        return b"slow"
+
+    def budget(self) -> bytes:
+        self.budget_calls += 1
+        at = get_deadline()
+        return b"none" if at is None else b"%.3f" % (at - monotonic())
+
+    def pending(self) -> RPCFuture[bytes]:
+        fut = RPCFuture()
+        fut.add_done_callback(lambda f: f.cancelled() and self.cancelled.set())
+        return fut
+
+    def shutdown(self) -> None:
+        raise Shutdown()
+
+
+@pytest.fixture
+def deadline_srv(request, assert_threads_cleanup):
+    ctx = zmq.Context()
+    conf = InprocConnConf(
+        "test_deadline",
+        "pubsub_test_deadline",
+        ctx,
+        timeout=2000,
+        transport=request.param,
+        wire_options=WireOptions(deadlines=True),
+    )
+    api = DeadlineRPC()
+    # calls wait for the worker on server side, not in socket queue
+    srv = Server(api, conf, max_workers=1)
+    t = Thread(target=srv.listen, name="TestServerThread")
+    t.start()
+
+    cl = Client(IDeadlineRPC(), conf)
+    yield cl, srv, api
+
+    with pytest.raises(Shutdown):
+        cl.shutdown()
+    t.join()
+
+
+@pytest.mark.parametrize("deadline_srv", [Transport.ReqRep, Transport.Pipelined], indirect=True)
+def test_deadline_is_carried_to_server(deadline_srv):
+    cl, srv, api = deadline_srv
+
+    assert cl.budget() == b"none"
+    with deadline(5):
+        assert 4 < float(cl.budget()) <= 5
+
+
+@pytest.mark.parametrize("deadline_srv", [Transport.ReqRep, Transport.Pipelined], indirect=True)
+def test_call_past_deadline_is_skipped(deadline_srv):
+    cl, srv, api = deadline_srv
+    cl.budget()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        slow = executor.submit(cl.slow)
+        sleep(0.05)
+
+        with deadline(0.1):
+            with pytest.raises(DeadlineExceeded):
+                cl.budget()
+
+        assert slow.result() == b"slow"
+
+    assert api.budget_calls == 1
+    assert srv.skipped == {"cancelled": 0, "expired": 1}
+
+    with deadline(0):
+        with pytest.raises(DeadlineExceeded):
+            cl.budget()
+
+
+@pytest.mark.parametrize(
+    "options",
+    [WireOptions(shm=True, compression=("zlib",), binary_header=1, deadlines=True, tracing=True), WireOptions()],
+)
+def test_call_options_roundtrip(options):
+    assert decode_call_options(encode_call_options(options)) == options
+    assert decode_call_options(encode_call_options(WireOptions(compression=("unknown",)))) == WireOptions()
+
+
+class IHeaderRPC(RPCInterface):
+    @exposed
+    def describe(self, prefix: bytes) -> bytes:
+        raise NotImplementedError
+
+    @exposed
+    def shutdown(self) -> None:
+        raise NotImplementedError
+
+
+class HeaderRPC(IHeaderRPC):
+    def describe(self, prefix: bytes) -> bytes:
+        at = get_deadline()
+        budget = b"none" if at is None else b"%.3f" % (at - monotonic())
+        return b"%s|%s|%s" % (prefix, budget, (get_trace_id() or "none").encode("ascii"))
+
+    def shutdown(self) -> None:
+        raise Shutdown()
+
+
+@pytest.mark.parametrize(
+    "options",
+    [WireOptions(deadlines=True), WireOptions(tracing=True), WireOptions(deadlines=True, tracing=True)],
+    ids=["deadlines", "tracing", "both"],
+)
+def test_call_of_peer_unknown_to_server(options, assert_threads_cleanup):
+    # peer which handshaked with another server (or was forgotten by this one) sends optional frames anyway
+    ctx = zmq.Context()
+    conf = InprocConnConf(
+        "test_unknown_peer",
+        "pubsub_test_unknown_peer",
+        ctx,
+        timeout=2000,
+        transport=Transport.Pipelined,
+        wire_options=options,
+    )
+    t = Thread(target=Server(HeaderRPC(), conf).listen, name="TestServerThread")
+    t.start()
+
+    dealer = ctx.socket(zmq.DEALER)
+    dealer.setsockopt(zmq.LINGER, 0)
+    dealer.connect(conf.get_conn_str())
+    codec = MethodCodec("describe", HeaderRPC().describe)
+    try:
+        with deadline(5), traced("trace-1"):
+            header = make_call_header(codec, b"call-1", options, get_deadline())
+        dealer.send_multipart([*header, *codec.serialize_args((b"arg",))])
+
+        assert dealer.poll(2000)
+        _id, _mode, state, *ret = dealer.recv_multipart(copy=False)
+        assert state.bytes == State.Return.value
+        prefix, budget, trace_id = codec.deserialize_return(iter(ret)).split(b"|")
+        assert prefix == b"arg"
+        if options.deadlines:
+            assert 4 < float(budget) <= 5
+        else:
+            assert budget == b"none"
+        assert trace_id == (b"trace-1" if options.tracing else b"none")
+    finally:
+        dealer.close()
+        with pytest.raises(Shutdown):
+            Client(IHeaderRPC(), conf).shutdown()
+        t.join()
+
+
+@pytest.mark.parametrize("deadline_srv", [Transport.ReqRep, Transport.Pipelined], indirect=True)
+def test_cancelling_future_cancels_it_on_server(deadline_srv):
+    cl, srv, api = deadline_srv
+
+    fut = cl.pending()
+    assert fut.cancel()
+
+    assert api.cancelled.wait(timeout=2)
+    assert srv.skipped == {"cancelled": 1, "expired": 0}
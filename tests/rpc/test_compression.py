@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pytest
+
+from tiktorch.rpc import WireOptions, compression
+from tiktorch.types import NDArray
+
+
+@pytest.fixture
+def stats():
+    compression.stats.reset()
+    yield compression.stats
+    compression.stats.reset()
+
+
+def test_stdlib_codecs_available():
+    assert {"zlib", "lzma"} <= set(compression.available())
+
+
+@pytest.mark.parametrize(
+    "offered, supported, expected",
+    [
+        (["lz4", "zlib"], ["zlib", "lzma"], "zlib"),
+        (["lzma", "zlib"], ["zlib", "lzma"], "lzma"),
+        (["unknown"], ["unknown"], None),
+        ([], ["zlib"], None),
+    ],
+)
+def test_negotiate(offered, supported, expected):
+    assert compression.negotiate(offered, supported) == expected
+
+
+@pytest.mark.parametrize("codec", compression.available())
+def test_roundtrip(codec, stats):
+    data = np.zeros((128, 128), dtype=np.float32)
+
+    compressed = compression.compress(codec, data)
+    assert compressed is not None
+    assert compression.decompress(codec, compressed) == data.tobytes()
+
+    counters = stats.snapshot()[codec]
+    assert counters["frames"] == 1
+    assert counters["bytes_in"] == data.nbytes
+    assert counters["bytes_out"] == len(compressed)
+    assert counters["decompressed"] == 1
+
+
+def test_small_and_incompressible_frames_are_skipped(stats):
+    assert compression.compress("zlib", b"\0" * (compression.MIN_SIZE - 1)) is None
+    assert compression.compress("zlib", os.urandom(compression.MIN_SIZE * 2)) is None
+
+    assert stats.snapshot()["zlib"] == {"frames": 0, "skipped": 2, "bytes_in": 0, "bytes_out": 0, "decompressed": 0}
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        compression.decompress("unknown", b"")
+
+
+@pytest.mark.parametrize(
+    "server_codecs, client_codecs, expected",
+    [(("zlib", "lzma"), ("lzma", "zlib"), ("lzma",)), (("zlib",), ("lzma",), ()), ((), ("zlib",), ())],
+)
+def test_compression_negotiation(negotiate, server_codecs, client_codecs, expected):
+    cl = negotiate(WireOptions(compression=server_codecs), WireOptions(compression=client_codecs))
+    assert cl.wire_options.compression == expected
+
+    arr = NDArray(np.zeros((128, 128), dtype=np.float32), id_=(1,))
+    for res in [cl.add_one(arr), cl.add_one_async(arr).result(timeout=2)]:
+        np.testing.assert_array_equal(res.as_numpy(), arr.as_numpy() + 1)
@@ -0,0 +1,95 @@
+import errno
+import os
+import socket
+import threading
+
+import pytest
+import zmq
+
+from tiktorch.rpc import Client, IPCConnConf, RPCInterface, Server, Shutdown, exposed
+
+pytestmark = pytest.mark.skipif(not zmq.has("ipc"), reason="ipc transport is not supported")
+
+
+class IEcho(RPCInterface):
+    @exposed
+    def echo(self, value: bytes) -> bytes:
+        raise NotImplementedError
+
+    @exposed
+    def shutdown(self) -> None:
+        raise NotImplementedError
+
+
+class Echo(IEcho):
+    def echo(self, value: bytes) -> bytes:
+        return value
+
+    def shutdown(self) -> None:
+        raise Shutdown()
+
+
+@pytest.fixture
+def conf(tmp_path):
+    return IPCConnConf(str(tmp_path / "sockets" / "rpc"), timeout=2000, ctx=zmq.Context())
+
+
+def serve(conf):
+    srv = Server(Echo(), conf)
+    t = threading.Thread(target=srv.listen, name="TestServerThread")
+    t.start()
+    return t
+
+
+def shutdown(conf, t):
+    with pytest.raises(Shutdown):
+        Client(IEcho(), conf).shutdown()
+    t.join()
+
+
+def test_call_over_ipc(conf):
+    t = serve(conf)
+    assert os.path.exists(conf.path)
+
+    assert Client(IEcho(), conf).echo(b"x" * 1000) == b"x" * 1000
+
+    shutdown(conf, t)
+    assert not os.path.exists(conf.path)
+    assert not os.path.exists(conf.pubsub_path)
+
+
+def test_stale_socket_file_is_replaced(conf):
+    os.makedirs(os.path.dirname(conf.path))
+    # left behind by server which was killed
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+        stale.bind(conf.path)
+
+    t = serve(conf)
+    assert Client(IEcho(), conf).echo(b"ping") == b"ping"
+    shutdown(conf, t)
+
+
+def test_running_server_is_not_replaced(conf):
+    t = serve(conf)
+
+    with pytest.raises(zmq.ZMQError) as exc_info:
+        Server(Echo(), conf)
+    assert exc_info.value.errno == errno.EADDRINUSE
+
+    assert Client(IEcho(), conf).echo(b"ping") == b"ping"
+    shutdown(conf, t)
+
+
+def test_other_files_are_not_removed(conf):
+    os.makedirs(os.path.dirname(conf.path))
+    with open(conf.path, "w") as f:
+        f.write("data")
+
+    with pytest.raises(FileExistsError):
+        Server(Echo(), conf)
+    assert os.path.exists(conf.path)
+
+
+def test_too_long_path_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        IPCConnConf(str(tmp_path / ("x" * 200)))
@@ -0,0 +1,195 @@
+import threading
+import time
+from multiprocessing import Pipe
+
+import pytest
+import zmq
+
+from tiktorch.rpc import Client, InprocConnConf, RPCFuture, RPCInterface, Server, Shutdown, exposed
+from tiktorch.rpc.metrics import Histogram, merge, registry, split
+from tiktorch.rpc.mp import MPServer, create_client
+
+
+class IMetered(RPCInterface):
+    @exposed
+    def echo(self, value: bytes) -> bytes:
+        raise NotImplementedError
+
+    @exposed
+    def fail(self) -> None:
+        raise NotImplementedError
+
+    @exposed
+    def pending(self) -> RPCFuture[bytes]:
+        raise NotImplementedError
+
+    @exposed
+    def shutdown(self) -> None:
+        raise NotImplementedError
+
+
+class Metered(IMetered):
+    def __init__(self):
+        self.fut = RPCFuture()
+
+    def echo(self, value: bytes) -> bytes:
+        return value
+
+    def fail(self) -> None:
+        raise Exception("fail")
+
+    def pending(self) -> RPCFuture[bytes]:
+        return self.fut
+
+    def shutdown(self) -> None:
+        raise Shutdown()
+
+
+class MPMetered(Metered):
+    def shutdown(self) -> Shutdown:
+        return Shutdown()
+
+
+def wait_until_finished(stats, timeout=2):
+    # done callbacks of futures may still run after result() returns
+    start = time.monotonic()
+    while stats.as_dict()["in_flight"] and time.monotonic() - start < timeout:
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def fresh_registry():
+    registry.reset()
+    yield registry
+    registry.reset()
+
+
+@pytest.fixture
+def zmq_srv(fresh_registry):
+    conf = InprocConnConf("metrics", "metrics_notify", zmq.Context(), timeout=2000)
+    api = Metered()
+    srv = Server(api, conf)
+    t = threading.Thread(target=srv.listen, name="TestServerThread")
+    t.start()
+
+    cl = Client(IMetered(), conf)
+    yield cl, srv, api
+
+    with pytest.raises(Shutdown):
+        cl.shutdown()
+    t.join()
+
+
+@pytest.fixture
+def mp_srv(fresh_registry):
+    client_conn, server_conn = Pipe()
+    api = MPMetered()
+    srv = MPServer(api, server_conn)
+    t = threading.Thread(target=srv.listen, name="TestServerThread")
+    t.start()
+
+    cl = create_client(IMetered, client_conn, timeout=10)
+    yield cl, srv, api
+
+    cl.shutdown()
+    t.join()
+
+
+@pytest.mark.parametrize("value", [0, 1, 15, 16, 17, 100, 1000, 123456, 2**30])
+def test_histogram_bucket_contains_value(value):
+    idx = Histogram.index(value)
+    assert Histogram.lowest(idx) <= value < Histogram.lowest(idx + 1)
+    # relative error stays within a bucket
+    assert Histogram.lowest(idx + 1) - Histogram.lowest(idx) <= max(1, value / 8)
+
+
+def test_histogram_percentiles():
+    hist = Histogram()
+    for value in range(1, 1001):
+        hist.record(value)
+
+    assert hist.count == 1000
+    assert hist.min == 1 and hist.max == 1000
+    assert 500 <= hist.percentile(50) < 500 * 1.125
+    assert 990 <= hist.percentile(99) <= 1000
+    assert hist.percentile(100) == 1000
+
+
+def test_histogram_roundtrips_through_dict():
+    hist = Histogram()
+    for value in [3, 40, 40, 5000]:
+        hist.record(value)
+
+    data = hist.as_dict()
+    assert Histogram.from_dict(data).as_dict() == data
+
+
+def test_merge_adds_up_stats():
+    hist = Histogram()
+    hist.record(10)
+    stats = {"count": 1, "errors": 0, "in_flight": 1, "bytes_in": 5, "bytes_out": 7, "latency_us": hist.as_dict()}
+    snapshot = {"servers": {"Api": {"foo": stats}}, "clients": {}}
+
+    merged = merge([snapshot, snapshot])["servers"]["Api"]["foo"]
+    assert merged["count"] == 2
+    assert merged["in_flight"] == 2
+    assert merged["bytes_in"] == 10
+    assert merged["latency_us"]["count"] == 2
+    # inputs are left untouched
+    assert stats["count"] == 1
+
+
+def test_split():
+    assert split(10, 3) == [4, 3, 3]
+    assert sum(split(7, 7)) == 7
+
+
+def test_server_and_client_count_calls(zmq_srv):
+    cl, srv, api = zmq_srv
+
+    assert cl.echo(b"x" * 100) == b"x" * 100
+    with pytest.raises(Exception):
+        cl.fail()
+
+    fut = cl.pending()
+    for metrics in (cl.metrics, srv.metrics):
+        assert metrics["pending"].as_dict()["in_flight"] == 1
+
+    api.fut.set_result(b"done")
+    assert fut.result(timeout=2) == b"done"
+
+    for metrics in (cl.metrics, srv.metrics):
+        wait_until_finished(metrics["pending"])
+        stats = metrics.snapshot()
+        assert stats["echo"]["count"] == 1
+        assert stats["echo"]["errors"] == 0
+        assert stats["echo"]["bytes_in"] > 100 and stats["echo"]["bytes_out"] > 100
+        assert stats["echo"]["latency_us"]["count"] == 1
+        assert stats["fail"]["errors"] == 1
+        assert stats["pending"]["count"] == 1 and stats["pending"]["in_flight"] == 0
+
+    snapshot = registry.snapshot()
+    assert snapshot["servers"]["Metered"]["echo"]["count"] == 1
+    assert snapshot["clients"]["IMetered"]["echo"]["count"] == 1
+
+
+def test_mp_server_and_client_count_calls(mp_srv):
+    cl, srv, api = mp_srv
+
+    assert cl.echo(b"x" * 100) == b"x" * 100
+    with pytest.raises(Exception):
+        cl.fail()
+
+    fut = cl.pending()
+    api.fut.set_result(b"done")
+    assert fut.result(timeout=2) == b"done"
+
+    wait_until_finished(registry.client("IMetered")["pending"])
+    snapshot = registry.snapshot()
+    for stats in (snapshot["clients"]["IMetered"], snapshot["servers"]["MPMetered"]):
+        assert stats["echo"]["count"] == 1
+        assert stats["echo"]["bytes_in"] > 100 and stats["echo"]["bytes_out"] > 100
+        assert stats["fail"]["errors"] == 1
+        assert stats["pending"]["count"] == 1 and stats["pending"]["in_flight"] == 0
+
+    assert srv.metrics["echo"].as_dict()["count"] == 1
@@ -1,15 +1,17 @@
 import multiprocessing as mp
+import pickle
 import queue
 import threading
 import time
 from collections import namedtuple
 from concurrent.futures import CancelledError, Future, TimeoutError
+from typing import Iterator, List
 
 import pytest
 
 from tiktorch import log
-from tiktorch.rpc import RPCFuture, RPCInterface, Shutdown, exposed
-from tiktorch.rpc.mp import FutureStore, MPClient, MPServer, create_client
+from tiktorch.rpc import DeadlineExceeded, RPCFuture, RPCInterface, Shutdown, deadline, exposed, serial
+from tiktorch.rpc.mp import Cancellation, FutureStore, MethodCall, MPClient, MPServer, create_client, unbatch
 
 
 class ITestApi(RPCInterface):
@@ -29,6 +31,14 @@ class ITestApi(RPCInterface):
     def broken(self, a, b):
         raise NotImplementedError
 
+    @exposed
+    def count(self, n: int, fail_at: int = -1) -> Iterator[int]:
+        raise NotImplementedError
+
+    @exposed
+    def undeclared(self, n: int) -> int:
+        raise NotImplementedError
+
     @exposed
     def shutdown(self) -> RPCFuture[Shutdown]:
         raise Shutdown()
@@ -48,6 +58,15 @@ class ApiImpl(ITestApi):
         f.set_result(f"test {a + b}")
         return f
 
+    def count(self, n, fail_at=-1):
+        for i in range(n):
+            if i == fail_at:
+                raise ValueError("broken stream")
+            yield i
+
+    def undeclared(self, n):
+        return iter(range(n))
+
     def shutdown(self) -> Future:
         return Shutdown()
 
@@ -91,6 +110,230 @@ def test_future(client: ITestApi):
     assert res.result() == "test 3"
 
 
+def test_stream(client: ITestApi):
+    assert list(client.count(100)) == list(range(100))
+
+
+def test_stream_error(client: ITestApi):
+    stream = client.count(10, fail_at=3)
+
+    assert [next(stream) for _ in range(3)] == [0, 1, 2]
+    with pytest.raises(ValueError):
+        next(stream)
+
+
+def test_undeclared_stream_raises(client: ITestApi):
+    with pytest.raises(TypeError):
+        client.undeclared(3)
+
+    assert client.compute(1, 2) == "test 3"
+
+
+def test_call_past_deadline_is_skipped(client: ITestApi):
+    slow = client.compute.async_(1, 2)
+    with deadline(0.1):
+        fast = client.fast_compute.async_(1, 2)
+
+    with pytest.raises(DeadlineExceeded):
+        fast.result()
+
+    assert slow.result() == "test 3"
+
+    with deadline(0):
+        with pytest.raises(DeadlineExceeded):
+            client.fast_compute(1, 2)
+
+
+def test_stream_close(client: ITestApi):
+    with client.count(1000) as stream:
+        assert next(stream) == 0
+
+    assert list(stream) == []
+    assert client.compute(1, 2) == "test 3"
+
+
+def test_server_stops_when_pipe_is_closed():
+    child, parent = mp.Pipe()
+    srv = MPServer(ApiImpl(), parent)
+    t = threading.Thread(target=srv.listen, name="TestMPServer")
+    t.start()
+
+    child.close()
+    t.join(timeout=1)
+    assert not t.is_alive()
+
+
+def test_server_skips_unreadable_payload():
+    child, parent = mp.Pipe()
+    srv = MPServer(ApiImpl(), parent)
+    t = threading.Thread(target=srv.listen, name="TestMPServer")
+    t.start()
+
+    child.send_bytes(b"")
+    child.send_bytes(b"not a pickle")
+    child.send(MethodCall(1, "fast_compute", (1, 1), {}))
+    assert child.poll(timeout=5)
+    assert unbatch(child.recv())[0].result.value == "test 2"
+
+    child.close()
+    t.join(timeout=1)
+    assert not t.is_alive()
+
+
+def test_calls_after_client_shutdown_fail():
+    child, parent = mp.Pipe()
+    client = MPClient("test", child, timeout=10)
+    client._shutdown()
+
+    with pytest.raises(Shutdown):
+        client._invoke("fast_compute", 1, 1).result(timeout=1)
+
+    with pytest.raises(Shutdown):
+        list(client._invoke_stream("count", 3))
+
+    assert not parent.poll(timeout=0.1)
+    parent.close()
+
+
+def test_messages_pickle_as_constructor_args():
+    msg = MethodCall(1, "compute", (1,), {"b": 2}, deadline=3.0)
+    restored = pickle.loads(pickle.dumps(msg))
+
+    assert not hasattr(restored, "__dict__")
+    assert restored.id == 1
+    assert restored.method_name == "compute"
+    assert restored.args == (1,)
+    assert restored.kwargs == {"b": 2}
+    assert restored.deadline == 3.0
+    assert pickle.loads(pickle.dumps(Cancellation(4))).id == 4
+
+
+def test_server_handles_coalesced_messages():
+    child, parent = mp.Pipe()
+    srv = MPServer(ApiImpl(), parent)
+    t = threading.Thread(target=srv.listen, name="TestMPServer")
+    t.start()
+
+    child.send([MethodCall(i, "fast_compute", (i, 1), {}) for i in range(10)])
+    results = {}
+    while len(results) < 10:
+        for msg in unbatch(child.recv()):
+            results[msg.id] = msg.result.value
+
+    assert results == {i: f"test {i + 1}" for i in range(10)}
+
+    child.close()
+    t.join(timeout=1)
+
+
+class IConcurrentApi(RPCInterface):
+    @exposed
+    def block(self) -> None:
+        raise NotImplementedError
+
+    @exposed
+    def release(self) -> None:
+        raise NotImplementedError
+
+    @exposed
+    def fast(self) -> int:
+        raise NotImplementedError
+
+    @exposed
+    @serial("log")
+    def append(self, value: int, delay: float) -> None:
+        raise NotImplementedError
+
+    @exposed
+    @serial("log")
+    def get_log(self) -> List[int]:
+        raise NotImplementedError
+
+    @exposed
+    def shutdown(self) -> Shutdown:
+        raise NotImplementedError
+
+
+class ConcurrentApi(IConcurrentApi):
+    def __init__(self):
+        self._released = threading.Event()
+        self._log = []
+
+    def block(self):
+        assert self._released.wait(timeout=5)
+
+    def release(self):
+        self._released.set()
+
+    def fast(self):
+        return 42
+
+    def append(self, value, delay):
+        time.sleep(delay)
+        self._log.append(value)
+
+    def get_log(self):
+        return self._log
+
+    def shutdown(self):
+        return Shutdown()
+
+
+@pytest.fixture
+def concurrent_srv():
+    data = {}
+
+    def _start(max_workers):
+        child, parent = mp.Pipe()
+        api = ConcurrentApi()
+        srv = MPServer(api, parent, max_workers=max_workers)
+        data["thread"] = t = threading.Thread(target=srv.listen, name="TestMPServer")
+        t.start()
+        data["client"] = create_client(IConcurrentApi, child, timeout=10)
+        return data["client"], srv, api
+
+    yield _start
+
+    data["client"].shutdown()
+    data["thread"].join(timeout=5)
+    assert not data["thread"].is_alive()
+
+
+def test_blocking_call_doesnt_block_others(concurrent_srv):
+    client, _, _ = concurrent_srv(max_workers=2)
+
+    blocked = client.block.async_()
+    assert client.fast() == 42
+    assert not blocked.done()
+
+    client.release()
+    blocked.result(timeout=5)
+
+
+def test_serial_methods_keep_order(concurrent_srv):
+    client, _, _ = concurrent_srv(max_workers=4)
+
+    futs = [client.append.async_(i, (10 - i) / 1000) for i in range(10)]
+    for fut in futs:
+        fut.result(timeout=5)
+
+    assert client.get_log() == list(range(10))
+
+
+def test_cancelled_queued_call_is_skipped(concurrent_srv):
+    client, srv, api = concurrent_srv(max_workers=1)
+
+    blocked = client.block.async_()
+    queued = client.fast.async_()
+    queued.cancel()
+    # cancellation is processed by receiving loop while the only worker is busy
+    time.sleep(0.1)
+    api.release()
+    blocked.result(timeout=5)
+
+    assert srv.skipped == {"cancelled": 1, "expired": 0}
+
+
 def test_race_condition(log_queue):
     class SlowConn:
         def __init__(self, conn):
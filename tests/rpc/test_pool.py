@@ -0,0 +1,151 @@
+import threading
+import time
+
+import pytest
+import zmq
+
+from tiktorch.rpc import Client, InprocConnConf, RPCInterface, Server, Shutdown, Timeout, WireOptions, exposed
+from tiktorch.rpc.pool import SocketPool
+
+
+class IPooled(RPCInterface):
+    @exposed
+    def echo(self, value: bytes) -> bytes:
+        raise NotImplementedError
+
+    @exposed
+    def sleep(self, seconds: float) -> None:
+        raise NotImplementedError
+
+    @exposed
+    def shutdown(self) -> None:
+        raise NotImplementedError
+
+
+class Pooled(IPooled):
+    def echo(self, value: bytes) -> bytes:
+        return value
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+    def shutdown(self) -> None:
+        raise Shutdown()
+
+
+@pytest.fixture
+def socket_pool():
+    socket_pool = SocketPool(max_idle_per_key=2, max_idle=3, idle_timeout=60)
+    yield socket_pool
+    socket_pool.close()
+
+
+@pytest.fixture
+def conf():
+    conf = InprocConnConf("pool", "pool_notify", zmq.Context(), timeout=500)
+    srv = Server(Pooled(), conf)
+    t = threading.Thread(target=srv.listen, name="TestServerThread")
+    t.start()
+
+    yield conf
+
+    # shutdown closes sockets of the connection
+    with pytest.raises(Shutdown):
+        Client(IPooled(), conf).shutdown()
+    t.join()
+
+
+def test_clients_share_sockets(conf, socket_pool):
+    for _ in range(10):
+        assert Client(IPooled(), conf, socket_pool=socket_pool).echo(b"ping") == b"ping"
+
+    stats = socket_pool.stats()
+    assert stats["created"] == 1
+    assert stats["reused"] == 10
+    assert stats["idle"] == 1
+
+
+def test_concurrent_requests_use_separate_sockets(conf, socket_pool):
+    cl = Client(IPooled(), conf, socket_pool=socket_pool)
+    threads = [threading.Thread(target=cl.sleep, args=(0.2,)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    stats = socket_pool.stats()
+    assert stats["created"] == 4
+    # only max_idle_per_key are kept
+    assert stats["idle"] == 2
+    assert stats["evicted"] == 2
+
+
+def test_idle_sockets_are_bounded_in_total(socket_pool):
+    ctx = zmq.Context()
+    confs = [InprocConnConf(f"pool-{idx}", f"pool-{idx}-notify", ctx, timeout=500) for idx in range(5)]
+    for conf in confs:
+        entry = socket_pool.acquire(conf, lambda sock: WireOptions())
+        socket_pool.release(entry)
+
+    assert socket_pool.stats()["idle"] == 3
+    # least recently released are closed first
+    assert socket_pool.key(confs[0]) not in socket_pool._idle
+    assert socket_pool.key(confs[-1]) in socket_pool._idle
+
+
+def test_idle_sockets_expire(conf, socket_pool):
+    socket_pool.idle_timeout = 0.05
+    cl = Client(IPooled(), conf, socket_pool=socket_pool)
+    cl.echo(b"ping")
+    time.sleep(0.1)
+    cl.echo(b"ping")
+
+    stats = socket_pool.stats()
+    assert stats["created"] == 2
+    assert stats["evicted"] == 1
+
+
+def test_failed_socket_is_discarded(conf, socket_pool):
+    with pytest.raises(Timeout):
+        with socket_pool.socket(conf, lambda sock: WireOptions()) as entry:
+            raise Timeout()
+
+    assert entry.socket.closed
+    assert socket_pool.stats()["idle"] == 0
+
+
+def test_socket_waiting_for_reply_is_not_reused(socket_pool):
+    conf = InprocConnConf("pool-unbound", "pool-unbound-notify", zmq.Context(), timeout=500)
+    entry = socket_pool.acquire(conf, lambda sock: WireOptions())
+    # REQ socket can't send until it receives reply
+    entry.socket.send(b"request")
+    socket_pool.release(entry)
+
+    assert entry.socket.closed
+    assert socket_pool.stats()["discarded"] == 1
+
+
+def test_unhealthy_idle_socket_is_replaced(conf, socket_pool):
+    cl = Client(IPooled(), conf, socket_pool=socket_pool)
+    cl.echo(b"ping")
+    socket_pool._idle[socket_pool.key(conf)][0].socket.close()
+
+    assert cl.echo(b"ping") == b"ping"
+    stats = socket_pool.stats()
+    assert stats["created"] == 2
+    assert stats["discarded"] == 1
+
+
+def test_shutdown_clears_sockets_of_connection(socket_pool):
+    conf = InprocConnConf("pool-shutdown", "pool-shutdown-notify", zmq.Context(), timeout=500)
+    srv = Server(Pooled(), conf)
+    t = threading.Thread(target=srv.listen, name="TestServerThread")
+    t.start()
+
+    cl = Client(IPooled(), conf, socket_pool=socket_pool)
+    cl.echo(b"ping")
+    with pytest.raises(Shutdown):
+        cl.shutdown()
+    t.join()
+
+    assert socket_pool.stats()["idle"] == 0
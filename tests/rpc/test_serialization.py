@@ -2,10 +2,22 @@ import json
 from itertools import chain
 from typing import Iterator
 
+import numpy as np
 import pytest
 import zmq
 
-from tiktorch.rpc.serialization import DeserializationError, ISerializer, SerializerRegistry, deserialize, serialize
+from tiktorch.rpc.serialization import (
+    BINARY_MARKER,
+    DeserializationError,
+    IBinarySerializer,
+    ISerializer,
+    SerializerRegistry,
+    WireOptions,
+    deserialize,
+    serialize,
+    wire_options,
+)
+from tiktorch.types import NDArray
 
 
 class Foo:
@@ -122,3 +134,46 @@ def test_tuple_serialization():
     data = (1, 2, 3, 42, 5)
     serialized = serialize(data)
     assert deserialize(serialized) == data
+
+
+class BinaryBarSerializer(BarSerializer, IBinarySerializer[Bar]):
+    @classmethod
+    def serialize_binary(cls, obj: Bar, version: int):
+        return bytes((obj.b, obj.c)), []
+
+    @classmethod
+    def deserialize_binary(cls, header: memoryview, version: int, frames: Iterator[zmq.Frame]) -> Bar:
+        return Bar(b=header[0], c=header[1])
+
+
+def test_binary_header_requires_negotiation(ser):
+    ser.register(Bar, tag=b"bar", code=7)(BinaryBarSerializer)
+
+    assert [frame.bytes for frame in ser.serialize(Bar(b=42, c=21))] == [b"T:bar", b"*", b"\x15"]
+
+    with wire_options(WireOptions(binary_header=1)):
+        frames = list(ser.serialize(Bar(b=42, c=21)))
+
+    assert [frame.bytes for frame in frames] == [bytes((BINARY_MARKER, 7, 1, 42, 21))]
+    assert ser.deserialize(iter(frames)) == Bar(b=42, c=21)
+
+
+def test_binary_header_unknown_type_code_raises(ser):
+    with pytest.raises(NotImplementedError):
+        ser.deserialize(iter([zmq.Frame(bytes((BINARY_MARKER, 7, 1)))]))
+
+
+@pytest.mark.parametrize("server_version, client_version, expected", [(1, 1, 1), (1, 0, 0), (0, 1, 0), (1, 5, 1)])
+def test_binary_header_negotiation(negotiate, server_version, client_version, expected):
+    cl = negotiate(WireOptions(binary_header=server_version), WireOptions(binary_header=client_version))
+    assert cl.wire_options.binary_header == expected
+
+    arr = NDArray(np.random.rand(8, 8).astype(np.float32), id_=(4, 2))
+    for res in [cl.add_one(arr), cl.add_one_async(arr).result(timeout=2)]:
+        np.testing.assert_array_equal(res.as_numpy(), arr.as_numpy() + 1)
+        assert res.id == (4, 2)
+
+
+def test_type_code_requires_binary_serializer(ser):
+    with pytest.raises(TypeError):
+        ser.register(Bar, tag=b"bar", code=7)(BarSerializer)
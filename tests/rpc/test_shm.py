@@ -0,0 +1,98 @@
+import os
+
+import numpy as np
+import pytest
+
+from tiktorch.rpc import WireOptions, shm
+from tiktorch.types import NDArray
+
+pytestmark = pytest.mark.skipif(not shm.is_available(), reason="shared memory requires python 3.8+")
+
+
+def _exists(name):
+    return os.path.exists(os.path.join(shm.SHM_DIR, name))
+
+
+def _take_array(name, like):
+    data = shm.take(name, like.nbytes)
+    return np.frombuffer(data, dtype=like.dtype).reshape(like.shape)
+
+
+@pytest.fixture
+def pool():
+    pool = shm._Pool(max_segments=2, ttl=10)
+    yield pool
+    pool.close()
+
+
+def test_put_take():
+    arr = np.random.rand(64, 32)
+    name = shm.put(arr)
+
+    np.testing.assert_array_equal(_take_array(name, arr), arr)
+
+
+def test_put_non_contiguous():
+    arr = np.arange(100, dtype=np.int64).reshape(10, 10)[:, ::2]
+
+    np.testing.assert_array_equal(_take_array(shm.put(arr), arr), arr)
+
+
+def test_released_segment_is_reused(pool):
+    arr = np.ones(1000)
+    name = pool.put(arr)
+    assert pool.put(arr) != name, "segment in flight should not be reused"
+
+    shm.take(name, arr.nbytes)
+    assert pool.put(arr) == name
+
+
+def test_exhausted_pool_returns_none(pool):
+    arr = np.ones(1000)
+    assert pool.put(arr) is not None
+    assert pool.put(arr) is not None
+    assert pool.put(arr) is None
+
+
+def test_close_unlinks_segments(pool):
+    name = pool.put(np.ones(10))
+    assert _exists(name)
+
+    pool.close()
+    assert not _exists(name)
+
+
+def test_probe():
+    with shm.probe() as (name, token):
+        assert shm.check_probe(name, token)
+        assert not shm.check_probe(name, "wrong")
+
+    assert not shm.check_probe(name, token)
+
+
+@pytest.mark.skipif(not os.path.isdir(shm.SHM_DIR), reason="requires /dev/shm")
+def test_reclaim_stale():
+    # pid of finished child process
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    stale = shm.shared_memory.SharedMemory(name=f"{shm.PREFIX}_{pid}_deadbeef", create=True, size=16)
+    shm._untrack(stale).close()
+    alive = shm.put(np.zeros(4))
+
+    shm.reclaim_stale()
+    assert not _exists(stale.name)
+    assert _exists(alive)
+
+
+@pytest.mark.parametrize("server_shm, client_shm", [(True, True), (True, False), (False, True)])
+def test_shared_memory_negotiation(negotiate, server_shm, client_shm):
+    cl = negotiate(WireOptions(shm=server_shm), WireOptions(shm=client_shm))
+    assert cl.wire_options.shm == (server_shm and client_shm)
+
+    arr = NDArray(np.random.rand(128, 128).astype(np.float32), id_=(1,))
+    for res in [cl.add_one(arr), cl.add_one_async(arr).result(timeout=2)]:
+        np.testing.assert_array_equal(res.as_numpy(), arr.as_numpy() + 1)
+        assert res.id == (1,)
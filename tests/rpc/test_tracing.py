@@ -0,0 +1,142 @@
+import json
+import pickle
+import threading
+from multiprocessing import Pipe
+
+import pytest
+import zmq
+
+from tiktorch.rpc import Client, InprocConnConf, RPCFuture, RPCInterface, Server, Shutdown, WireOptions, exposed
+from tiktorch.rpc import tracing
+from tiktorch.rpc.mp import MethodCall, MPServer, create_client
+
+
+class ITraced(RPCInterface):
+    @exposed
+    def trace_id(self) -> str:
+        raise NotImplementedError
+
+    @exposed
+    def trace_id_async(self) -> RPCFuture[str]:
+        raise NotImplementedError
+
+    @exposed
+    def shutdown(self) -> None:
+        raise NotImplementedError
+
+
+class Traced(ITraced):
+    def trace_id(self) -> str:
+        return tracing.get_trace_id()
+
+    def trace_id_async(self) -> RPCFuture[str]:
+        fut = RPCFuture()
+        fut.set_result(tracing.get_trace_id())
+        return fut
+
+    def shutdown(self) -> None:
+        raise Shutdown()
+
+
+class MPTraced(Traced):
+    def shutdown(self) -> Shutdown:
+        return Shutdown()
+
+
+@pytest.fixture
+def trace_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv(tracing.TRACE_DIR_ENV, str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def client():
+    conf = InprocConnConf(
+        "tracing", "tracing_notify", zmq.Context(), timeout=2000, wire_options=WireOptions(tracing=True)
+    )
+    srv = Server(Traced(), conf)
+    t = threading.Thread(target=srv.listen, name="TestServerThread")
+    t.start()
+
+    cl = Client(ITraced(), conf)
+    yield cl
+
+    with pytest.raises(Shutdown):
+        cl.shutdown()
+    t.join()
+
+
+@pytest.fixture
+def mp_client():
+    client_conn, server_conn = Pipe()
+    t = threading.Thread(target=MPServer(MPTraced(), server_conn).listen, name="TestServerThread")
+    t.start()
+
+    cl = create_client(ITraced, client_conn, timeout=10)
+    yield cl
+
+    cl.shutdown()
+    t.join()
+
+
+def load_events(trace_dir, tmp_path):
+    tracing.flush()
+    output = tmp_path / "trace.json"
+    tracing.merge(str(trace_dir), str(output))
+    with output.open() as f:
+        return [event for event in json.load(f)["traceEvents"] if event["ph"] == "X"]
+
+
+def test_trace_id_is_carried_to_server(client):
+    assert client.trace_id() is None
+
+    with tracing.traced("abc"):
+        assert client.trace_id() == "abc"
+        assert client.trace_id_async().result(timeout=2) == "abc"
+
+
+def test_trace_id_is_carried_over_pipe(mp_client):
+    assert mp_client.trace_id() is None
+
+    with tracing.traced("abc"):
+        assert mp_client.trace_id() == "abc"
+
+
+def test_method_call_pickles_trace_id():
+    call = pickle.loads(pickle.dumps(MethodCall(1, "foo", (), {}, None, "abc")))
+    assert call.trace_id == "abc"
+
+
+def test_untraced_calls_start_new_trace(trace_dir, client):
+    first, second = client.trace_id(), client.trace_id()
+    assert first and second and first != second
+
+
+def test_spans_of_both_sides_are_recorded(trace_dir, tmp_path, client):
+    trace_id = client.trace_id()
+
+    events = [event for event in load_events(trace_dir, tmp_path) if event["args"]["trace_id"] == trace_id]
+    names = {event["name"] for event in events}
+    assert {"call trace_id", "serialize", "handle trace_id", "deserialize", "reply"} <= names
+    assert all(event["dur"] >= 0 for event in events)
+
+
+def test_spans_are_not_recorded_when_disabled(tmp_path, monkeypatch):
+    monkeypatch.delenv(tracing.TRACE_DIR_ENV, raising=False)
+    with tracing.traced("abc"), tracing.span("noop"):
+        pass
+    tracing.record("noop", 0, 1)
+
+    assert not list(tmp_path.iterdir())
+
+
+def test_merge_writes_chrome_trace(trace_dir, tmp_path):
+    with tracing.traced("abc"):
+        with tracing.span("outer", extra=1):
+            tracing.record("inner", 1.0, 1.5)
+
+    events = load_events(trace_dir, tmp_path)
+    by_name = {event["name"]: event for event in events}
+    assert by_name["inner"]["ts"] == 1e6
+    assert by_name["inner"]["dur"] == 0.5e6
+    assert by_name["outer"]["args"] == {"trace_id": "abc", "extra": 1}
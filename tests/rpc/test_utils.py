@@ -1,8 +1,10 @@
 import random
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 
-from tiktorch.rpc.utils import BatchedExecutor
+import pytest
+
+from tiktorch.rpc.utils import BatchedExecutor, Policy
 
 
 def test():
@@ -28,3 +30,74 @@ def test():
             count += 1
 
     assert count == len(blocks)
+
+
+def submit_order(batcher, priorities):
+    """
+    :returns order in which calls queued behind a blocked one were submitted
+    """
+    order = []
+    blocker = Future()
+    batcher.submit(lambda: blocker)
+
+    def call(idx):
+        order.append(idx)
+        fut = Future()
+        fut.set_result(idx)
+        return fut
+
+    for idx, priority in enumerate(priorities):
+        batcher.submit(call, idx, priority=priority)
+
+    assert batcher.queue_depth == len(priorities)
+    blocker.set_result(None)
+    return order
+
+
+@pytest.mark.parametrize("policy, expected", [(Policy.FIFO, [0, 1, 2]), (Policy.LIFO, [2, 1, 0])])
+def test_policy(policy, expected):
+    batcher = BatchedExecutor(batch_size=1, policy=policy, adaptive=False)
+    assert submit_order(batcher, [0, 0, 0]) == expected
+
+
+def test_higher_priority_goes_first():
+    batcher = BatchedExecutor(batch_size=1, policy=Policy.FIFO, adaptive=False)
+    assert submit_order(batcher, [0, 1, 0, 2]) == [3, 1, 0, 2]
+
+
+def test_window_grows_while_latency_is_stable():
+    batcher = BatchedExecutor(batch_size=2)
+    done = Future()
+    done.set_result(None)
+
+    futures = [batcher.submit(lambda: done) for _ in range(100)]
+    assert all(f.done() for f in futures)
+    assert batcher.window > 2
+
+
+def test_window_shrinks_when_server_queues_up():
+    batcher = BatchedExecutor(batch_size=32, tolerance=1.5)
+
+    # single worker, latency grows with number of calls in flight
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        futures = [batcher.submit(ex.submit, time.sleep, 0.002) for _ in range(300)]
+        for f in futures:
+            f.result(timeout=10)
+
+    stats = batcher.stats()
+    assert stats["window"] < 32
+    assert stats["in_flight"] == 0 and stats["queued"] == 0
+
+
+def test_failed_submission_releases_slot():
+    batcher = BatchedExecutor(batch_size=1, adaptive=False)
+
+    def fail():
+        raise Exception("fail")
+
+    with pytest.raises(Exception):
+        batcher.submit(fail).result(timeout=1)
+
+    done = Future()
+    done.set_result(1)
+    assert batcher.submit(lambda: done).result(timeout=1) == 1
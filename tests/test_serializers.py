@@ -1,9 +1,11 @@
 import numpy as np
+import pytest
 import zmq
 
 from tiktorch import serializers as ser
 from tiktorch import types
-from tiktorch.rpc import deserialize, serialize
+from tiktorch.rpc import WireOptions, deserialize, serialize, shm
+from tiktorch.rpc.serialization import BINARY_MARKER, wire_options
 
 
 def test_ndarray_serializer():
@@ -46,3 +48,119 @@ def test_model_serializer():
     serialized = s.serialize(model)
     deserialized = s.deserialize(iter(serialized))
     assert model == deserialized
+
+
+def test_ndarray_serializer_shared_memory():
+    ndarray = types.NDArray(np.random.rand(256, 256).astype(np.float32), id_=(1, 2))
+
+    with wire_options(WireOptions(shm=True)):
+        serialized = list(serialize(ndarray))
+
+    assert len(serialized[-1].bytes) == 0, "buffer should be passed through shared memory"
+
+    deserialized = deserialize(iter(serialized))
+    np.testing.assert_array_equal(deserialized.as_numpy(), ndarray.as_numpy())
+    assert deserialized.id == ndarray.id
+
+
+def test_ndarray_batch_serializer_shared_memory_skips_small_arrays():
+    batch = types.NDArrayBatch([types.NDArray(np.ones((4, 4))), types.NDArray(np.random.rand(128, 128), id_=(7,))])
+
+    with wire_options(WireOptions(shm=True)):
+        serialized = list(serialize(batch))
+
+    assert [len(frame.bytes) for frame in serialized[2:]] == [4 * 4 * 8, 0]
+
+    deserialized = deserialize(iter(serialized))
+    for expected, actual in zip(batch, deserialized):
+        np.testing.assert_array_equal(actual.as_numpy(), expected.as_numpy())
+        assert actual.id == expected.id
+
+
+def test_ndarray_batch_serializer_compression():
+    labels = np.zeros((64, 64), dtype=np.uint8)
+    labels[10:20, 10:20] = 1
+    batch = types.NDArrayBatch([types.NDArray(labels, id_=(0,)), types.NDArray(np.ones((4, 4)), id_=(1,))])
+
+    with wire_options(WireOptions(compression=("zlib",))):
+        serialized = list(serialize(batch))
+
+    assert len(serialized[2].bytes) < labels.nbytes
+    assert len(serialized[3].bytes) == 4 * 4 * 8, "tiny frames should be sent uncompressed"
+
+    deserialized = deserialize(iter(serialized))
+    for expected, actual in zip(batch, deserialized):
+        np.testing.assert_array_equal(actual.as_numpy(), expected.as_numpy())
+        assert actual.id == expected.id
+
+
+def test_model_state_serializer_compression():
+    state = types.ModelState(model_state=b"\0" * 100_000, optimizer_state=b"opt_state", loss=0.5, epoch=3)
+
+    with wire_options(WireOptions(compression=("lzma",))):
+        serialized = list(serialize(state))
+
+    assert len(serialized[2].bytes) < 100_000
+    assert deserialize(iter(serialized)) == state
+
+
+def _binary_roundtrip(obj, options=WireOptions(binary_header=1)):
+    with wire_options(options):
+        serialized = list(serialize(obj))
+
+    assert serialized[0].bytes[0] == BINARY_MARKER
+    return serialized, deserialize(iter(serialized))
+
+
+@pytest.mark.parametrize(
+    "ndarray",
+    [
+        types.NDArray(np.random.rand(17, 12, 13), id_=(3, 5)),
+        types.NDArray(np.arange(12, dtype=np.uint16).reshape(3, 4)),
+        types.NDArray(np.array(True), id_=()),
+    ],
+)
+def test_ndarray_binary_header(ndarray):
+    serialized, deserialized = _binary_roundtrip(ndarray)
+
+    assert len(serialized) == 2, "type and metadata should share header frame"
+    np.testing.assert_array_equal(deserialized.as_numpy(), ndarray.as_numpy())
+    assert deserialized.dtype == ndarray.dtype
+    assert deserialized.id == ndarray.id
+
+
+def test_ndarray_batch_binary_header_with_compression_and_shared_memory():
+    labels = np.zeros((64, 64), dtype=np.uint8)
+    batch = types.NDArrayBatch(
+        [
+            types.NDArray(labels, id_=(0,)),
+            types.NDArray(np.random.rand(128, 128), id_=(1, 2)),
+            types.NDArray(np.ones((4, 4), dtype=np.float32)),
+        ]
+    )
+    options = WireOptions(shm=shm.is_available(), compression=("zlib",), binary_header=1)
+
+    serialized, deserialized = _binary_roundtrip(batch, options)
+
+    assert len(serialized) == 4
+    assert len(serialized[1].bytes) < labels.nbytes
+    for expected, actual in zip(batch, deserialized):
+        np.testing.assert_array_equal(actual.as_numpy(), expected.as_numpy())
+        assert actual.id == expected.id
+
+
+@pytest.mark.parametrize(
+    "ndarray",
+    [
+        types.NDArray(np.ones((2, 2), dtype=">f4")),
+        types.NDArray(np.ones((2, 2), dtype=np.complex64)),
+        types.NDArray(np.ones((2, 2)), id_=("a", 1)),
+    ],
+)
+def test_binary_header_falls_back_to_json(ndarray):
+    with wire_options(WireOptions(binary_header=1)):
+        serialized = list(serialize(ndarray))
+
+    assert serialized[0].bytes == b"T:ndarray"
+    deserialized = deserialize(iter(serialized))
+    np.testing.assert_array_equal(deserialized.as_numpy(), ndarray.as_numpy())
@@ -1,5 +1,7 @@
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from unittest import mock
 
 import numpy as np
@@ -8,7 +10,7 @@ import pytest
 from tiktorch.launcher import LocalServerLauncher
 from tiktorch.rpc import Client, Shutdown, TCPConnConf
 from tiktorch.rpc_interface import IFlightControl
-from tiktorch.server.base import TikTorchServer, Watchdog
+from tiktorch.server.base import TikTorchServer, Watchdog, embedded_server
 from tiktorch.types import Model, ModelState, NDArray, NDArrayBatch
 
 
@@ -46,6 +48,37 @@ def test_forward(datadir, srv, nn_sample):
     np.testing.assert_array_almost_equal(res_numpy[0], out_arr, decimal=2)
 
 
+def test_model_is_not_swapped_while_in_use():
+    srv = TikTorchServer()
+    old_handler, new_handler = mock.Mock(), mock.Mock()
+    state_started, release_state = threading.Event(), threading.Event()
+
+    def get_state():
+        state_started.set()
+        release_state.wait(timeout=5)
+        return b"old state"
+
+    old_handler.get_state.side_effect = get_state
+    srv._set_model(old_handler, {})
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        state = executor.submit(srv.get_model_state)
+        assert state_started.wait(timeout=5)
+        swap = executor.submit(srv._set_model, new_handler, {"Normalize": {}})
+        time.sleep(0.1)
+        # old handler is shut down only after the call using it is done
+        assert not swap.done()
+        old_handler.shutdown.assert_not_called()
+
+        release_state.set()
+        assert state.result(timeout=5) == b"old state"
+        swap.result(timeout=5)
+
+    old_handler.shutdown.assert_called_once()
+    assert srv.handler is new_handler
+    assert srv.test_transforms == {"Normalize": {}}
+
+
 class TestWatchdog:
     class SrvStub:
         def __init__(self):
@@ -97,3 +130,9 @@ class TestWatchdog:
         time.sleep(3)
 
         assert not launcher.is_server_running()
+
+
+def test_embedded_server():
+    with embedded_server(timeout=10000) as client:
+        assert client.get_available_devices()
+        assert client.active_children() == []
@@ -0,0 +1,140 @@
+import json
+
+import pytest
+import torch
+
+from tests.data.tiny_models import TinyConvNet2d
+from tiktorch.configkeys import INFERENCE_BATCH_SIZE, INFERENCE_BATCH_SIZE_CACHE
+from tiktorch.server.batch_control import MIN_SAMPLES, BatchSizeController, is_out_of_memory, model_hash
+from tiktorch.server.handler.inference import InferenceProcess
+from tiktorch.tiktypes import TikTensor
+
+CPU = torch.device("cpu")
+SHAPE = (1, 64, 64)
+
+
+def feed(controller, seconds_per_batch):
+    """
+    Measure full batches until controller settles, batch takes seconds_per_batch(batch_size)
+    """
+    for _ in range(100):
+        if controller.stats().get("cpu", {}).get("1x64x64", {}).get("converged"):
+            break
+
+        batch_size = controller.batch_size(CPU, SHAPE)
+        controller.record(CPU, SHAPE, batch_size, seconds_per_batch(batch_size))
+
+    return controller.batch_size(CPU, SHAPE)
+
+
+def test_batch_size_grows_while_throughput_improves():
+    controller = BatchSizeController(max_batch_size=64)
+    # fixed overhead per batch, batches of more than 8 items are as slow per item as single ones
+    assert feed(controller, lambda batch_size: 1 + 0.1 * batch_size if batch_size <= 8 else batch_size) == 8
+
+
+def test_batch_size_is_capped_by_max_batch_size():
+    controller = BatchSizeController(initial=3, max_batch_size=10)
+    assert feed(controller, lambda batch_size: 1.0) == 10
+
+
+def test_out_of_memory_caps_batch_size():
+    controller = BatchSizeController(max_batch_size=64)
+    controller.record(CPU, SHAPE, 1, 1.0)
+    assert controller.out_of_memory(CPU, SHAPE, 1) == 1
+
+    controller = BatchSizeController(initial=16, max_batch_size=64)
+    assert controller.out_of_memory(CPU, SHAPE, 16) == 8
+    # larger batch sizes are not tried anymore
+    for _ in range(MIN_SAMPLES * 3):
+        controller.record(CPU, SHAPE, 8, 0.1)
+    assert controller.batch_size(CPU, SHAPE) == 8
+    assert controller.stats()["cpu"]["1x64x64"]["oom_at"] == 16
+
+
+def test_limits_are_persisted_per_model(tmp_path):
+    cache_file = str(tmp_path / "cache" / "batch_sizes.json")
+    controller = BatchSizeController(max_batch_size=4, cache_file=cache_file, model_key="model-a")
+    assert feed(controller, lambda batch_size: 1.0) == 4
+    controller.out_of_memory(CPU, (1, 128, 128), 2)
+
+    with open(cache_file) as f:
+        assert json.load(f)["model-a"]["cpu"] == {
+            "1x64x64": {"batch_size": 4, "oom_at": None},
+            "1x128x128": {"batch_size": 1, "oom_at": 2},
+        }
+
+    restored = BatchSizeController(max_batch_size=4, cache_file=cache_file, model_key="model-a")
+    assert restored.batch_size(CPU, SHAPE) == 4
+    assert restored.batch_size(CPU, (1, 128, 128)) == 1
+
+    other = BatchSizeController(max_batch_size=4, cache_file=cache_file, model_key="model-b")
+    assert other.batch_size(CPU, SHAPE) == 1
+    other.out_of_memory(CPU, SHAPE, 1)
+    with open(cache_file) as f:
+        assert set(json.load(f)) == {"model-a", "model-b"}
+
+
+def test_malformed_cache_is_ignored(tmp_path):
+    cache_file = tmp_path / "batch_sizes.json"
+    cache_file.write_text("{not json")
+    controller = BatchSizeController(cache_file=str(cache_file), model_key="model")
+    assert controller.batch_size(CPU, SHAPE) == 1
+
+
+def test_model_hash_depends_on_architecture_only():
+    model = TinyConvNet2d(in_channels=1)
+    retrained = TinyConvNet2d(in_channels=1)
+    assert model_hash(model) == model_hash(retrained)
+    assert model_hash(model) != model_hash(TinyConvNet2d(in_channels=2))
+
+
+def test_is_out_of_memory():
+    assert is_out_of_memory(RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB"))
+    assert is_out_of_memory(
+        RuntimeError("[enforce fail at alloc_cpu.cpp:73] DefaultCPUAllocator: can't allocate memory")
+    )
+    assert not is_out_of_memory(RuntimeError("Given groups=1, weight of size [16, 1, 1, 1], expected input"))
+
+
+class LimitedMemoryNet(TinyConvNet2d):
+    """
+    Runs out of memory for batches larger than 2, fails for inputs containing nan
+    """
+
+    def forward(self, x):
+        if x.shape[0] > 2:
+            raise RuntimeError("CUDA out of memory. Tried to allocate 1.00 GiB")
+        if torch.isnan(x).any():
+            raise ValueError("nan in input")
+        return super().forward(x)
+
+
+def test_inference_retries_out_of_memory_with_smaller_batches(tiny_model_2d, tmp_path):
+    cache_file = str(tmp_path / "batch_sizes.json")
+    config = {**tiny_model_2d["config"], INFERENCE_BATCH_SIZE: 4, INFERENCE_BATCH_SIZE_CACHE: cache_file}
+    in_channels = config["input_channels"]
+    model = LimitedMemoryNet(in_channels=in_channels)
+    inference = InferenceProcess(config=config, model=model)
+    try:
+        tiles = [torch.rand(in_channels, 15, 15) for _ in range(4)]
+        tiles[3][0, 0, 0] = float("nan")
+        preds = [inference.forward(TikTensor(tile, (idx,))) for idx, tile in enumerate(tiles)]
+        inference.set_devices([CPU])
+
+        for pred in preds[:2]:
+            assert isinstance(pred.result(timeout=10), TikTensor)
+        # other errors fail requests of the failed batch only
+        with pytest.raises(ValueError):
+            preds[3].result(timeout=10)
+        with pytest.raises(ValueError):
+            preds[2].result(timeout=10)
+
+        limits = inference.get_forward_stats()["batch_sizes"]["cpu"][f"{in_channels}x15x15"]
+        assert limits["batch_size"] == 2
+        assert limits["oom_at"] == 4
+    finally:
+        inference.shutdown()
+
+    with open(cache_file) as f:
+        assert json.load(f)[model_hash(model)]["cpu"][f"{in_channels}x15x15"]["oom_at"] == 4
@@ -0,0 +1,93 @@
+import threading
+import time
+
+from tiktorch.server.batching import Batcher
+
+
+def test_full_batch_is_handed_out_right_away():
+    batcher = Batcher(max_delay=10)
+    for idx in range(5):
+        batcher.put(idx, idx)
+
+    start = time.monotonic()
+    assert batcher.get_batch(3, timeout=1) == [0, 1, 2]
+    assert batcher.get_batch(2, timeout=1) == [3, 4]
+    assert time.monotonic() - start < 1
+    assert not batcher
+
+
+def test_partial_batch_waits_for_max_delay():
+    batcher = Batcher(max_delay=0.1)
+    batcher.put("a", "a")
+
+    start = time.monotonic()
+    assert batcher.get_batch(4, timeout=1) == ["a"]
+    assert time.monotonic() - start >= 0.1
+
+    stats = batcher.stats()
+    assert stats["batch_size"]["count"] == 1
+    assert stats["queue_delay_us"]["min"] >= 100000
+
+
+def test_timeout_and_interrupt_return_empty_batch():
+    batcher = Batcher()
+    assert batcher.get_batch(4, timeout=0.01) == []
+
+    result = []
+    t = threading.Thread(target=lambda: result.append(batcher.get_batch(4)))
+    t.start()
+    time.sleep(0.05)
+    batcher.interrupt()
+    t.join(timeout=1)
+    assert result == [[]]
+
+
+def test_discarded_items_are_skipped():
+    batcher = Batcher(max_delay=0)
+    batcher.put("a", "a")
+    batcher.put("b", "b")
+    assert batcher.discard("a")
+    assert not batcher.discard("a")
+
+    assert batcher.get_batch(4, timeout=1) == ["b"]
+
+
+def test_workers_take_turns():
+    batcher = Batcher(max_delay=0)
+    batches = {"first": [], "second": []}
+    done = threading.Event()
+
+    def worker(name):
+        while not done.is_set():
+            batch = batcher.get_batch(1, timeout=0.1)
+            if batch:
+                batches[name].extend(batch)
+                # simulate compute, other worker has to take over meanwhile
+                time.sleep(0.01)
+
+    workers = [threading.Thread(target=worker, args=(name,)) for name in batches]
+    for t in workers:
+        t.start()
+
+    for idx in range(20):
+        batcher.put(idx, idx)
+        time.sleep(0.002)
+
+    while batcher:
+        time.sleep(0.01)
+    done.set()
+    for t in workers:
+        t.join()
+
+    assert sorted(batches["first"] + batches["second"]) == list(range(20))
+    assert abs(len(batches["first"]) - len(batches["second"])) <= 2
+
+
+def test_batches_contain_one_bucket():
+    batcher = Batcher(max_delay=0)
+    for idx, bucket in enumerate(["small", "large", "small", "large", "large"]):
+        batcher.put(idx, idx, bucket=bucket)
+
+    assert batcher.get_batch(3, timeout=1) == [1, 3, 4]
+    assert batcher.get_batch(3, timeout=1) == [0, 2]
+    assert not batcher
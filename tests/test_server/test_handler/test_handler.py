@@ -3,7 +3,7 @@ import pytest
 import torch
 from torch import multiprocessing as mp
 
-from tiktorch.configkeys import TRAINING, TRAINING_SHAPE, TRAINING_SHAPE_UPPER_BOUND
+from tiktorch.configkeys import INFERENCE_MAX_QUEUE_DEPTH, TRAINING, TRAINING_SHAPE, TRAINING_SHAPE_UPPER_BOUND
 from tiktorch.rpc.mp import Shutdown, create_client
 from tiktorch.server.handler.handler import HandlerProcess, IHandler
 from tiktorch.server.handler.handler import run as run_handler
@@ -91,6 +91,40 @@ def test_forward_2d(handler2d, tiny_model_2d):
         print(f"got fut {i + 1}/{len(futs)}", flush=True)
 
 
+@pytest.mark.parametrize("blend", [False, True])
+def test_forward_tiled_2d(handler2d, tiny_model_2d, blend):
+    C, Y, X = tiny_model_2d["config"]["input_channels"], 40, 50
+    image = numpy.random.random((C, Y, X)).astype(numpy.float32)
+    # wait for dry run to determine valid shapes
+    handler2d.set_devices(["cpu"]).result(timeout=30)
+
+    pred = handler2d.forward_tiled(TikTensor(image), blend=blend).result(timeout=30).as_numpy()
+    with torch.no_grad():
+        expected = handler2d.model(torch.from_numpy(image)[None])[0].numpy()
+
+    assert pred.shape == expected.shape
+    numpy.testing.assert_allclose(pred, expected, rtol=1e-5, atol=1e-6)
+
+
+def test_forward_tiled_resubmits_tiles_rejected_by_inference(tiny_model_2d, log_queue):
+    # concurrent tiled requests keep more tiles in flight than inference admits
+    config = {**tiny_model_2d["config"], INFERENCE_MAX_QUEUE_DEPTH: 2}
+    hp = HandlerProcess(**{**tiny_model_2d, "config": config}, log_queue=log_queue)
+    try:
+        hp.set_devices(["cpu"]).result(timeout=30)
+        C = config["input_channels"]
+        images = [numpy.random.random((C, 60, 70)).astype(numpy.float32) for _ in range(2)]
+
+        futs = [hp.forward_tiled(TikTensor(image)) for image in images]
+        for image, fut in zip(images, futs):
+            pred = fut.result(timeout=60).as_numpy()
+            with torch.no_grad():
+                expected = hp.model(torch.from_numpy(image)[None])[0].numpy()
+            numpy.testing.assert_allclose(pred, expected, rtol=1e-5, atol=1e-6)
+    finally:
+        hp.shutdown()
+
+
 def test_forward_2d_through_client(client2d, tiny_model_2d):
     C, Y, X = tiny_model_2d["config"]["input_channels"], 15, 15
     futs = []
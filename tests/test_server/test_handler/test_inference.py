@@ -1,7 +1,16 @@
+import pytest
 import torch
 from torch import multiprocessing as mp
 
 from tests.data.tiny_models import TinyConvNet2d, TinyConvNet3d
+from tiktorch.configkeys import (
+    INFERENCE_BATCH_SIZE,
+    INFERENCE_MAX_QUEUE_DEPTH,
+    INFERENCE_MAX_QUEUED_BYTES,
+    INFERENCE_OVERLOAD,
+    INFERENCE_PAD_TO_VALID_SHAPE,
+)
+from tiktorch.rpc import DeadlineExceeded, Overloaded, deadline
 from tiktorch.rpc.mp import MPClient, Shutdown, create_client
 from tiktorch.server.handler.inference import IInference, InferenceProcess, run
 from tiktorch.tiktypes import TikTensor, TikTensorBatch
@@ -47,6 +56,154 @@ def test_inference2d_in_proc(tiny_model_2d, log_queue):
         client.shutdown()
 
 
+def test_inference_skips_cancelled_and_expired(tiny_model_2d):
+    config = tiny_model_2d["config"]
+    in_channels = config["input_channels"]
+    model = TinyConvNet2d(in_channels=in_channels)
+    inference = InferenceProcess(config=config, model=model)
+    try:
+        data = TikTensor(torch.zeros(in_channels, 15, 15), (0,))
+        # no devices yet, requests stay queued
+        cancelled = inference.forward(data)
+        assert cancelled.cancel()
+        with deadline(0):
+            expired = inference.forward(data)
+        pred = inference.forward(data)
+
+        inference.set_devices([torch.device("cpu")])
+        assert isinstance(pred.result(timeout=10), TikTensor)
+        with pytest.raises(DeadlineExceeded):
+            expired.result(timeout=10)
+
+        assert inference.get_skipped() == {"cancelled": 1, "expired": 1}
+    finally:
+        inference.shutdown()
+
+
+def test_inference_rejects_when_queue_is_full(tiny_model_2d):
+    config = {**tiny_model_2d["config"], INFERENCE_MAX_QUEUE_DEPTH: 2}
+    in_channels = config["input_channels"]
+    model = TinyConvNet2d(in_channels=in_channels)
+    inference = InferenceProcess(config=config, model=model)
+    try:
+        data = TikTensor(torch.zeros(in_channels, 15, 15), (0,))
+        # no devices yet, requests stay queued
+        queued = [inference.forward(data) for _ in range(2)]
+        rejected = inference.forward(data)
+        with pytest.raises(Overloaded):
+            rejected.result(timeout=1)
+
+        # cancelled request frees its slot
+        assert queued[0].cancel()
+        pred = inference.forward(data)
+
+        inference.set_devices([torch.device("cpu")])
+        assert isinstance(queued[1].result(timeout=10), TikTensor)
+        assert isinstance(pred.result(timeout=10), TikTensor)
+        assert inference.get_admission_stats() == {
+            "queued": 0,
+            "queued_bytes": 0,
+            "admitted": 3,
+            "rejected": 1,
+            "shed": 0,
+        }
+        assert inference.get_skipped() == {"cancelled": 1, "expired": 0}
+    finally:
+        inference.shutdown()
+
+
+def test_inference_sheds_oldest(tiny_model_2d):
+    data_bytes = 4 * 15 * 15 * tiny_model_2d["config"]["input_channels"]
+    config = {**tiny_model_2d["config"], INFERENCE_MAX_QUEUED_BYTES: 2 * data_bytes, INFERENCE_OVERLOAD: "shed_oldest"}
+    in_channels = config["input_channels"]
+    model = TinyConvNet2d(in_channels=in_channels)
+    inference = InferenceProcess(config=config, model=model)
+    try:
+        data = TikTensor(torch.zeros(in_channels, 15, 15), (0,))
+        preds = [inference.forward(data) for _ in range(3)]
+        with pytest.raises(Overloaded):
+            preds[0].result(timeout=1)
+
+        # too large on its own
+        with pytest.raises(Overloaded):
+            inference.forward(TikTensor(torch.zeros(in_channels, 45, 15), (1,))).result(timeout=1)
+
+        assert inference.get_admission_stats()["queued_bytes"] == 2 * data_bytes
+        inference.set_devices([torch.device("cpu")])
+        for pred in preds[1:]:
+            assert isinstance(pred.result(timeout=10), TikTensor)
+
+        stats = inference.get_admission_stats()
+        assert stats["shed"] == 1
+        assert stats["rejected"] == 1
+        assert stats["queued"] == 0
+    finally:
+        inference.shutdown()
+
+
+def test_replica_is_built_once_per_device(tiny_model_2d):
+    config = tiny_model_2d["config"]
+    in_channels = config["input_channels"]
+    model = TinyConvNet2d(in_channels=in_channels)
+    inference = InferenceProcess(config=config, model=model)
+    try:
+        inference.set_devices([torch.device("cpu")]).result(timeout=10)
+        data = TikTensor(torch.ones(in_channels, 15, 15), (0,))
+        preds = [inference.forward(data).result(timeout=10) for _ in range(3)]
+
+        stats = inference.get_forward_stats()
+        assert stats["replica_build_us"]["count"] == 1
+        assert stats["compute_us"]["count"] == 3
+        with torch.no_grad():
+            expected = model(torch.ones(1, in_channels, 15, 15))[0]
+        for pred in preds:
+            assert torch.allclose(pred.as_torch(), expected)
+    finally:
+        inference.shutdown()
+
+
+def test_mixed_shapes_are_batched_separately(tiny_model_2d):
+    config = {**tiny_model_2d["config"], INFERENCE_BATCH_SIZE: 4}
+    in_channels = config["input_channels"]
+    model = TinyConvNet2d(in_channels=in_channels)
+    inference = InferenceProcess(config=config, model=model)
+    try:
+        shapes = [(15, 15), (12, 15), (15, 15), (12, 15), (15, 15), (15, 15), (12, 15), (12, 15)]
+        preds = [
+            inference.forward(TikTensor(torch.rand(in_channels, *shape), (idx,))) for idx, shape in enumerate(shapes)
+        ]
+        inference.set_devices([torch.device("cpu")])
+        for shape, pred in zip(shapes, preds):
+            assert pred.result(timeout=10).shape[1:] == shape
+
+        batch_size = inference.get_forward_stats()["batch_size"]
+        assert batch_size["count"] == 2
+        assert batch_size["min"] == batch_size["max"] == 4
+    finally:
+        inference.shutdown()
+
+
+def test_smaller_tiles_are_padded_to_valid_shape(tiny_model_2d):
+    config = {**tiny_model_2d["config"], INFERENCE_BATCH_SIZE: 4, INFERENCE_PAD_TO_VALID_SHAPE: True}
+    in_channels = config["input_channels"]
+    model = TinyConvNet2d(in_channels=in_channels)
+    inference = InferenceProcess(config=config, model=model)
+    try:
+        inference.set_valid_shapes([(in_channels, 16, 16), (in_channels, 32, 32)])
+        tiles = [torch.rand(in_channels, *shape) for shape in [(16, 16), (12, 16), (16, 9), (16, 16)]]
+        preds = [inference.forward(TikTensor(tile, (idx,))) for idx, tile in enumerate(tiles)]
+        inference.set_devices([torch.device("cpu")])
+        for tile, pred in zip(tiles, preds):
+            # model works pixel-wise, cropped prediction is the same as without padding
+            with torch.no_grad():
+                expected = model(tile[None])[0]
+            assert torch.allclose(pred.result(timeout=10).as_torch(), expected)
+
+        assert inference.get_forward_stats()["batch_size"]["max"] == 4
+    finally:
+        inference.shutdown()
+
+
 def test_inference3d(tiny_model_3d, log_queue):
     config = tiny_model_3d["config"]
     in_channels = config["input_channels"]
@@ -0,0 +1,86 @@
+import numpy
+import pytest
+
+from tiktorch.server.tiling import Stitcher, Tiling, halo
+
+
+def predict(tiling, tile):
+    """
+    Network shrinking its input by halo and doubling it to two output channels
+    """
+    valid = tuple(slice(lo, lo + out) for (lo, _hi), out in zip(tiling.halo, tiling.output_shape))
+    center = tile[(slice(None),) + valid]
+    return numpy.concatenate([center[:1] * 2, center[:1] * 3])
+
+
+def predict_tiled(tiling, image, blend):
+    stitcher = Stitcher(tiling, blend)
+    for start, tile in tiling.tiles(image):
+        assert tile.shape == tiling.tile_shape
+        stitcher.add(start, predict(tiling, tile))
+
+    return stitcher.result()
+
+
+def test_halo():
+    assert halo((0, 4, 5)) == [(0, 0), (2, 2), (2, 3)]
+
+
+@pytest.mark.parametrize(
+    "shape,tile_shape,shrinkage,overlap",
+    [
+        ((1, 50, 70), (1, 24, 32), (0, 8, 8), None),
+        ((1, 50, 70), (1, 24, 32), (0, 5, 7), (4, 6)),
+        ((2, 7, 9), (2, 24, 32), (0, 8, 8), None),
+        ((1, 9, 30, 31), (1, 6, 16, 16), (0, 2, 4, 4), (1, 3, 3)),
+    ],
+)
+@pytest.mark.parametrize("blend", [False, True])
+def test_stitched_prediction_covers_image(shape, tile_shape, shrinkage, overlap, blend):
+    image = numpy.random.rand(*shape).astype(numpy.float32)
+    tiling = Tiling(shape, tile_shape, shrinkage, overlap)
+
+    pred = predict_tiled(tiling, image, blend)
+    assert pred.shape == (2,) + shape[1:]
+    numpy.testing.assert_allclose(pred[0], image[0] * 2, rtol=1e-5)
+    numpy.testing.assert_allclose(pred[1], image[0] * 3, rtol=1e-5)
+
+
+def test_tiles_overlap():
+    tiling = Tiling((1, 50, 70), (1, 24, 32), (0, 8, 8), overlap=(4, 6))
+    assert tiling.output_shape == (16, 24)
+    assert sorted({start[0] for start in tiling.starts}) == [0, 12, 24, 34]
+    assert sorted({start[1] for start in tiling.starts}) == [0, 18, 36, 46]
+    assert len(tiling) == 16
+
+
+def test_blend_window_decreases_towards_border():
+    tiling = Tiling((1, 50), (1, 12), (0, 2), overlap=(3,))
+    numpy.testing.assert_allclose(tiling.window(blend=True), [0.25, 0.5, 0.75, 1, 1, 1, 1, 0.75, 0.5, 0.25])
+    assert (tiling.window(blend=False) == 1).all()
+
+
+def test_valid_shape_covering_image_with_least_compute_is_chosen():
+    valid_shapes = [(1, 16, 16), (1, 40, 40), (1, 72, 72)]
+    assert Tiling.for_valid_shapes((1, 60, 60), valid_shapes, (0, 8, 8)).tile_shape == (1, 72, 72)
+    assert Tiling.for_valid_shapes((1, 8, 8), valid_shapes, (0, 8, 8)).tile_shape == (1, 16, 16)
+    blended = Tiling.for_valid_shapes((1, 60, 60), valid_shapes, (0, 8, 8), blend=True)
+    assert blended.overlap == (int(blended.output_shape[0] * 0.25),) * 2
+
+
+def test_invalid_tilings():
+    with pytest.raises(ValueError):
+        Tiling((2, 50, 50), (1, 24, 24), (0, 8, 8))
+    with pytest.raises(ValueError):
+        Tiling((1, 50, 50), (1, 8, 24), (0, 8, 8))
+    with pytest.raises(ValueError):
+        Tiling((1, 50, 50), (1, 24, 24), (0, 8, 8), overlap=(16, 0))
+    with pytest.raises(ValueError):
+        Tiling.for_valid_shapes((1, 50, 50, 50), [(1, 24, 24)], (0, 8, 8))
+
+    tiling = Tiling((1, 50, 50), (1, 24, 24), (0, 8, 8))
+    stitcher = Stitcher(tiling)
+    with pytest.raises(ValueError):
+        stitcher.add((0, 0), numpy.zeros((1, 24, 24)))
+    with pytest.raises(ValueError):
+        stitcher.result()
@@ -17,6 +17,13 @@ TRANSFORMS = "transforms"
 
 # inference
 INFERENCE_BATCH_SIZE = "inference_batch_size"
+INFERENCE_MAX_BATCH_SIZE = "inference_max_batch_size"
+INFERENCE_BATCH_SIZE_CACHE = "inference_batch_size_cache"  # json file learned batch sizes are kept in
+INFERENCE_MAX_BATCH_DELAY = "inference_max_batch_delay"  # seconds the oldest request waits for batch to fill up
+INFERENCE_PAD_TO_VALID_SHAPE = "inference_pad_to_valid_shape"  # pad requests to be batched with larger ones
+INFERENCE_MAX_QUEUE_DEPTH = "inference_max_queue_depth"  # per process, unbounded if None
+INFERENCE_MAX_QUEUED_BYTES = "inference_max_queued_bytes"  # per process, unbounded if None
+INFERENCE_OVERLOAD = "inference_overload"  # 'reject' (default) or 'shed_oldest'
 
 # training
 BATCH_SIZE = "batch_size"
@@ -52,6 +59,13 @@ CONFIG = {
     MODEL_INIT_KWARGS: None,
     HALO: None,
     INFERENCE_BATCH_SIZE: None,
+    INFERENCE_MAX_BATCH_SIZE: None,
+    INFERENCE_BATCH_SIZE_CACHE: None,
+    INFERENCE_MAX_BATCH_DELAY: None,
+    INFERENCE_PAD_TO_VALID_SHAPE: None,
+    INFERENCE_MAX_QUEUE_DEPTH: None,
+    INFERENCE_MAX_QUEUED_BYTES: None,
+    INFERENCE_OVERLOAD: None,
     TRAINING: {
         BATCH_SIZE: None,
         TRAINING_SHAPE: None,
@@ -1,9 +1,9 @@
 import logging
 import time
-from typing import Generator, Iterable, List, Optional, Tuple, Union
+from typing import Any, Dict, Generator, Iterable, List, Optional, Tuple, Union
 
 from tiktorch.configkeys import MINIMAL_CONFIG
-from tiktorch.rpc import RPCFuture, TCPConnConf, Timeout
+from tiktorch.rpc import RPCFuture, TCPConnConf, Timeout, metrics
 from tiktorch.rpc_interface import IFlightControl, INeuralNetworkAPI
 from tiktorch.types import LabeledNDArrayBatch, NDArray, SetDeviceReturnType
 
@@ -28,6 +28,10 @@ class DummyServerForFrontendDev(INeuralNetworkAPI, IFlightControl):
     def shutdown(self) -> None:
         logger.info("stopped")
 
+    def get_rpc_stats(self) -> Dict[str, Any]:
+        snapshot = metrics.registry.snapshot()
+        return {"processes": {"server": snapshot}, "total": snapshot}
+
     def load_model(
         self, config: dict, model_file: bytes, model_state: bytes, optimizer_state: bytes, devices: list
     ) -> RPCFuture[SetDeviceReturnType]:
@@ -54,6 +58,12 @@ class DummyServerForFrontendDev(INeuralNetworkAPI, IFlightControl):
         fut.set_result(batch)
         return fut
 
+    def forward_tiled(self, image: NDArray, blend: bool = False) -> RPCFuture[NDArray]:
+        logger.info("forward tiled for array of shape %s", image.shape)
+        fut = RPCFuture()
+        fut.set_result(image)
+        return fut
+
     def pause_training(self) -> None:
         logger.info("pause training")
 
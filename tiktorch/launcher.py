@@ -5,11 +5,11 @@ import sys
 import threading
 import time
 from socket import timeout
-from typing import Optional
+from typing import Optional, Union
 
 from paramiko import AutoAddPolicy, SSHClient
 
-from .rpc import Client, Shutdown, TCPConnConf, Timeout
+from .rpc import Client, IPCConnConf, Shutdown, TCPConnConf, Timeout
 from .rpc_interface import IFlightControl
 
 HEARTBEAT_INTERVAL = 10  # seconds
@@ -26,6 +26,7 @@ class IServerLauncher:
         Running = "Running"
 
     __conn_conf = None
+    __client: Optional[Client] = None
     _state: State = State.Stopped
     _heartbeat_worker: Optional[threading.Thread] = None
 
@@ -34,18 +35,27 @@ class IServerLauncher:
         return logging.getLogger(self.__class__.__qualname__)
 
     @property
-    def _conn_conf(self) -> TCPConnConf:
+    def _conn_conf(self) -> Union[TCPConnConf, IPCConnConf]:
         if self.__conn_conf is None:
             raise Exception("Please set self._conn_conf")
 
         return self.__conn_conf
 
     @_conn_conf.setter
-    def _conn_conf(self, value: TCPConnConf) -> None:
-        if not isinstance(value, TCPConnConf):
-            raise ValueError("Should be instance of TCPConnConf")
+    def _conn_conf(self, value: Union[TCPConnConf, IPCConnConf]) -> None:
+        if not isinstance(value, (TCPConnConf, IPCConnConf)):
+            raise ValueError("Should be instance of TCPConnConf or IPCConnConf")
 
         self.__conn_conf = value
+        self.__client = None
+
+    @property
+    def _client(self) -> Client:
+        # reused by heartbeats, its REQ sockets are drawn from the shared pool
+        if self.__client is None:
+            self.__client = Client(IFlightControl(), self._conn_conf)
+
+        return self.__client
 
     def _hearbeat(self, interval: int):
         while not self._stop.wait(timeout=interval):
@@ -57,8 +67,7 @@ class IServerLauncher:
 
     def _ping(self):
         try:
-            c = Client(IFlightControl(), self._conn_conf)
-            return c.ping() == b"pong"
+            return self._client.ping() == b"pong"
         except Timeout:
             return False
 
@@ -82,11 +91,12 @@ class IServerLauncher:
 
         self._stop.set()
 
-        c = Client(IFlightControl(), self._conn_conf)
         try:
-            c.shutdown()
+            self._client.shutdown()
         except Shutdown:
             pass
+        finally:
+            self.__client = None
 
         self._state = self.State.Stopped
         self._heartbeat_worker.join()
@@ -108,38 +118,35 @@ def wait(done, interval=0.1, max_wait=10):
 
 
 class LocalServerLauncher(IServerLauncher):
-    def __init__(self, conn_conf: TCPConnConf, path=None):
+    def __init__(self, conn_conf: Union[TCPConnConf, IPCConnConf], path=None):
+        """
+        :param conn_conf: IPCConnConf avoids TCP loopback overhead for large arrays
+        """
         self._conn_conf = conn_conf
         self._process = None
         self._path = path
 
     def _start_server(self, dummy: bool, kill_timeout: int):
-        addr, port, notify_port = self._conn_conf.addr, self._conn_conf.port, self._conn_conf.pubsub_port
-
-        if addr != "127.0.0.1":
-            raise ValueError("LocalServerHandler only possible to run on localhost")
-
         if self._process:
             raise AlreadyRunningError(f"Local server is already running (pid:{self._process.pid})")
 
-        self.logger.info("Starting local TikTorchServer on %s:%s", addr, port)
-
         if self._path:
             script = [self._path]
         else:
             script = [sys.executable, "-m", "tiktorch.server"]
 
-        cmd = [
-            *script,
-            "--port",
-            str(port),
-            "--notify-port",
-            str(notify_port),
-            "--addr",
-            addr,
-            "--kill-timeout",
-            str(kill_timeout),
-        ]
+        if isinstance(self._conn_conf, IPCConnConf):
+            self.logger.info("Starting local TikTorchServer on %s", self._conn_conf.path)
+            endpoint = ["--ipc-path", self._conn_conf.path]
+        else:
+            addr, port, notify_port = self._conn_conf.addr, self._conn_conf.port, self._conn_conf.pubsub_port
+            if addr != "127.0.0.1":
+                raise ValueError("LocalServerHandler only possible to run on localhost")
+
+            self.logger.info("Starting local TikTorchServer on %s:%s", addr, port)
+            endpoint = ["--port", str(port), "--notify-port", str(notify_port), "--addr", addr]
+
+        cmd = [*script, *endpoint, "--kill-timeout", str(kill_timeout)]
         if dummy:
             cmd.append("--dummy")
 
@@ -163,6 +170,9 @@ class SSHCred:
 
 class RemoteSSHServerLauncher(IServerLauncher):
     def __init__(self, conn_conf: TCPConnConf, *, cred: SSHCred, ssh_port: int = 22, path="tiktorch") -> None:
+        if not isinstance(conn_conf, TCPConnConf):
+            raise ValueError("Remote server is reachable only over TCP")
+
         self._path = path
         self._ssh_port = ssh_port
         self._channel = None
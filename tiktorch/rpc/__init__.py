@@ -1,20 +1,42 @@
+from .aio import AsyncClient
 from .base import Client, RPCFuture, Server
-from .connections import InprocConnConf, TCPConnConf
-from .exceptions import CallException, Canceled, Shutdown, Timeout
-from .interface import RPCInterface, exposed
-from .serialization import ISerializer, deserialize, serialize, serializer_for
+from .connections import InprocConnConf, IPCConnConf, TCPConnConf, Transport
+from .deadline import deadline
+from .exceptions import CallException, Canceled, DeadlineExceeded, Overloaded, Shutdown, Timeout
+from .interface import RPCInterface, exposed, serial
+from .serialization import (
+    BINARY_HEADER_VERSION,
+    IBinarySerializer,
+    ISerializer,
+    WireOptions,
+    deserialize,
+    serialize,
+    serializer_for,
+)
+from .stream import RPCStream
 
 __all__ = [
     "serializer_for",
     "ISerializer",
+    "IBinarySerializer",
     "serialize",
     "deserialize",
     "Client",
+    "AsyncClient",
     "Server",
     "Shutdown",
     "Timeout",
+    "DeadlineExceeded",
+    "Overloaded",
+    "deadline",
     "RPCInterface",
     "exposed",
+    "serial",
     "TCPConnConf",
     "InprocConnConf",
+    "IPCConnConf",
+    "Transport",
+    "WireOptions",
+    "BINARY_HEADER_VERSION",
+    "RPCStream",
 ]
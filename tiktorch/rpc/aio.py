@@ -0,0 +1,326 @@
+"""
+Asyncio client
+
+Exposes methods of RPCInterface as coroutines. Everything runs on the event loop:
+requests are pipelined over a single DEALER socket, replies and notifications
+are received by tasks of the loop, no helper threads are started.
+
+    client = AsyncClient(INeuralNetworkAPI(), conn_conf)
+    res = await client.forward(batch)
+"""
+import asyncio
+import itertools
+import logging
+from contextlib import ExitStack
+from functools import partial
+from typing import Any, Dict, List, Optional, Set, Tuple
+from uuid import uuid4
+
+import zmq
+import zmq.asyncio
+
+from .base import (
+    CANCEL,
+    STREAM_CANCEL,
+    STREAM_CREDIT,
+    MethodCodec,
+    Mode,
+    deserialize_ack,
+    deserialize_result,
+    make_call_header,
+    make_codecs,
+    make_handshake,
+    notify_stream,
+    parse_handshake,
+)
+from .connections import IConnConf
+from .deadline import expired, get_deadline
+from .exceptions import DeadlineExceeded, Shutdown, Timeout
+from .interface import RPCInterface, get_exposed_methods
+from .serialization import DEFAULT_WIRE_OPTIONS, WireOptions, wire_options
+from .stream import RPCStream
+from .tracing import span, start_trace, traced
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncMethodDispatcher:
+    def __init__(self, codec: MethodCodec, client: "AsyncClient") -> None:
+        self._codec = codec
+        self._client = client
+
+    def __call__(self, *args, **kwargs) -> Any:
+        coro = self._client.call(self._codec, args, kwargs)
+        if self._codec.returns_future:
+            # dispatched right away, same as methods returning RPCFuture on Client
+            return asyncio.ensure_future(coro)
+
+        return coro
+
+
+class AsyncClient:
+    """
+    Calls return coroutines, methods returning RPCFuture return awaitable tasks
+    which are dispatched immediately, streaming methods return RPCStream to iterate
+    with `async for`.
+
+    Timeout of *conn_conf* (ms) limits waiting for replies.
+    """
+
+    def __init__(self, api: RPCInterface, conn_conf: IConnConf) -> None:
+        self._methods_by_name = get_exposed_methods(api)
+        self._dispatchers = {
+            name: AsyncMethodDispatcher(codec, self) for name, codec in make_codecs(self._methods_by_name).items()
+        }
+        self._conn_conf = conn_conf
+        self._name = api.__class__.__name__
+        self._id_prefix = uuid4().hex[:8].encode("ascii")
+        self._ids = itertools.count()
+        timeout = conn_conf.get_timeout()
+        self._timeout = None if timeout == -1 else timeout / 1000
+        # shadow shares sockets namespace with sync context, needed for inproc connections
+        self._ctx = zmq.asyncio.Context.shadow(conn_conf.get_ctx().underlying)
+        self._wire_options = DEFAULT_WIRE_OPTIONS
+
+        self._dealer: Optional[zmq.asyncio.Socket] = None
+        self._notifications: Optional[zmq.asyncio.Socket] = None
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._pending: Dict[bytes, asyncio.Future] = {}
+        self._futures: Dict[bytes, Tuple[asyncio.Future, MethodCodec]] = {}
+        self._streams: Dict[bytes, Tuple[RPCStream, MethodCodec]] = {}
+        self._closed = False
+
+    @property
+    def wire_options(self) -> WireOptions:
+        """
+        Serialization options agreed with server, defaults until first call
+        """
+        return self._wire_options
+
+    def next_id(self) -> bytes:
+        return b"%s-%x" % (self._id_prefix, next(self._ids))
+
+    def __getattr__(self, name) -> Any:
+        dispatcher = self.__dict__.get("_dispatchers", {}).get(name)
+        if dispatcher is None:
+            raise AttributeError(name)
+        return dispatcher
+
+    def __dir__(self):
+        own_methods = self.__dict__.keys()
+        iface_methods = self._methods_by_name.keys()
+        return iface_methods ^ own_methods
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _connect(self) -> None:
+        if self._connect_lock is None:
+            # created lazily to bind to the running loop
+            self._connect_lock = asyncio.Lock()
+
+        async with self._connect_lock:
+            if self._closed:
+                raise Shutdown()
+
+            if self._dealer is not None:
+                return
+
+            dealer = self._ctx.socket(zmq.DEALER)
+            dealer.setsockopt(zmq.LINGER, 0)
+            dealer.connect(self._conn_conf.get_conn_str())
+            self._spawn(self._recv_replies(dealer))
+
+            offer = self._conn_conf.get_wire_options()
+            if offer != DEFAULT_WIRE_OPTIONS:
+                with ExitStack() as stack:
+                    resp = await self._request(dealer, make_handshake(offer, stack))
+                self._wire_options = parse_handshake(resp)
+
+            self._dealer = dealer
+
+    def _listen_notifications(self) -> None:
+        # connected only once needed, server allows a single peer on notification channel
+        if self._notifications is None:
+            self._notifications = self._ctx.socket(zmq.PAIR)
+            self._notifications.setsockopt(zmq.LINGER, 0)
+            self._notifications.connect(self._conn_conf.get_pubsub_conn_str())
+            self._spawn(self._recv_notifications(self._notifications))
+
+    async def _recv_replies(self, dealer: zmq.asyncio.Socket) -> None:
+        while True:
+            try:
+                id_frm, *resp = await dealer.recv_multipart(copy=False)
+            except zmq.ZMQError:
+                return
+
+            fut = self._pending.pop(id_frm.bytes, None)
+            if fut is None:
+                logger.debug("[id: %s] Discarding reply", id_frm.bytes)
+            elif not fut.done():
+                fut.set_result(resp)
+
+    async def _recv_notifications(self, sock: zmq.asyncio.Socket) -> None:
+        while True:
+            try:
+                id_frm, *frames = await sock.recv_multipart(copy=False)
+            except zmq.ZMQError:
+                return
+
+            id_ = id_frm.bytes
+            stream = self._streams.get(id_)
+            if stream is not None:
+                if notify_stream(*stream, frames):
+                    self._streams.pop(id_, None)
+                continue
+
+            fut, codec = self._futures.pop(id_, (None, None))
+            if fut is None or fut.done():
+                continue
+
+            try:
+                result = deserialize_result(codec, iter(frames))
+            except Exception as e:
+                fut.set_exception(e)
+            else:
+                result.to_future(fut)
+
+    async def _request(self, dealer: zmq.asyncio.Socket, frames: List[Any]) -> List[zmq.Frame]:
+        id_ = frames[1]
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[id_] = fut
+
+        try:
+            await dealer.send_multipart(frames, copy=False)
+            mode_frm, *resp = await asyncio.wait_for(fut, self._timeout)
+        except asyncio.TimeoutError:
+            raise Timeout() from None
+        finally:
+            self._pending.pop(id_, None)
+
+        if mode_frm.bytes == Mode.Shutdown.value:
+            self.close()
+            raise Shutdown()
+
+        return resp
+
+    async def call(self, codec: MethodCodec, args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> Any:
+        at = get_deadline()
+        if expired(at):
+            raise DeadlineExceeded(f"Deadline of {codec.name} call exceeded before it was sent")
+
+        await self._connect()
+
+        id_ = self.next_id()
+        logger.debug("[id: %s] Send call %s", id_, codec.name)
+        with traced(start_trace()), wire_options(self._wire_options):
+            header = make_call_header(codec, id_, self._wire_options, at)
+            with span("serialize"):
+                frames = [*header, *codec.serialize_args(args, kwargs)]
+
+        if codec.returns_future:
+            self._listen_notifications()
+            fut = asyncio.get_running_loop().create_future()
+            self._futures[id_] = (fut, codec)
+        elif codec.returns_stream:
+            self._listen_notifications()
+            stream = RPCStream(
+                partial(self._schedule_grant, id_),
+                partial(self._cancel_stream, id_),
+                timeout=self._timeout,
+                async_grant=partial(self._grant, id_),
+            )
+            self._streams[id_] = (stream, codec)
+
+        try:
+            resp = iter(await self._request(self._dealer, frames))
+            if codec.returns_future or codec.returns_stream:
+                deserialize_ack(resp).result()
+        except asyncio.CancelledError:
+            self._futures.pop(id_, None)
+            self._streams.pop(id_, None)
+            self._cancel_call(id_)
+            raise
+        except BaseException:
+            self._futures.pop(id_, None)
+            self._streams.pop(id_, None)
+            raise
+
+        if codec.returns_future:
+            try:
+                return await fut
+            except asyncio.CancelledError:
+                if self._futures.pop(id_, None) is not None:
+                    self._cancel_call(id_)
+                raise
+            finally:
+                self._futures.pop(id_, None)
+
+        if codec.returns_stream:
+            await stream.open_async()
+            return stream
+
+        return deserialize_result(codec, resp).result()
+
+    async def _grant(self, id_: bytes, count: int) -> None:
+        await self._request(self._dealer, [STREAM_CREDIT, self.next_id(), id_, b"%d" % count])
+
+    def _schedule_grant(self, id_: bytes, count: int) -> None:
+        self._spawn(self._grant(id_, count))
+
+    async def _send_control(self, method: bytes, id_: bytes) -> None:
+        try:
+            await self._request(self._dealer, [method, self.next_id(), id_])
+        except (Shutdown, Timeout):
+            logger.debug("[id: %s] Failed to send %s", id_, method)
+
+    def _cancel_call(self, id_: bytes) -> None:
+        # server drops the call if it hasn't started it yet, otherwise discards its result
+        if not self._closed:
+            logger.debug("[id: %s] Cancel call", id_)
+            self._spawn(self._send_control(CANCEL, id_))
+
+    def _cancel_stream(self, id_: bytes) -> None:
+        if self._streams.pop(id_, None) is not None and not self._closed:
+            self._spawn(self._send_control(STREAM_CANCEL, id_))
+
+    def close(self) -> None:
+        """
+        Close sockets, pending calls fail with Shutdown
+        """
+        if self._closed:
+            return
+
+        self._closed = True
+        for task in list(self._tasks):
+            task.cancel()
+
+        for fut in list(self._pending.values()):
+            if not fut.done():
+                fut.set_exception(Shutdown())
+        for fut, _ in list(self._futures.values()):
+            if not fut.done():
+                fut.set_exception(Shutdown())
+        for stream, _ in list(self._streams.values()):
+            stream.finish(Shutdown())
+        self._futures.clear()
+        self._streams.clear()
+
+        for sock in (self._dealer, self._notifications):
+            if sock is not None:
+                sock.close()
+
+    async def aclose(self) -> None:
+        tasks = list(self._tasks)
+        self.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def __aenter__(self) -> "AsyncClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
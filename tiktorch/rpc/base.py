@@ -1,26 +1,74 @@
 import enum
+import functools
 import inspect
+import itertools
 import logging
 import queue
+import struct
 import threading
-from concurrent.futures import Future
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import ExitStack
 from functools import partial
-from typing import Any, Callable, Dict, Generic, Iterator, List, Mapping, Optional, Set, Tuple, TypeVar
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 from uuid import uuid4
 
 import zmq
-
-from .connections import IConnConf
-from .exceptions import CallException, Canceled, Shutdown, Timeout
-from .interface import RPCInterface, get_exposed_methods
-from .serialization import deserialize, serialize
+from zmq.utils import jsonapi
+
+from . import compression, metrics, shm
+from .connections import IConnConf, Transport
+from .deadline import SkipCounter, deadline_at, decode_budget, encode_budget, expired, get_deadline
+from .exceptions import PROPAGATED, CallException, Canceled, DeadlineExceeded, Shutdown, Timeout
+from .interface import RPCInterface, get_exposed_methods, get_serial_groups
+from .serialization import (
+    BINARY_HEADER_VERSION,
+    DEFAULT_WIRE_OPTIONS,
+    WireOptions,
+    deserialize,
+    get_serializer,
+    get_wire_options,
+    serialize,
+    wire_options,
+)
+from .metrics import Call, Metrics, nbytes
+from .pool import SocketPool, pool
+from .stream import RPCStream, StreamProducer, check_stream, isstreamret
+from .tracing import get_trace_id, record, span, start_trace, traced
 from .types import RPCFuture, isfutureret
+from .utils import Lane
 
 logger = logging.getLogger(__name__)
 
 
 T = TypeVar("T")
 
+# reserved method names, negotiate wire options of connection, cancel calls and control flow of streams
+HANDSHAKE = b"__handshake__"
+CANCEL = b"__cancel__"
+STREAM_CREDIT = b"__stream_credit__"
+STREAM_CANCEL = b"__stream_cancel__"
+# first byte of frame following call id of peers using wire options other than defaults,
+# argument frames start with b"T" or binary header marker
+CALL_OPTIONS_MARKER = 0xB8
+# marker, flags, binary header version, followed by name of compression codec
+_call_options_prefix = struct.Struct("<BBB")
+_SHM, _DEADLINES, _TRACING = 1, 2, 4
+
 
 @enum.unique
 class Mode(enum.Enum):
@@ -33,70 +81,75 @@ class State(enum.Enum):
     Return = b"0"
     Error = b"1"
     Ack = b"2"
+    # notifications of streaming calls
+    Item = b"3"
+    End = b"4"
 
 
 def isfuture(obj):
     return isinstance(obj, (RPCFuture, Future))
 
 
-def serialize_args(
-    func: Callable, args: Tuple[Any, ...], kwargs: Optional[Dict[str, Any]] = None
-) -> Iterator[zmq.Frame]:
-
-    kwargs = kwargs or {}
-    ismethod = inspect.ismethod(func)
-
-    sig = inspect.signature(func)
-
-    # Ensure that we only handle class methods
-    if not ismethod:
-        raise ValueError(f"{func} should be bound instance method")
-
-    bound_args = sig.bind(*args, **kwargs).arguments
-
-    for arg in sig.parameters.values():
-        type_ = arg.annotation
-        call_arg = bound_args[arg.name]
-        yield from serialize(call_arg)
-
-
-def deserialize_args(func: Callable, frames: Iterator[zmq.Frame]) -> List[Any]:
-    sig = inspect.signature(func)
-    args = []
-
-    for arg in sig.parameters.values():
-        type_ = arg.annotation
-        args.append(deserialize(frames))
-
-    return args
-
-
-def serialize_return(func: Callable, value: Any) -> Iterator[zmq.Frame]:
-    return serialize(value)
-    # sig = inspect.signature(func)
-
-    # if sig.return_annotation and issubclass(sig.return_annotation, RPCFuture):
-    #     type_, *rest = typing_inspect.get_args(sig.return_annotation)
-    #     if rest:
-    #         raise ValueError("Tuple returns are not supported")
-    #     return serialize(type_, value)
+class MethodCodec:
+    """
+    Serialization of arguments and return value of exposed method
+
+    Signature is inspected once on construction instead of on every call.
+    Arguments whose type matches parameter annotation are serialized
+    without serializer registry lookup.
+    """
+
+    __slots__ = (
+        "name",
+        "wire_name",
+        "func",
+        "returns_future",
+        "returns_stream",
+        "_sig",
+        "_params",
+        "_fast_serializers",
+    )
+
+    def __init__(self, name: str, func: Callable) -> None:
+        if not inspect.ismethod(func):
+            raise ValueError(f"{func} should be bound instance method")
+
+        self.name = name
+        self.wire_name = name.encode("utf-8")
+        self.func = func
+        self.returns_future = isfutureret(func)
+        self.returns_stream = isstreamret(func)
+        self._sig = inspect.signature(func)
+        self._params = tuple(self._sig.parameters.values())
+        self._fast_serializers = tuple((param.annotation, get_serializer(param.annotation)) for param in self._params)
+
+    def serialize_args(self, args: Tuple[Any, ...], kwargs: Optional[Dict[str, Any]] = None) -> List[zmq.Frame]:
+        if kwargs or len(args) != len(self._params):
+            bound = self._sig.bind(*args, **(kwargs or {}))
+            bound.apply_defaults()
+            args = bound.args
+
+        frames = []
+        for arg, (type_, serialize_fast) in zip(args, self._fast_serializers):
+            if serialize_fast is not None and type(arg) is type_:
+                frames.extend(serialize_fast(arg))
+            else:
+                frames.extend(serialize(arg))
 
-    # else:
-    #     return serialize(sig.return_annotation, value)
+        return frames
 
+    def deserialize_args(self, frames: Iterator[zmq.Frame]) -> List[Any]:
+        return [deserialize(frames) for _ in self._params]
 
-def deserialize_return(func: Callable, frames: Iterator[zmq.Frame]) -> Any:
-    sig = inspect.signature(func)
+    def serialize_return(self, value: Any) -> Iterator[zmq.Frame]:
+        return serialize(value)
 
-    # if sig.return_annotation and issubclass(sig.return_annotation, RPCFuture):
-    #     type_, *rest = typing_inspect.get_args(sig.return_annotation)
-    #     if rest:
-    #         raise ValueError("Tuple returns are not supported")
+    def deserialize_return(self, frames: Iterator[zmq.Frame]) -> Any:
+        return deserialize(frames)
 
-    return deserialize(frames)
 
-    # else:
-    #     return deserialize(frames)
+def make_codecs(methods: Mapping[str, Callable]) -> Dict[str, MethodCodec]:
+    return {name: MethodCodec(name, method) for name, method in methods.items()}
 
 
 class Result:
@@ -113,10 +166,14 @@ class Result:
         return self._value
 
     def to_future(self, future: RPCFuture) -> None:
+        # future could have been cancelled while result was on its way
+        if future.done():
+            return
+
         if self._exc:
             future.set_exception(self._exc)
-
-        future.set_result(self._value)
+        else:
+            future.set_result(self._value)
 
 
 class Ack:
@@ -126,20 +183,45 @@ class Ack:
         self._exc = exc
 
     def to_future(self, future: RPCFuture) -> None:
-        if self._exc:
+        if self._exc and not future.done():
             future.set_exception(self._exc)
 
+    def result(self) -> None:
+        if self._exc:
+            raise self._exc
+
+
+def error_frames(exc: Exception) -> List[bytes]:
+    """
+    Error state and message, followed by type name for errors client should be able to tell apart
+    """
+    frames = [State.Error.value, str(exc).encode("utf-8")]
+    if PROPAGATED.get(type(exc).__name__) is type(exc):
+        frames.append(type(exc).__name__.encode("ascii"))
+    return frames
+
+
+def remote_error(frames: Iterator[zmq.Frame]) -> Exception:
+    """
+    Exception of error reply, frames following error state
+    """
+    msg_frm = next(frames, None)
+    kind = next(frames, None)
+    msg = "" if msg_frm is None else _frame_bytes(msg_frm).decode("utf-8")
+    if kind is None:
+        return CallException(msg)
+    return PROPAGATED.get(_frame_bytes(kind).decode("ascii"), CallException)(msg)
 
-def deserialize_result(method: Callable, frames: Iterator[zmq.Frame]):
+
+def deserialize_result(codec: MethodCodec, frames: Iterator[zmq.Frame]):
 
     ctrl_frm = next(frames)
 
     if ctrl_frm.bytes == State.Error.value:
-        msg = next(frames, None)
-        return Result(exc=CallException(msg))
+        return Result(exc=remote_error(frames))
 
     elif ctrl_frm.bytes == State.Return.value:
-        value = deserialize_return(method, frames)
+        value = codec.deserialize_return(frames)
         return Result(value=value)
 
     elif ctrl_frm.bytes == State.Ack.value:
@@ -152,8 +234,7 @@ def deserialize_ack(frames: Iterator[zmq.Frame]):
     ctrl_frm = next(frames)
 
     if ctrl_frm.bytes == State.Error.value:
-        msg = next(frames, None)
-        return Ack(exc=CallException(msg))
+        return Ack(exc=remote_error(frames))
 
     elif ctrl_frm.bytes == State.Ack.value:
         return Ack()
@@ -161,59 +242,451 @@ def deserialize_ack(frames: Iterator[zmq.Frame]):
     raise Exception("Unexpected control frame %s" % ctrl_frm)
 
 
+def notify_stream(stream: RPCStream, codec: MethodCodec, frames: List[zmq.Frame]) -> bool:
+    """
+    Pass item, end or error notification to *stream*
+
+    :returns True if stream is finished
+    """
+    state = frames[0].bytes
+
+    try:
+        if state == State.Item.value:
+            stream.put(codec.deserialize_return(iter(frames[1:])))
+            return False
+
+        if state == State.End.value:
+            exc = None
+        elif state == State.Error.value:
+            exc = remote_error(iter(frames[1:]))
+        else:
+            raise Exception("Unexpected control frame %s" % frames[0])
+    except Exception as e:
+        exc = e
+
+    stream.finish(exc)
+    return True
+
+
+def make_handshake(offer: WireOptions, stack: ExitStack) -> List[bytes]:
+    """
+    :returns handshake request offering *offer* to server,
+        resources server needs to verify the offer are kept open by *stack* until it replies
+    """
+    caps = offer.to_dict()
+    if offer.shm and shm.is_available():
+        caps["shm_probe"], caps["shm_token"] = stack.enter_context(shm.probe())
+    else:
+        caps["shm"] = False
+
+    caps["compression"] = [name for name in offer.compression if name in compression.available()]
+    caps["binary_header"] = min(offer.binary_header, BINARY_HEADER_VERSION)
+
+    return [HANDSHAKE, uuid4().hex.encode("ascii"), jsonapi.dumps(caps)]
+
+
+def parse_handshake(frames: List[zmq.Frame]) -> WireOptions:
+    """
+    :returns wire options agreed by server, defaults if server doesn't support handshake
+    """
+    state_frm, *resp = frames
+    if state_frm.bytes == State.Return.value:
+        agreed = WireOptions.from_dict(jsonapi.loads(resp[0].bytes))
+        logger.debug("Negotiated %s", agreed)
+        return agreed
+
+    logger.warning("Server doesn't support handshake, falling back to default wire options")
+    return DEFAULT_WIRE_OPTIONS
+
+
+@functools.lru_cache(maxsize=None)
+def encode_call_options(options: WireOptions) -> bytes:
+    """
+    :returns frame telling server which optional frames follow and how to encode reply
+    """
+    flags = _SHM if options.shm else 0
+    if options.deadlines:
+        flags |= _DEADLINES
+    if options.tracing:
+        flags |= _TRACING
+
+    codec = options.compression[0] if options.compression else ""
+    return _call_options_prefix.pack(CALL_OPTIONS_MARKER, flags, options.binary_header) + codec.encode("ascii")
+
+
+@functools.lru_cache(maxsize=64)
+def decode_call_options(data: bytes) -> WireOptions:
+    """
+    Options are limited to what this process supports
+    """
+    _marker, flags, binary_header = _call_options_prefix.unpack_from(data)
+    codec = data[_call_options_prefix.size :].decode("ascii")
+    return WireOptions(
+        shm=bool(flags & _SHM) and shm.is_available(),
+        compression=(codec,) if codec in compression.available() else (),
+        binary_header=min(binary_header, BINARY_HEADER_VERSION),
+        deadlines=bool(flags & _DEADLINES),
+        tracing=bool(flags & _TRACING),
+    )
+
+
+def make_call_header(codec: MethodCodec, id_: bytes, options: WireOptions, at: Optional[float]) -> List[bytes]:
+    """
+    :returns method name, call id and unless default options were agreed with server,
+        options of the call followed by optional frames they announce (deadline budget, trace id)
+    """
+    header = [codec.wire_name, id_]
+    if options == DEFAULT_WIRE_OPTIONS:
+        return header
+
+    header.append(encode_call_options(options))
+    if options.deadlines:
+        header.append(encode_budget(at))
+    if options.tracing:
+        header.append((get_trace_id() or "").encode("ascii"))
+
+    return header
+
+
+def parse_call_header(frames: List[zmq.Frame]) -> Tuple[WireOptions, Optional[float], Optional[str], List[zmq.Frame]]:
+    """
+    Server doesn't have to remember options negotiated by peer, every call describes them
+
+    :param frames: frames following call id
+    :returns wire options, deadline and trace id of the call, argument frames
+    """
+    data = frames[0].bytes if frames else b""
+    if not data or data[0] != CALL_OPTIONS_MARKER:
+        return DEFAULT_WIRE_OPTIONS, None, None, frames
+
+    options = decode_call_options(data)
+    at, trace_id, rest = None, None, frames[1:]
+    if options.deadlines:
+        # budget is converted to local deadline on arrival, time spent in queue counts against it
+        budget, *rest = rest
+        at = decode_budget(budget.bytes)
+    if options.tracing:
+        trace_frm, *rest = rest
+        trace_id = trace_frm.bytes.decode("ascii") or None
+
+    return options, at, trace_id, rest
+
+
 class MethodDispatcher:
-    def __init__(self, method_name, method, client):
-        self._method_name = method_name
+    def __init__(self, codec: MethodCodec, client: "Client") -> None:
+        self._codec = codec
         self._client = client
-        self._method = method
-        self._id = uuid4().hex.encode("ascii")
 
     def __call__(self, *args, **kwargs) -> Any:
-        logger.debug("[id: %s] Send call %s", self._id, self._method_name)
-        method_name = self._method_name.encode("utf-8")
-        frames = [method_name, self._id, *serialize_args(self._method, args, kwargs)]
-        is_future = isfutureret(self._method)
+        call = self._client.metrics[self._codec.name].start()
+        try:
+            # calls made outside of traced request start a new trace
+            with traced(start_trace()), span(f"call {self._codec.name}"):
+                res = self._call(args, kwargs, call)
+        except Shutdown:
+            call.finish()
+            raise
+        except BaseException:
+            call.finish(error=True)
+            raise
+
+        if self._codec.returns_future:
+            res.add_done_callback(call.finish_future)
+        elif not self._codec.returns_stream:
+            # stream calls are finished by client once stream ends or is cancelled
+            call.finish()
+        return res
+
+    def _call(self, args: Tuple[Any, ...], kwargs: Dict[str, Any], call: Call) -> Any:
+        stats = call.stats
+        codec = self._codec
+        at = get_deadline()
+        if expired(at):
+            raise DeadlineExceeded(f"Deadline of {codec.name} call exceeded before it was sent")
+
+        # id has to be unique per call, replies and futures are matched by it
+        id_ = self._client.next_id()
+        logger.debug("[id: %s] Send call %s", id_, codec.name)
+        options = self._client.wire_options
+        with wire_options(options), span("serialize"):
+            frames = [*make_call_header(codec, id_, options, at), *codec.serialize_args(args, kwargs)]
+        stats.add_bytes(sent=nbytes(frames))
+        is_future = codec.returns_future
         if is_future:
-            logger.debug("[id: %s] Created future", self._id)
-            fut = self._client.create_future(self._id, self._method)
+            logger.debug("[id: %s] Created future", id_)
+            fut = self._client.create_future(id_, codec)
+        elif codec.returns_stream:
+            logger.debug("[id: %s] Created stream", id_)
+            stream = self._client.create_stream(id_, codec, call)
 
         # temporal dep,
         # postbox (future) should be created before address is known by remote
-        return_frames = iter(self._client.dispatch(frames))
+        try:
+            return_frames = self._client.dispatch(frames)
+        except Exception:
+            if codec.returns_stream:
+                self._client.discard_stream(id_)
+            raise
+
+        stats.add_bytes(received=nbytes(return_frames))
+        return_frames = iter(return_frames)
 
         if is_future:
             ack = deserialize_ack(return_frames)
             ack.to_future(fut)
             return fut
+        elif codec.returns_stream:
+            try:
+                deserialize_ack(return_frames).result()
+            except Exception:
+                self._client.discard_stream(id_)
+                raise
+
+            stream.open()
+            return stream
         else:
-            res = deserialize_result(self._method, return_frames)
+            res = deserialize_result(codec, return_frames)
             return res.result()
 
 
+def reply_timeout(timeout: int) -> Optional[float]:
+    """
+    :param timeout: timeout of connection, see IConnConf.get_timeout
+    :returns seconds to wait for reply to a request, None to wait indefinitely
+    """
+    return None if timeout == -1 else timeout
+
+
+class _Pipeline:
+    """
+    Pipelined request channel over a single DEALER socket
+
+    The socket is owned by a background IO thread. Caller threads hand their
+    requests over through an inproc PUSH socket and block on a future that is
+    resolved when the reply with matching method call id arrives.
+    Any number of requests can be in flight at the same time.
+    """
+
+    def __init__(self, ctx: zmq.Context, conn_str: str, timeout: int, name: str) -> None:
+        self._ctx = ctx
+        self._conn_str = conn_str
+        self._timeout = timeout
+        self._outbox_addr = f"inproc://pipeline-{uuid4().hex}"
+        self._pending: Dict[bytes, Future] = {}
+        self._pending_lock = threading.Lock()
+        self._closed = threading.Event()
+
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), name=f"ClientPipelineThread[{name}]")
+        self._thread.daemon = True
+        self._thread.start()
+        # inproc endpoint has to be bound before we connect to it
+        ready.wait()
+
+        # zmq sockets are not thread safe, access to shared outbox is serialized by lock
+        self._send_lock = threading.Lock()
+        self._outbox = ctx.socket(zmq.PUSH)
+        self._outbox.setsockopt(zmq.LINGER, 0)
+        self._outbox.connect(self._outbox_addr)
+
+    def _run(self, ready: threading.Event) -> None:
+        dealer = self._ctx.socket(zmq.DEALER)
+        dealer.setsockopt(zmq.LINGER, 2000)
+        dealer.connect(self._conn_str)
+
+        outbox = self._ctx.socket(zmq.PULL)
+        outbox.setsockopt(zmq.LINGER, 0)
+        outbox.bind(self._outbox_addr)
+        ready.set()
+
+        poller = zmq.Poller()
+        poller.register(outbox, zmq.POLLIN)
+        poller.register(dealer, zmq.POLLIN)
+
+        while not self._closed.is_set():
+            events = dict(poller.poll())
+
+            if outbox in events:
+                while True:
+                    try:
+                        frames = outbox.recv_multipart(flags=zmq.NOBLOCK, copy=False)
+                    except zmq.Again:
+                        break
+
+                    if len(frames) == 1:
+                        # wakeup sent by close(), requests have at least method name and id
+                        break
+                    dealer.send_multipart(frames, copy=False)
+
+            if dealer in events:
+                while True:
+                    try:
+                        id_frm, *resp = dealer.recv_multipart(flags=zmq.NOBLOCK, copy=False)
+                    except zmq.Again:
+                        break
+
+                    with self._pending_lock:
+                        fut = self._pending.pop(id_frm.bytes, None)
+
+                    if fut is None:
+                        logger.debug("[id: %s] Discarding reply", id_frm.bytes)
+                    else:
+                        fut.set_result(resp)
+
+        outbox.close()
+        dealer.close()
+
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+
+        for fut in pending.values():
+            fut.set_exception(Shutdown())
+
+    def dispatch(self, frames: List[zmq.Frame]) -> List[zmq.Frame]:
+        id_ = frames[1]
+        fut = Future()
+        with self._pending_lock:
+            self._pending[id_] = fut
+
+        with self._send_lock:
+            if self._closed.is_set():
+                raise Shutdown()
+
+            self._outbox.send_multipart(frames, copy=False)
+
+        try:
+            return fut.result(timeout=reply_timeout(self._timeout))
+        except FutureTimeoutError:
+            with self._pending_lock:
+                self._pending.pop(id_, None)
+            raise Timeout() from None
+
+    def close(self) -> None:
+        with self._send_lock:
+            if not self._closed.is_set():
+                self._closed.set()
+                self._outbox.send(b"")
+                self._outbox.close()
+
+
 class Client:
-    def __init__(self, api: RPCInterface, conn_conf: IConnConf) -> None:
+    def __init__(self, api: RPCInterface, conn_conf: IConnConf, *, socket_pool: Optional[SocketPool] = None) -> None:
 
         self._methods_by_name = get_exposed_methods(api)
+        self._dispatchers = {
+            name: MethodDispatcher(codec, self) for name, codec in make_codecs(self._methods_by_name).items()
+        }
+        # unique per client, prefix avoids clashes between clients sharing a notification channel
+        self._id_prefix = uuid4().hex[:8].encode("ascii")
+        self._ids = itertools.count()
         self._conn_conf = conn_conf
 
         self._name = api.__class__.__name__
-        self._local = threading.local()
-        self._poller = zmq.Poller()
+        self._metrics = metrics.registry.client(self._name)
+        # REQ sockets are shared with other clients of the same connection
+        self._pool = socket_pool or pool
+        # listener thread blocks until notification arrives or it's woken up on shutdown
+        self._wake_addr = f"inproc://client-wake-{uuid4().hex}"
         self._timeout = conn_conf.get_timeout()
         self._futures = {}
+        self._streams: Dict[bytes, Tuple[RPCStream, MethodCodec]] = {}
+        self._stream_calls: Dict[bytes, Call] = {}
         self._shutdown = threading.Event()
         self._listener = None
         self._ctx = self._conn_conf.get_ctx()
+        self._transport = self._conn_conf.get_transport()
+        self._pipeline: Optional[_Pipeline] = None
+        self._pipeline_lock = threading.Lock()
+        self._wire_options: Optional[WireOptions] = None
+
+    @property
+    def metrics(self) -> Metrics:
+        """
+        Stats of calls made by clients of this interface in this process
+        """
+        return self._metrics
+
+    @property
+    def wire_options(self) -> WireOptions:
+        """
+        Serialization options agreed with server, negotiated when connection is established
+        """
+        # connection is established lazily on first access
+        if self._transport == Transport.Pipelined:
+            self._pipelined  # noqa: B018
+        elif self._wire_options is None:
+            # sockets of one connection config agree on the same options
+            self._wire_options = self._pool.wire_options(self._conn_conf, self._setup_socket)
+
+        return self._wire_options
 
-    def create_future(self, id_, method):
+    def _negotiate(self, dispatch: Callable[[List[bytes]], List[zmq.Frame]]) -> WireOptions:
+        offer = self._conn_conf.get_wire_options()
+        if offer == DEFAULT_WIRE_OPTIONS:
+            return DEFAULT_WIRE_OPTIONS
+
+        with ExitStack() as stack:
+            _mode_frm, *resp = dispatch(make_handshake(offer, stack))
+
+        return parse_handshake(resp)
+
+    def next_id(self) -> bytes:
+        return b"%s-%x" % (self._id_prefix, next(self._ids))
+
+    def create_future(self, id_: bytes, codec: MethodCodec) -> RPCFuture:
         if self._listener is None:
             self._start_listener()
 
         fut_timeout = self._timeout if self._timeout != -1 else None  # infinite timeout: zmq: -1, Future: None
         f = RPCFuture(timeout=fut_timeout)
-        self._futures[id_] = (f, method)
+        self._futures[id_] = (f, codec)
+        f.add_done_callback(partial(self._on_future_done, id_))
         return f
 
+    def _on_future_done(self, id_: bytes, fut: RPCFuture) -> None:
+        # entry is already gone if future was resolved by notification
+        if self._futures.pop(id_, None) is None or not fut.cancelled() or self._shutdown.is_set():
+            return
+
+        logger.debug("[id: %s] Cancel call", id_)
+        try:
+            self.dispatch([CANCEL, self.next_id(), id_])
+        except (Shutdown, Timeout):
+            logger.debug("[id: %s] Failed to send cancellation", id_)
+
+    def create_stream(self, id_: bytes, codec: MethodCodec, call: Optional[Call] = None) -> RPCStream:
+        """
+        :param call: finished once stream ends or is cancelled
+        """
+        if self._listener is None:
+            self._start_listener()
+
+        timeout = self._timeout if self._timeout != -1 else None
+        stream = RPCStream(partial(self._grant_credit, id_), partial(self._cancel_stream, id_), timeout=timeout)
+        self._streams[id_] = (stream, codec)
+        if call is not None:
+            self._stream_calls[id_] = call
+        return stream
+
+    def discard_stream(self, id_: bytes) -> None:
+        self._streams.pop(id_, None)
+        self._stream_calls.pop(id_, None)
+
+    def _finish_stream_call(self, id_: bytes, error: bool = False) -> None:
+        call = self._stream_calls.pop(id_, None)
+        if call is not None:
+            call.finish(error)
+
+    def _grant_credit(self, id_: bytes, count: int) -> None:
+        self.dispatch([STREAM_CREDIT, self.next_id(), id_, b"%d" % count])
+
+    def _cancel_stream(self, id_: bytes) -> None:
+        self._finish_stream_call(id_)
+        if self._streams.pop(id_, None) is None or self._shutdown.is_set():
+            return
+
+        self.dispatch([STREAM_CANCEL, self.next_id(), id_])
+
     def _start_listener(self):
         def _listen():
             ctx = self._ctx
@@ -223,71 +696,123 @@ class Client:
             sock.SNDTIMEO = self._timeout
             sock.connect(self._conn_conf.get_pubsub_conn_str())
 
+            wake = ctx.socket(zmq.PULL)
+            wake.setsockopt(zmq.LINGER, 0)
+            wake.bind(self._wake_addr)
+            ready.set()
+
+            poller = zmq.Poller()
+            poller.register(sock, zmq.POLLIN)
+            poller.register(wake, zmq.POLLIN)
+
             while True:
-                events = sock.poll(flags=zmq.POLLIN, timeout=500)
+                events = dict(poller.poll())
 
-                if events == zmq.POLLIN:
+                if sock in events:
                     id_frm, *return_frames = sock.recv_multipart(copy=False)
                     id_ = id_frm.bytes
-                    logger.debug("[id: %s] Recieved return", id_)
-                    fut, method = self._futures.pop(id_, (None, None))
-                    if fut is not None:
-                        try:
-                            result = deserialize_result(method, iter(return_frames))
-                        except Exception as e:
-                            fut.set_exception(e)
-                        else:
-                            result.to_future(fut)
-
-                if self._shutdown.is_set():
+                    stream = self._streams.get(id_)
+                    if stream is not None:
+                        self._metrics[stream[1].name].add_bytes(received=nbytes(return_frames))
+                        if notify_stream(*stream, return_frames):
+                            self._streams.pop(id_, None)
+                            self._finish_stream_call(id_, error=return_frames[0].bytes != State.End.value)
+                    else:
+                        logger.debug("[id: %s] Recieved return", id_)
+                        fut, codec = self._futures.pop(id_, (None, None))
+                        if fut is not None:
+                            self._metrics[codec.name].add_bytes(received=nbytes(return_frames))
+                            try:
+                                result = deserialize_result(codec, iter(return_frames))
+                            except Exception as e:
+                                fut.set_exception(e)
+                            else:
+                                result.to_future(fut)
+
+                if wake in events:
                     sock.close()
+                    wake.close()
                     break
 
+        ready = threading.Event()
         self._listener = threading.Thread(target=_listen, name=f"ClientNotificationsThread[{self._name}]")
         self._listener.daemon = True
         self._listener.start()
+        # wake endpoint has to be bound before shutdown connects to it
+        ready.wait()
 
-    @property
-    def _socket(self):
-        sock = getattr(self._local, "sock", None)
+    def _wake_listener(self) -> None:
+        if self._listener is None:
+            return
 
-        if sock is None:
-            ctx = self._conn_conf.get_ctx()
-            sock = ctx.socket(zmq.REQ)
-            sock.setsockopt(zmq.LINGER, 2000)
-            sock.RCVTIMEO = self._timeout
-            sock.SNDTIMEO = self._timeout
-            sock.connect(self._conn_conf.get_conn_str())
-            setattr(self._local, "sock", sock)
+        wake = self._ctx.socket(zmq.PUSH)
+        wake.setsockopt(zmq.LINGER, 0)
+        wake.connect(self._wake_addr)
+        wake.send(b"")
+        wake.close()
 
-        return sock
+    def _setup_socket(self, sock: zmq.Socket) -> WireOptions:
+        return self._negotiate(partial(self._send_recv, sock))
 
     def __getattr__(self, name) -> Any:
-        method = self._methods_by_name.get(name)
-        if method is None:
+        dispatcher = self.__dict__.get("_dispatchers", {}).get(name)
+        if dispatcher is None:
             raise AttributeError(name)
-        return MethodDispatcher(name, method, self)
+        return dispatcher
 
-    def dispatch(self, frames: List[zmq.Frame]):
-        evt = self._socket.poll(self._timeout, flags=zmq.POLLOUT)
+    @property
+    def _pipelined(self) -> _Pipeline:
+        if self._pipeline is None:
+            with self._pipeline_lock:
+                if self._pipeline is None:
+                    pipeline = _Pipeline(self._ctx, self._conn_conf.get_conn_str(), self._timeout, self._name)
+                    self._wire_options = self._negotiate(pipeline.dispatch)
+                    self._pipeline = pipeline
+
+        return self._pipeline
+
+    def _send_recv(self, sock: zmq.Socket, frames: List[zmq.Frame]) -> List[zmq.Frame]:
+        evt = sock.poll(self._timeout, flags=zmq.POLLOUT)
         if not evt:
             raise Timeout()
 
-        frames = self._socket.send_multipart(frames, copy=False)
+        sock.send_multipart(frames, copy=False)
 
-        evt = self._socket.poll(1000 * self._timeout, flags=zmq.POLLIN)
+        seconds = reply_timeout(self._timeout)
+        evt = sock.poll(None if seconds is None else 1000 * seconds, flags=zmq.POLLIN)
         if not evt:
             raise Timeout()
 
-        mode_frm, *resp = self._socket.recv_multipart(copy=False)
+        return sock.recv_multipart(copy=False)
+
+    def _dispatch_reqrep(self, frames: List[zmq.Frame]) -> List[zmq.Frame]:
+        # socket which timed out is left in the middle of request and discarded by the pool
+        with self._pool.socket(self._conn_conf, self._setup_socket) as entry:
+            return self._send_recv(entry.socket, frames)
+
+    def dispatch(self, frames: List[zmq.Frame]):
+        if self._transport == Transport.Pipelined:
+            mode_frm, *resp = self._pipelined.dispatch(frames)
+        else:
+            mode_frm, *resp = self._dispatch_reqrep(frames)
 
         if mode_frm.bytes == Mode.Shutdown.value:
-            self._socket.close()
+            if self._transport == Transport.Pipelined:
+                self._pipelined.close()
+            else:
+                self._pool.clear(self._conn_conf)
 
             for f, _ in list(self._futures.values()):
-                f.set_exception(Shutdown())
+                if not f.done():
+                    f.set_exception(Shutdown())
 
             self._shutdown.set()
+            self._wake_listener()
+
+            for id_, (stream, _) in list(self._streams.items()):
+                self._finish_stream_call(id_, error=True)
+                stream.finish(Shutdown())
+            self._streams.clear()
 
             raise Shutdown()
 
@@ -299,28 +824,135 @@ class Client:
         return iface_methods ^ own_methods
 
 
+def _split_envelope(frames: List[zmq.Frame]) -> Tuple[List[zmq.Frame], List[zmq.Frame]]:
+    """
+    Split frames received on ROUTER socket into reply envelope and request
+
+    REQ peers prefix request with an empty delimiter frame, which has to be echoed back.
+    DEALER peers (pipelined transport) send bare requests and expect the method call id
+    as the first frame of reply to match it with pending request.
+    """
+    identity, *frames = frames
+
+    if not frames[0].bytes:
+        return [identity, frames[0]], frames[1:]
+
+    return [identity, frames[1]], frames
+
+
 class Server:
-    def __init__(self, api: RPCInterface, conn_conf: IConnConf) -> None:
+    """
+    Serves *api* over ROUTER socket
+
+    By default every call is executed on the listening thread one after another.
+    With *max_workers* > 0 calls are executed on a pool of worker threads so
+    that long running calls don't delay the fast ones:
+
+    :param max_workers: size of worker pool, 0 executes calls inline
+    :param serial_methods: names of methods executed one at a time in order of arrival
+        (e.g. methods changing server state), methods decorated with @serial are ordered as declared
+    :param method_limits: maximum number of concurrently executed calls per method name
+
+    Calls cancelled by client or past their deadline are dropped if they haven't started yet,
+    number of dropped calls is reported by *skipped*.
+    """
+
+    _sentinel = object()
+
+    def __init__(
+        self,
+        api: RPCInterface,
+        conn_conf: IConnConf,
+        *,
+        max_workers: int = 0,
+        serial_methods: Iterable[str] = (),
+        method_limits: Optional[Mapping[str, int]] = None,
+    ) -> None:
+        if max_workers < 0:
+            raise ValueError(f"max_workers should be non-negative, got {max_workers}")
+
+        method_by_name = get_exposed_methods(api)
+        method_limits = dict(method_limits or {})
+        serial_methods = set(serial_methods)
+        unknown = (serial_methods | set(method_limits)) - set(method_by_name)
+        if unknown:
+            raise ValueError(f"Unknown methods {sorted(unknown)}")
 
         self._api = api
 
         self._ctx = ctx = conn_conf.get_ctx()
         self._conn_conf = conn_conf
-        sock = ctx.socket(zmq.REP)
+        # ROUTER serves both REQ (lockstep) and DEALER (pipelined) clients
+        sock = ctx.socket(zmq.ROUTER)
         sock.setsockopt(zmq.LINGER, 0)
         sock.RCVTIMEO = 2000
         sock.SNDTIMEO = 2000
+        conn_conf.prepare_endpoints()
         sock.bind(conn_conf.get_conn_str())
 
-        self._futures: Set[Future[Any]] = set()
+        self._futures: Dict[bytes, Future] = {}
+        self._streams: Dict[bytes, StreamProducer] = {}
+        # stream calls are finished when stream ends or is cancelled
+        self._stream_calls: Dict[bytes, Call] = {}
+        # ids of calls waiting for a worker, True if call was cancelled
+        self._queued: Dict[bytes, bool] = {}
+        self._queued_lock = threading.Lock()
+        self._skipped = SkipCounter()
+        self._metrics = metrics.registry.server(type(api).__name__)
 
         self._socket = sock
-        self._method_by_name = get_exposed_methods(api)
+        self._method_by_name = method_by_name
+        self._codecs = {codec.wire_name: codec for codec in make_codecs(method_by_name).values()}
         self._pub_lock = threading.Lock()
         self._results_queue = queue.Queue()
         self._shutdown_event = threading.Event()
         self._result_sender = None
 
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lanes: Dict[str, Lane] = {}
+        self._default_lane: Optional[Lane] = None
+        self._replies_addr = f"inproc://server-replies-{uuid4().hex}"
+        self._replies_lock = threading.Lock()
+        self._replies_out: Optional[zmq.Socket] = None
+        self._replies_in: Optional[zmq.Socket] = None
+
+        if max_workers:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ServerWorker")
+            self._default_lane = Lane(self._executor, max_workers)
+            serial_lane = Lane(self._executor, 1)
+            for name in serial_methods:
+                self._lanes[name] = serial_lane
+            for name, limit in method_limits.items():
+                if name not in serial_methods:
+                    self._lanes[name] = Lane(self._executor, limit)
+
+            group_lanes: Dict[str, Lane] = {}
+            for name, group in get_serial_groups(api).items():
+                if name not in self._lanes:
+                    self._lanes[name] = group_lanes.setdefault(group, Lane(self._executor, 1))
+
+            # workers hand replies over to listening thread which owns ROUTER socket
+            self._replies_in = ctx.socket(zmq.PULL)
+            self._replies_in.setsockopt(zmq.LINGER, 0)
+            self._replies_in.bind(self._replies_addr)
+            self._replies_out = ctx.socket(zmq.PUSH)
+            self._replies_out.setsockopt(zmq.LINGER, 0)
+            self._replies_out.connect(self._replies_addr)
+
+    @property
+    def skipped(self) -> Dict[str, int]:
+        """
+        Number of calls dropped because they were cancelled or past deadline
+        """
+        return self._skipped.as_dict()
+
+    @property
+    def metrics(self) -> Metrics:
+        """
+        Stats of served calls, shared by servers of the same api class in this process
+        """
+        return self._metrics
+
     def _start_result_sender(self):
         def _sender():
             pub = self._ctx.socket(zmq.PAIR)
@@ -330,93 +962,368 @@ class Server:
             pub.bind(self._conn_conf.get_pubsub_conn_str())
 
             while True:
-                try:
-                    result = self._results_queue.get(timeout=0.5)
-                    pub.send_multipart(result)
-                except queue.Empty:
-                    pass
-
-                if self._shutdown_event.is_set():
+                result = self._results_queue.get()
+                if result is self._sentinel:
                     pub.close()
                     break
 
+                pub.send_multipart(result)
+
         t = threading.Thread(target=_sender, name="ResultSender")
         t.start()
         return t
 
-    def _make_done_callback(self, id_: bytes, func: Callable[..., Any]) -> Callable[[Future], None]:
+    def _ensure_result_sender(self) -> None:
+        with self._pub_lock:
+            if self._result_sender is None:
+                self._result_sender = self._start_result_sender()
+
+    def _make_done_callback(self, id_: bytes, codec: MethodCodec, call: Call) -> Callable[[Future], None]:
         logger.debug("[id: %s]. Created done callback", id_)
-        if self._result_sender is None:
-            self._result_sender = self._start_result_sender()
+        self._ensure_result_sender()
+
+        options = get_wire_options()
+        trace_id = get_trace_id()
 
         def _done_callback(fut: Future) -> None:
-            self._futures.discard(fut)
+            self._futures.pop(id_, None)
+            if fut.cancelled():
+                logger.debug("[id: %s]. Future cancelled", id_)
+                call.finish(error=True)
+                return
 
             try:
                 result = fut.result()
-                resp = [id_, State.Return.value, *serialize_return(func, result)]
+                with wire_options(options), span("reply", trace_id):
+                    resp = [id_, State.Return.value, *codec.serialize_return(result)]
             except Exception as e:
                 logger.error("[id: %s]. Future expection", id_, exc_info=1)
-                resp = [id_, State.Error.value, str(e).encode("utf-8")]
+                resp = [id_, *error_frames(e)]
+                call.finish(error=True)
+            else:
+                call.finish()
 
+            call.stats.add_bytes(sent=nbytes(resp))
             logger.debug("[id: %s]. Sending result", id_)
             self._results_queue.put(resp)
 
         return _done_callback
 
-    def _call(self, func: Callable, id_: bytes, frames: List[zmq.Frame]) -> List[zmq.Frame]:
-        frames_it = iter(frames)
-        args = deserialize_args(func, frames_it)
+    def _start_stream(self, id_: bytes, codec: MethodCodec, iterable: Iterable[Any], call: Call) -> None:
+        """
+        Items are produced once client grants credit for them and sent over notification channel
+        """
+        self._ensure_result_sender()
+        options = get_wire_options()
+
+        def _emit_item(item: Any) -> None:
+            with wire_options(options):
+                frames = [id_, State.Item.value, *codec.serialize_return(item)]
+            call.stats.add_bytes(sent=nbytes(frames))
+            self._results_queue.put(frames)
+
+        def _emit_end(exc: Optional[Exception]) -> None:
+            self._streams.pop(id_, None)
+            if self._stream_calls.pop(id_, None) is not None:
+                call.finish(error=exc is not None)
+            if exc is None:
+                self._results_queue.put([id_, State.End.value])
+            else:
+                self._results_queue.put([id_, *error_frames(exc)])
+
+        producer = StreamProducer(iter(iterable), _emit_item, _emit_end, name=codec.name)
+        self._streams[id_] = producer
+        self._stream_calls[id_] = call
+        producer.start()
+
+    def _cancel_stream(self, id_: bytes) -> None:
+        producer = self._streams.pop(id_, None)
+        if producer is not None:
+            producer.cancel()
+
+        call = self._stream_calls.pop(id_, None)
+        if call is not None:
+            call.finish()
+
+    def _stream_control(self, envelope: List[zmq.Frame], method_name: bytes, frames: List[zmq.Frame]):
+        producer = self._streams.get(frames[0].bytes)
+        # stream could have finished in the meantime
+        if producer is not None:
+            if method_name == STREAM_CREDIT:
+                producer.grant(int(frames[1].bytes))
+            else:
+                self._cancel_stream(frames[0].bytes)
+
+        return [*envelope, Mode.Normal.value, State.Ack.value]
+
+    def _cancel(self, envelope: List[zmq.Frame], frames: List[zmq.Frame]) -> List[Union[bytes, zmq.Frame]]:
+        id_ = frames[0].bytes
+
+        with self._queued_lock:
+            if id_ in self._queued:
+                # dropped once worker picks it up
+                self._queued[id_] = True
+                return [*envelope, Mode.Normal.value, State.Ack.value]
+
+        self._cancel_stream(id_)
 
-        logger.debug("[id: %s]. Invoking method %s", id_, func)
-        ret = func(*args)
+        fut = self._futures.pop(id_, None)
+        if fut is not None and fut.cancel():
+            logger.debug("[id: %s]. Cancelled", id_)
+            self._skipped.cancelled()
+
+        return [*envelope, Mode.Normal.value, State.Ack.value]
+
+    def _call(self, codec: MethodCodec, id_: bytes, frames: List[zmq.Frame], call: Call) -> List[zmq.Frame]:
+        """
+        :param call: finished once result is sent, unless call raises
+        """
+        with span("deserialize"):
+            args = codec.deserialize_args(iter(frames))
+
+        logger.debug("[id: %s]. Invoking method %s", id_, codec.name)
+        ret = codec.func(*args)
         logger.debug("[id: %s]. Return value", id_)
 
         if isfuture(ret):
             logger.debug("[id: %s]. Handling future", id_)
 
-            self._futures.add(ret)
-            ret.add_done_callback(self._make_done_callback(id_, func))
+            self._futures[id_] = ret
+            ret.add_done_callback(self._make_done_callback(id_, codec, call))
 
             return [State.Ack.value]
 
-        return [State.Return.value, *serialize_return(func, ret)]
+        check_stream(codec.name, codec.returns_stream, ret)
+        if codec.returns_stream:
+            logger.debug("[id: %s]. Handling stream", id_)
+            self._start_stream(id_, codec, ret, call)
+            return [State.Ack.value]
 
-    def listen(self):
-        while True:
+        with span("reply"):
+            frames = [State.Return.value, *codec.serialize_return(ret)]
+        call.finish()
+        call.stats.add_bytes(sent=nbytes(frames))
+        return frames
+
+    def _process(
+        self,
+        envelope: List[zmq.Frame],
+        method_name: bytes,
+        method_id: bytes,
+        args: List[zmq.Frame],
+        options: WireOptions = DEFAULT_WIRE_OPTIONS,
+        at: Optional[float] = None,
+        trace_id: Optional[str] = None,
+    ):
+        """
+        Executes method call and returns reply frames
+
+        :param options: wire options reply is serialized with
+        :param at: deadline of the call
+        :param trace_id: trace id of request the call is made for
+        :raises Shutdown: if server should shutdown after the call
+        """
+        codec = self._codecs.get(method_name)
+
+        if expired(at):
+            logger.debug("[id: %s]. Deadline exceeded, skipping", method_id)
+            self._skipped.expired()
+            return [*envelope, Mode.Normal.value, *error_frames(DeadlineExceeded("Deadline exceeded"))]
+
+        try:
+            if codec is None:
+                raise Exception(f"Unknown method {method_name}")
+
+            stats = self._metrics[codec.name]
+            stats.add_bytes(received=nbytes(args))
+            call = stats.start()
             try:
-                frames = self._socket.recv_multipart(copy=False)
-            except zmq.Again:
-                continue
-            method_frm, method_id_frm, *args = frames
+                with wire_options(options), deadline_at(at), traced(trace_id), span(f"handle {codec.name}"):
+                    resp_frames = self._call(codec, method_id, args, call)
+            except Shutdown:
+                call.finish()
+                raise
+            except Exception:
+                call.finish(error=True)
+                raise
+
+        except Shutdown:
+            raise
+
+        except Exception as e:
+            logger.exception("Exception during method %s call", method_name)
+            # TODO: Better exception serialization
+            return [*envelope, Mode.Normal.value, *error_frames(e)]
+
+        return [*envelope, Mode.Normal.value, *resp_frames]
+
+    def _process_in_worker(self, envelope, method_name, method_id, args, options, at, trace_id, queued_at) -> None:
+        record("queue wait", queued_at, time.monotonic(), trace_id)
+        with self._queued_lock:
+            cancelled = self._queued.pop(method_id, False)
+
+        if cancelled:
+            logger.debug("[id: %s]. Cancelled before start, skipping", method_id)
+            self._skipped.cancelled()
+            reply = [*envelope, Mode.Normal.value, *error_frames(Canceled("Cancelled"))]
+        else:
+            try:
+                reply = self._process(envelope, method_name, method_id, args, options, at, trace_id)
+            except Shutdown:
+                reply = [*envelope, Mode.Shutdown.value]
 
-            method_name = method_frm.bytes
-            method_id = method_id_frm.bytes
-            logger.debug("Invoking %s method", method_name)
+        with self._replies_lock:
+            if self._replies_out is None:
+                logger.debug("[id: %s] Server is shut down, dropping reply", method_id)
+                return
 
-            method = self._method_by_name.get(method_name.decode("utf-8"))
+            self._replies_out.send_multipart(reply, copy=False)
 
-            try:
-                if method is None:
-                    raise Exception(f"Unknown method {method_name}")
+    def _dispatch(self, envelope, method_name, method_id, args) -> Optional[List[zmq.Frame]]:
+        """
+        Executes call inline or submits it to worker pool
+
+        :returns reply frames for inline call, None if call was submitted
+        """
+        if method_name == HANDSHAKE:
+            return self._handshake(envelope, args)
+
+        if method_name in (STREAM_CREDIT, STREAM_CANCEL):
+            return self._stream_control(envelope, method_name, args)
+
+        if method_name == CANCEL:
+            return self._cancel(envelope, args)
 
-                resp_frames = self._call(method, method_id, args)
+        try:
+            options, at, trace_id, args = parse_call_header(args)
+        except Exception as e:
+            logger.exception("Malformed call header")
+            return [*envelope, Mode.Normal.value, *error_frames(e)]
 
+        if self._executor is None:
+            try:
+                return self._process(envelope, method_name, method_id, args, options, at, trace_id)
             except Shutdown:
-                self._shutdown_event.set()
-                if self._result_sender:
-                    self._result_sender.join()
-                for f in list(self._futures):
-                    f.cancel()
-                self._socket.send_multipart([Mode.Shutdown.value])
-                self._socket.close()
-                break
+                return [*envelope, Mode.Shutdown.value]
+
+        with self._queued_lock:
+            self._queued[method_id] = False
+
+        lane = self._lanes.get(method_name.decode("utf-8"), self._default_lane)
+        lane.submit(
+            partial(
+                self._process_in_worker,
+                envelope,
+                method_name,
+                method_id,
+                args,
+                options,
+                at,
+                trace_id,
+                time.monotonic(),
+            )
+        )
+        return None
+
+    def _handshake(self, envelope: List[zmq.Frame], frames: List[zmq.Frame]) -> List[Union[bytes, zmq.Frame]]:
+        """
+        Agree on wire options with connecting peer
+        """
+        try:
+            offer = jsonapi.loads(frames[0].bytes)
+        except Exception as e:
+            logger.exception("Malformed handshake")
+            return [*envelope, Mode.Normal.value, State.Error.value, str(e).encode("utf-8")]
+
+        own = self._conn_conf.get_wire_options()
+        # probe segment is accessible only if peer shares memory with us
+        use_shm = bool(own.shm and offer.get("shm") and shm.check_probe(offer["shm_probe"], offer["shm_token"]))
+        codec = compression.negotiate(offer.get("compression", ()), own.compression)
+        # peers without binary header support don't offer it
+        binary_header = min(int(offer.get("binary_header", 0)), own.binary_header, BINARY_HEADER_VERSION)
+
+        agreed = WireOptions(
+            shm=use_shm,
+            compression=(codec,) if codec else (),
+            binary_header=binary_header,
+            deadlines=bool(offer.get("deadlines")) and own.deadlines,
+            tracing=bool(offer.get("tracing")) and own.tracing,
+        )
+        logger.debug("Negotiated %s", agreed)
+        return [*envelope, Mode.Normal.value, State.Return.value, jsonapi.dumps(agreed.to_dict())]
+
+    def _shutdown(self, envelope: List[zmq.Frame]) -> None:
+        self._shutdown_event.set()
+
+        for id_ in list(self._streams):
+            self._cancel_stream(id_)
+
+        if self._executor is not None:
+            for lane in {self._default_lane, *self._lanes.values()}:
+                lane.clear()
+            with self._queued_lock:
+                self._queued.clear()
+
+            with self._replies_lock:
+                self._replies_out.close()
+                self._replies_out = None
+
+            self._replies_in.close()
+            self._executor.shutdown(wait=False)
+
+        if self._result_sender:
+            self._results_queue.put(self._sentinel)
+            self._result_sender.join()
+        for f in list(self._futures.values()):
+            f.cancel()
+        self._socket.send_multipart([*envelope, Mode.Shutdown.value])
+        self._socket.close()
+        self._conn_conf.cleanup_endpoints()
+
+    def _send_reply(self, reply: List[Union[bytes, zmq.Frame]]) -> bool:
+        """
+        :returns True if server was shut down
+        """
+        envelope, mode = reply[:2], reply[2]
+        if _frame_bytes(mode) == Mode.Shutdown.value:
+            self._shutdown(envelope)
+            return True
+
+        self._socket.send_multipart(reply, copy=False)
+        return False
 
-            except Exception as e:
-                logger.exception("Exception during method %s call", method)
-                # TODO: Better exception serialization
-                self._socket.send_multipart([Mode.Normal.value, State.Error.value, str(e).encode("ascii")])
-            # TODO: rearm socket after timeout to avoid being stuck in sending state
-            # in case of client missing (dead)
-            else:
-                self._socket.send_multipart([Mode.Normal.value, *resp_frames], copy=False)
+    def listen(self):
+        poller = zmq.Poller()
+        poller.register(self._socket, zmq.POLLIN)
+        if self._replies_in is not None:
+            poller.register(self._replies_in, zmq.POLLIN)
+
+        while True:
+            events = dict(poller.poll())
+
+            if self._replies_in is not None and self._replies_in in events:
+                while True:
+                    try:
+                        reply = self._replies_in.recv_multipart(flags=zmq.NOBLOCK, copy=False)
+                    except zmq.Again:
+                        break
+
+                    if self._send_reply(reply):
+                        return
+
+            if self._socket in events:
+                while True:
+                    try:
+                        frames = self._socket.recv_multipart(flags=zmq.NOBLOCK, copy=False)
+                    except zmq.Again:
+                        break
+
+                    envelope, (method_frm, method_id_frm, *args) = _split_envelope(frames)
+                    logger.debug("Invoking %s method", method_frm.bytes)
+                    reply = self._dispatch(envelope, method_frm.bytes, method_id_frm.bytes, args)
+                    if reply is not None and self._send_reply(reply):
+                        return
+
+
+def _frame_bytes(frame: Union[bytes, zmq.Frame]) -> bytes:
+    return frame.bytes if isinstance(frame, zmq.Frame) else frame
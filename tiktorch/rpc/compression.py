@@ -0,0 +1,123 @@
+"""
+Compression codecs for large payload frames
+
+Codec is negotiated per connection, see WireOptions.compression.
+Frames smaller than MIN_SIZE and frames which don't shrink are sent as is.
+"""
+import lzma
+import threading
+import zlib
+from typing import Callable, Dict, List, Optional, Sequence
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# compressing tiny frames costs more than it saves
+MIN_SIZE = 4 * 1024
+
+
+class Codec:
+    def __init__(self, name: str, compress: Callable[[bytes], bytes], decompress: Callable[[bytes], bytes]) -> None:
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+
+    def __repr__(self) -> str:
+        return f"Codec({self.name})"
+
+
+_codecs: Dict[str, Codec] = {}
+
+
+def register(codec: Codec) -> None:
+    _codecs[codec.name] = codec
+
+
+if lz4 is not None:
+    register(Codec("lz4", lz4.frame.compress, lz4.frame.decompress))
+register(Codec("zlib", lambda data: zlib.compress(data, 1), zlib.decompress))
+register(Codec("lzma", lambda data: lzma.compress(data, preset=0), lzma.decompress))
+
+
+def available() -> List[str]:
+    """
+    :returns names of codecs supported by this process, fastest first
+    """
+    return list(_codecs)
+
+
+def negotiate(offered: Sequence[str], supported: Sequence[str]) -> Optional[str]:
+    """
+    :returns first of *offered* codecs which is *supported* and available
+    """
+    for name in offered:
+        if name in supported and name in _codecs:
+            return name
+
+    return None
+
+
+class Stats:
+    """
+    Number of bytes passed through codecs
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    def add(self, name: str, **values: int) -> None:
+        with self._lock:
+            counters = self._counters.setdefault(
+                name, {"frames": 0, "skipped": 0, "bytes_in": 0, "bytes_out": 0, "decompressed": 0}
+            )
+            for key, value in values.items():
+                counters[key] += value
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        """
+        :returns per codec counters
+            frames: number of compressed frames
+            skipped: number of frames sent uncompressed (too small or incompressible)
+            bytes_in, bytes_out: size of compressed frames before and after compression
+            decompressed: number of decompressed frames
+        """
+        with self._lock:
+            return {name: dict(counters) for name, counters in self._counters.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+
+
+stats = Stats()
+
+
+def compress(name: str, data) -> Optional[bytes]:
+    """
+    :param data: bytes-like object
+    :returns compressed data or None if frame should be sent uncompressed
+    """
+    size = memoryview(data).nbytes
+    if size < MIN_SIZE:
+        stats.add(name, skipped=1)
+        return None
+
+    compressed = _codecs[name].compress(data)
+    if len(compressed) >= size:
+        stats.add(name, skipped=1)
+        return None
+
+    stats.add(name, frames=1, bytes_in=size, bytes_out=len(compressed))
+    return compressed
+
+
+def decompress(name: str, data) -> bytes:
+    codec = _codecs.get(name)
+    if codec is None:
+        raise ValueError(f"Unsupported compression codec {name}")
+
+    stats.add(name, decompressed=1)
+    return codec.decompress(data)
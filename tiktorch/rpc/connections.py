@@ -1,11 +1,35 @@
+import enum
+import errno
+import os
+import socket
+import stat
 from typing import Optional
 
 import zmq
 
+from .serialization import DEFAULT_WIRE_OPTIONS, WireOptions
+
+
+@enum.unique
+class Transport(enum.Enum):
+    """
+    Socket pattern used by the client side of a connection
+
+    ReqRep: REQ sockets borrowed from a pool shared by clients of the connection,
+            one per request in flight, strict send/receive lockstep
+    Pipelined: one DEALER socket per client, many requests in flight,
+               replies are matched by method call id
+    """
+
+    ReqRep = "reqrep"
+    Pipelined = "pipelined"
+
 
 class IConnConf:
     _ctx: zmq.Context
     _timeout: Optional[int]
+    _transport: Transport = Transport.ReqRep
+    _wire_options: WireOptions = DEFAULT_WIRE_OPTIONS
 
     def get_conn_str(self) -> str:
         """
@@ -36,14 +60,46 @@ class IConnConf:
         else:
             return self._timeout
 
+    def get_transport(self) -> Transport:
+        """
+        :returns Transport: socket pattern clients should use for this connection
+        """
+        return self._transport
+
+    def get_wire_options(self) -> WireOptions:
+        """
+        :returns WireOptions: serialization options offered to the peer
+        """
+        return self._wire_options
+
+    def prepare_endpoints(self) -> None:
+        """
+        Called by server before it binds endpoints of this config
+        """
+
+    def cleanup_endpoints(self) -> None:
+        """
+        Called by server after it closed endpoints of this config
+        """
+
 
 class InprocConnConf(IConnConf):
-    def __init__(self, name: str, pubsub: str, ctx: zmq.Context, timeout: Optional[int] = None) -> None:
+    def __init__(
+        self,
+        name: str,
+        pubsub: str,
+        ctx: zmq.Context,
+        timeout: Optional[int] = None,
+        transport: Transport = Transport.ReqRep,
+        wire_options: WireOptions = DEFAULT_WIRE_OPTIONS,
+    ) -> None:
         """
         Inproc config is dependent on sharing *same context instance*
         """
         self._ctx = ctx
         self._timeout = timeout
+        self._transport = transport
+        self._wire_options = wire_options
         self.name = name
         self.pubsub = pubsub
 
@@ -56,11 +112,20 @@ class InprocConnConf(IConnConf):
 
 class TCPConnConf(IConnConf):
     def __init__(
-        self, addr: str, port: str, pubsub_port: str, timeout: Optional[int] = None, ctx: Optional[zmq.Context] = None
+        self,
+        addr: str,
+        port: str,
+        pubsub_port: str,
+        timeout: Optional[int] = None,
+        ctx: Optional[zmq.Context] = None,
+        transport: Transport = Transport.ReqRep,
+        wire_options: WireOptions = DEFAULT_WIRE_OPTIONS,
     ) -> None:
         self.port = port
         self.addr = addr
         self._timeout = timeout
+        self._transport = transport
+        self._wire_options = wire_options
         self._ctx = ctx or zmq.Context.instance()
         self.pubsub_port = pubsub_port
 
@@ -69,3 +134,84 @@ class TCPConnConf(IConnConf):
 
     def get_pubsub_conn_str(self) -> str:
         return f"tcp://{self.addr}:{self.pubsub_port}"
+
+
+# sun_path of sockaddr_un including terminating null byte (104 on macOS)
+MAX_IPC_PATH = 107
+
+
+class IPCConnConf(IConnConf):
+    def __init__(
+        self,
+        path: str,
+        timeout: Optional[int] = None,
+        ctx: Optional[zmq.Context] = None,
+        transport: Transport = Transport.ReqRep,
+        wire_options: WireOptions = DEFAULT_WIRE_OPTIONS,
+    ) -> None:
+        """
+        Unix domain sockets, for server and clients running on the same host
+
+        Requests go through socket file *path*, notifications through *path*.notify
+        """
+        self.path = os.path.abspath(path)
+        self.pubsub_path = f"{self.path}.notify"
+        if len(self.pubsub_path.encode()) > MAX_IPC_PATH:
+            raise ValueError(f"IPC socket path {self.pubsub_path} is longer than {MAX_IPC_PATH} bytes")
+
+        self._timeout = timeout
+        self._transport = transport
+        self._wire_options = wire_options
+        self._ctx = ctx or zmq.Context.instance()
+
+    def get_conn_str(self) -> str:
+        return f"ipc://{self.path}"
+
+    def get_pubsub_conn_str(self) -> str:
+        return f"ipc://{self.pubsub_path}"
+
+    def prepare_endpoints(self) -> None:
+        """
+        Create directory of socket files and remove files left behind by server which didn't shut down cleanly
+
+        :raises zmq.ZMQError: EADDRINUSE if another server is listening on the path
+        :raises FileExistsError: if path is taken by something else than socket
+        """
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+        # zmq would silently unlink socket file of running server and take over its path
+        for path in (self.path, self.pubsub_path):
+            if not _is_socket(path):
+                if os.path.lexists(path):
+                    raise FileExistsError(errno.EEXIST, "Not a socket", path)
+                continue
+
+            if _is_listening(path):
+                raise zmq.ZMQError(errno.EADDRINUSE, f"Server is already listening on {path}")
+
+            os.unlink(path)
+
+    def cleanup_endpoints(self) -> None:
+        # zmq removes socket files too, but asynchronously in its io thread
+        for path in (self.path, self.pubsub_path):
+            if _is_socket(path):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+
+def _is_socket(path: str) -> bool:
+    try:
+        return stat.S_ISSOCK(os.lstat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+def _is_listening(path: str) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            return False
+
+    return True
@@ -0,0 +1,100 @@
+"""
+Call deadlines
+
+Deadline set for a block of code applies to all calls made in it, servers
+set deadline of incoming call while executing it, so it's passed on
+to calls made on behalf of it (e.g. to child processes).
+Work which is past its deadline is dropped instead of computed.
+
+Deadline travels as remaining time budget, peers don't need synchronized clocks,
+time call spends in transit isn't counted against it.
+
+    with deadline(0.5):
+        fut = client.forward(tile)
+"""
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import ContextManager, Dict, Iterator, Optional
+
+# time.monotonic() value, context variable to work with both threads and asyncio tasks
+_current: contextvars.ContextVar = contextvars.ContextVar("deadline", default=None)
+
+
+def get_deadline() -> Optional[float]:
+    """
+    :returns deadline of calls made in current context as time.monotonic() value, None if there is none
+    """
+    return _current.get()
+
+
+@contextmanager
+def deadline_at(at: Optional[float]) -> Iterator[Optional[float]]:
+    """
+    Set deadline to *at* (time.monotonic() value), nested deadline can only be shorter than enclosing one
+    """
+    outer = _current.get()
+    if outer is not None and (at is None or outer < at):
+        at = outer
+
+    token = _current.set(at)
+    try:
+        yield at
+    finally:
+        _current.reset(token)
+
+
+def deadline(timeout: Optional[float]) -> ContextManager[Optional[float]]:
+    """
+    Calls made in this context should complete in *timeout* seconds
+    """
+    return deadline_at(None if timeout is None else time.monotonic() + timeout)
+
+
+def expired(at: Optional[float]) -> bool:
+    return at is not None and time.monotonic() >= at
+
+
+def encode_budget(at: Optional[float]) -> bytes:
+    """
+    :returns remaining time in ms (rounded up), empty if there is no deadline
+    """
+    if at is None:
+        return b""
+
+    return b"%d" % max(math.ceil((at - time.monotonic()) * 1000), 0)
+
+
+def decode_budget(budget: bytes) -> Optional[float]:
+    """
+    :returns deadline relative to local clock
+    """
+    if not budget:
+        return None
+
+    return time.monotonic() + int(budget) / 1000
+
+
+class SkipCounter:
+    """
+    Counts calls dropped before they were computed
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._cancelled = 0
+        self._expired = 0
+
+    def cancelled(self, count: int = 1) -> None:
+        with self._lock:
+            self._cancelled += count
+
+    def expired(self, count: int = 1) -> None:
+        with self._lock:
+            self._expired += count
+
+    def as_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return {"cancelled": self._cancelled, "expired": self._expired}
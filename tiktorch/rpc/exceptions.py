@@ -2,6 +2,12 @@ class CallException(Exception):
     pass
 
 
+class Overloaded(CallException):
+    """
+    Request was rejected or shed because server reached its queue limits, client should back off
+    """
+
+
 class Canceled(Exception):
     pass
 
@@ -12,3 +18,11 @@ class Shutdown(Exception):
 
 class Timeout(Exception):
     pass
+
+
+class DeadlineExceeded(Timeout):
+    pass
+
+
+# raised with their own type on client side of zmq connection, other remote errors become CallException
+PROPAGATED = {cls.__name__: cls for cls in (Overloaded, DeadlineExceeded, Canceled)}
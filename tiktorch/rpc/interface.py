@@ -1,4 +1,4 @@
-from typing import Any, Callable, Dict
+from typing import Any, Callable, Dict, Optional, Union
 
 
 class RPCInterfaceMeta(type):
@@ -23,6 +23,43 @@ def exposed(method: Callable[..., Any]) -> Callable[..., Any]:
     return method
 
 
+def serial(group: Union[str, Callable[..., Any]]) -> Callable[..., Any]:
+    """
+    Calls of decorated method are executed one at a time in order of arrival
+    even if server executes calls concurrently, methods sharing *group* are ordered together
+
+        @exposed
+        @serial("data")
+        def update_dataset(self, ...):
+    """
+    if callable(group):
+        group.__serial__ = group.__name__
+        return group
+
+    def _decorator(method: Callable[..., Any]) -> Callable[..., Any]:
+        method.__serial__ = group
+        return method
+
+    return _decorator
+
+
+def get_serial_groups(obj: RPCInterface) -> Dict[str, str]:
+    """
+    :returns serial group by name of exposed method, declaration on interface applies to implementations
+    """
+    cls = obj if isinstance(obj, type) else type(obj)
+    groups = {}
+
+    for attr_name in getattr(obj, "__exposedmethods__", ()):
+        for klass in cls.__mro__:
+            group: Optional[str] = getattr(klass.__dict__.get(attr_name), "__serial__", None)
+            if group is not None:
+                groups[attr_name] = group
+                break
+
+    return groups
+
+
 def get_exposed_methods(obj: RPCInterface) -> Dict[str, Callable[..., Any]]:
     exposed = getattr(obj, "__exposedmethods__", None)
 
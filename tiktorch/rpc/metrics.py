@@ -0,0 +1,300 @@
+"""
+RPC metrics
+
+Servers and clients count calls of every exposed method: number of calls,
+errors, calls in flight, bytes received and sent and a latency histogram.
+Counters are kept per process, endpoints with the same name
+(e.g. all clients of IFlightControl) share them.
+
+    registry.snapshot()["servers"]["InferenceProcess"]["forward"]["latency_us"]["p99"]
+
+Snapshots of several processes are combined with merge().
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, Iterable, List, Optional
+
+import zmq
+
+
+class Histogram:
+    """
+    Histogram with fixed log-linear buckets (HDR-style)
+
+    Values below 16 have a bucket each, every following power of two is split
+    into 8 buckets, so values are reported with relative error below 12.5%.
+    Buckets are the same in every process, histograms are merged by adding counts.
+    """
+
+    _SUB_BUCKETS = 8
+    # values are clamped to 2 ** 36 (~19 hours in microseconds)
+    _MAX_EXPONENT = 33
+    _SIZE = _SUB_BUCKETS * (_MAX_EXPONENT + 2)
+
+    __slots__ = ("_counts", "count", "total", "min", "max")
+
+    def __init__(self) -> None:
+        self._counts = [0] * self._SIZE
+        self.count = 0
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max: Optional[int] = None
+
+    @classmethod
+    def index(cls, value: int) -> int:
+        exponent = min(max(value.bit_length() - 4, 0), cls._MAX_EXPONENT)
+        return min(cls._SUB_BUCKETS * exponent + (value >> exponent), cls._SIZE - 1)
+
+    @classmethod
+    def lowest(cls, index: int) -> int:
+        """
+        :returns smallest value counted in bucket *index*
+        """
+        exponent = max(index // cls._SUB_BUCKETS - 1, 0)
+        return (index - cls._SUB_BUCKETS * exponent) << exponent
+
+    def record(self, value: int) -> None:
+        value = int(value) if value > 0 else 0
+        # same as index(), inlined as it's called for every call
+        exponent = value.bit_length() - 4
+        if exponent <= 0:
+            idx = value
+        elif exponent <= self._MAX_EXPONENT:
+            idx = self._SUB_BUCKETS * exponent + (value >> exponent)
+        else:
+            idx = self._SIZE - 1
+
+        self._counts[idx] += 1
+        self.count += 1
+        self.total += value
+        if self.count == 1:
+            self.min = self.max = value
+        elif value < self.min:
+            self.min = value
+        elif value > self.max:
+            self.max = value
+
+    def merge(self, other: "Histogram") -> None:
+        for idx, count in enumerate(other._counts):
+            self._counts[idx] += count
+
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def percentile(self, q: float) -> int:
+        """
+        :returns highest value of the bucket q-th percentile falls into, capped by maximum
+        """
+        if not self.count:
+            return 0
+
+        rank = max(q / 100 * self.count, 1)
+        seen = 0
+        for idx, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                return min(self.lowest(idx + 1) - 1, self.max)
+
+        return self.max
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "min": self.min or 0,
+            "max": self.max or 0,
+            "mean": self.total / self.count if self.count else 0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "p999": self.percentile(99.9),
+            # sparse, as [lowest value, count] pairs
+            "buckets": [[self.lowest(idx), count] for idx, count in enumerate(self._counts) if count],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Histogram":
+        hist = cls()
+        for lowest, count in data["buckets"]:
+            hist._counts[cls.index(lowest)] += count
+
+        hist.count = data["count"]
+        hist.total = round(data["mean"] * data["count"])
+        if hist.count:
+            hist.min, hist.max = data["min"], data["max"]
+        return hist
+
+
+class Call:
+    """
+    Call in progress, finished exactly once
+    """
+
+    __slots__ = ("stats", "_started")
+
+    def __init__(self, stats: "MethodStats") -> None:
+        self.stats = stats
+        self._started = time.perf_counter()
+
+    def finish(self, error: bool = False) -> None:
+        self.stats._finish(time.perf_counter() - self._started, error)
+
+    def finish_future(self, fut: Future) -> None:
+        """
+        Done callback of future returned by the call
+        """
+        self.finish(error=fut.cancelled() or fut.exception() is not None)
+
+
+class MethodStats:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._count = 0
+        self._errors = 0
+        self._in_flight = 0
+        self._bytes_in = 0
+        self._bytes_out = 0
+        self._latency = Histogram()
+
+    def start(self) -> Call:
+        with self._lock:
+            self._in_flight += 1
+        return Call(self)
+
+    def _finish(self, elapsed: float, error: bool) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            self._count += 1
+            if error:
+                self._errors += 1
+            self._latency.record(elapsed * 1e6)
+
+    def add_bytes(self, received: int = 0, sent: int = 0) -> None:
+        with self._lock:
+            self._bytes_in += received
+            self._bytes_out += sent
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        :returns
+            count: number of finished calls
+            errors: number of finished calls which failed, were cancelled or dropped
+            in_flight: number of calls started but not finished
+            bytes_in, bytes_out: bytes received and sent for calls
+            latency_us: histogram of call latency in microseconds
+        """
+        with self._lock:
+            return {
+                "count": self._count,
+                "errors": self._errors,
+                "in_flight": self._in_flight,
+                "bytes_in": self._bytes_in,
+                "bytes_out": self._bytes_out,
+                "latency_us": self._latency.as_dict(),
+            }
+
+
+class Metrics:
+    """
+    Stats of methods served or called by an endpoint
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._methods: Dict[str, MethodStats] = {}
+
+    def __getitem__(self, method_name: str) -> MethodStats:
+        stats = self._methods.get(method_name)
+        if stats is None:
+            with self._lock:
+                stats = self._methods.setdefault(method_name, MethodStats())
+        return stats
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            methods = dict(self._methods)
+        return {name: stats.as_dict() for name, stats in methods.items()}
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._endpoints: Dict[str, Dict[str, Metrics]] = {"servers": {}, "clients": {}}
+
+    def server(self, name: str) -> Metrics:
+        return self._get("servers", name)
+
+    def client(self, name: str) -> Metrics:
+        return self._get("clients", name)
+
+    def _get(self, kind: str, name: str) -> Metrics:
+        with self._lock:
+            return self._endpoints[kind].setdefault(name, Metrics())
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """
+        :returns {"servers": {endpoint: {method: stats}}, "clients": {...}}, see MethodStats.as_dict
+        """
+        with self._lock:
+            endpoints = {kind: dict(by_name) for kind, by_name in self._endpoints.items()}
+        return {
+            kind: {name: metrics.snapshot() for name, metrics in by_name.items()} for kind, by_name in endpoints.items()
+        }
+
+    def reset(self) -> None:
+        self._lock = threading.Lock()
+        self._endpoints = {"servers": {}, "clients": {}}
+
+
+registry = Registry()
+# forked child processes start counting from zero
+os.register_at_fork(after_in_child=registry.reset)
+
+
+def merge(snapshots: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Combine registry snapshots (e.g. of several processes), stats of same endpoint and method are added up
+    """
+    merged: Dict[str, Dict[str, Dict[str, Dict[str, Any]]]] = {"servers": {}, "clients": {}}
+    for snapshot in snapshots:
+        for kind, by_name in snapshot.items():
+            for name, methods in by_name.items():
+                for method_name, stats in methods.items():
+                    target = merged.setdefault(kind, {}).setdefault(name, {}).get(method_name)
+                    if target is None:
+                        merged[kind][name][method_name] = {**stats, "latency_us": dict(stats["latency_us"])}
+                        continue
+
+                    for key in ("count", "errors", "in_flight", "bytes_in", "bytes_out"):
+                        target[key] += stats[key]
+                    hist = Histogram.from_dict(target["latency_us"])
+                    hist.merge(Histogram.from_dict(stats["latency_us"]))
+                    target["latency_us"] = hist.as_dict()
+
+    return merged
+
+
+def nbytes(frames: Iterable[Any]) -> int:
+    """
+    :returns total size of zmq frames or bytes-like objects
+    """
+    size = 0
+    for frame in frames:
+        if isinstance(frame, zmq.Frame):
+            size += len(frame)
+        else:
+            size += memoryview(frame).nbytes
+    return size
+
+
+def split(size: int, count: int) -> List[int]:
+    """
+    Size of batch of messages attributed to each of them
+    """
+    share, rest = divmod(size, count)
+    return [share + 1 if idx < rest else share for idx in range(count)]
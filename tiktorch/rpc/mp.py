@@ -1,19 +1,27 @@
+import itertools
 import logging
 import multiprocessing as mp
 import queue
 import threading
+import time
 import types
 import weakref
-from concurrent.futures import Future
-from functools import wraps
-from multiprocessing.connection import Connection
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial, wraps
+from multiprocessing.connection import Connection, wait
+from multiprocessing.reduction import ForkingPickler
 from threading import Event, Thread
-from typing import Any, Optional, Type, TypeVar
-from uuid import uuid4
-
-from .exceptions import Shutdown
-from .interface import RPCInterface, get_exposed_methods
+from typing import Any, Callable, Dict, List, Optional, Type, TypeVar
+
+from . import metrics
+from .deadline import SkipCounter, deadline_at, expired, get_deadline
+from .exceptions import DeadlineExceeded, Shutdown
+from .interface import RPCInterface, get_exposed_methods, get_serial_groups
+from .metrics import Call, Metrics, split
+from .stream import RPCStream, StreamProducer, check_stream, isstreamret
+from .tracing import record, span, start_trace, traced
 from .types import RPCFuture, isfutureret
+from .utils import Lane
 
 logger = logging.getLogger(__name__)
 
@@ -56,6 +64,10 @@ class Result:
         return cls(err=err)
 
     def to_future(self, fut):
+        # future could have been cancelled while result was on its way
+        if fut.done():
+            return
+
         if self.is_err:
             fut.set_exception(self.error)
         else:
@@ -91,6 +103,12 @@ def create_client(iface_cls: Type[T], conn: Connection, timeout=None) -> T:
                 def __call__(self, *args, **kwargs) -> Any:
                     return self.async_(*args, **kwargs)
 
+            elif isstreamret(method):
+
+                @wraps(method)
+                def __call__(self, *args, **kwargs) -> Any:
+                    return client._invoke_stream(method.__name__, *args, **kwargs)
+
             else:
 
                 @wraps(method)
@@ -113,12 +131,17 @@ class MPClient:
     def __init__(self, name, conn: Connection, timeout: int):
         self._conn = conn
         self._request_by_id = {}
+        self._stream_by_id = {}
         self._name = name
         self._shutdown_event = Event()
         self._logger = None
+        self._ids = itertools.count()
+        self._metrics = metrics.registry.client(name)
+        # calls in progress by id, for both futures and streams
+        self._calls: Dict[int, Call] = {}
+        self._outbox = _Outbox(conn, self._on_send_error, name, self._on_sent)
         self._start_poller()
         self._timeout = timeout
-        self._send_lock = threading.Lock()
 
     @property
     def logger(self):
@@ -126,35 +149,29 @@ class MPClient:
             self._logger = logging.getLogger(f"{__name__}.{type(self).__name__}")
         return self._logger
 
-    def _new_id(self) -> str:
-        return uuid4().hex
+    @property
+    def metrics(self) -> Metrics:
+        """
+        Stats of calls made by clients of this interface in this process
+        """
+        return self._metrics
+
+    def _new_id(self) -> int:
+        return next(self._ids)
 
     def _start_poller(self):
         def _poller():
+            # blocks until next message, loop ends on shutdown signal or when pipe is closed
             while True:
-                if self._conn.poll(timeout=0.3):
-                    res: Result
-                    try:
-                        msg = self._conn.recv()
-                    except EOFError:
-                        self.logger.warning("Communication channel closed. Shutting Down.")
-                        self._shutdown()
-                    else:
-                        # signal
-                        if isinstance(msg, Signal):
-                            if msg.payload == b"shutdown":
-                                self.logger.debug("[signal] Shutdown")
-                                self._shutdown()
-
-                        # method
-                        elif isinstance(msg, MethodReturn):
-                            fut = self._request_by_id.pop(msg.id, None)
-                            self.logger.debug("[id:%s] Recieved result", msg.id)
-
-                            if fut is not None:
-                                msg.result.to_future(fut)
-                            else:
-                                self.logger.debug("[id:%s] Discarding result", msg.id)
+                try:
+                    payload = self._conn.recv_bytes()
+                except EOFError:
+                    self.logger.warning("Communication channel closed. Shutting Down.")
+                    self._shutdown()
+                else:
+                    msgs = unbatch(ForkingPickler.loads(payload))
+                    for msg, size in zip(msgs, split(len(payload), len(msgs))):
+                        self._handle_message(msg, size)
 
                 if self._shutdown_event.is_set():
                     break
@@ -163,59 +180,309 @@ class MPClient:
         self._poller.daemon = True
         self._poller.start()
 
+    def _handle_message(self, msg, size: int = 0):
+        """
+        :param size: share of received bytes attributed to the message
+        """
+        # signal
+        if isinstance(msg, Signal):
+            if msg.payload == b"shutdown":
+                self.logger.debug("[signal] Shutdown")
+                self._shutdown()
+            return
+
+        call = self._calls.get(msg.id)
+        if call is not None:
+            call.stats.add_bytes(received=size)
+
+        if isinstance(msg, StreamItem):
+            stream = self._stream_by_id.get(msg.id)
+            if stream is not None:
+                stream.put(msg.value)
+
+        elif isinstance(msg, StreamEnd):
+            stream = self._stream_by_id.pop(msg.id, None)
+            if stream is not None:
+                self._finish_call(msg.id, error=msg.result.error is not None)
+                stream.finish(msg.result.error)
+
+        # method
+        elif msg.id in self._stream_by_id:
+            # call failed before stream was started
+            self._finish_call(msg.id, error=True)
+            self._stream_by_id.pop(msg.id).finish(msg.result.error)
+
+        elif isinstance(msg, MethodReturn):
+            fut = self._request_by_id.pop(msg.id, None)
+            self.logger.debug("[id:%s] Recieved result", msg.id)
+
+            if fut is not None:
+                msg.result.to_future(fut)
+            else:
+                self.logger.debug("[id:%s] Discarding result", msg.id)
+
     def _cancellation_cb(self, fut):
-        if fut.cancelled():
-            with self._send_lock:
-                self._conn.send(Cancellation(fut.id))
+        if fut.cancelled() and self._request_by_id.pop(fut.id, None) is not None:
+            self._send_msg(Cancellation, fut.id)
 
     def _make_future(self):
         f = RPCFuture(timeout=self._timeout)
         f.add_done_callback(self._cancellation_cb)
         return f
 
+    def _finish_call(self, id_, error: bool = False):
+        call = self._calls.pop(id_, None)
+        if call is not None:
+            call.finish(error)
+
+    def _finish_future_call(self, id_, fut):
+        call = self._calls.pop(id_, None)
+        if call is not None:
+            call.finish_future(fut)
+
     def _invoke(self, method_name, *args, **kwargs):
         # request id, method, args, kwargs
         id_ = self._new_id()
+        at = get_deadline()
+        call = self._metrics[method_name].start()
+        if expired(at):
+            f = RPCFuture()
+            f.set_exception(DeadlineExceeded(f"Deadline of {method_name} call exceeded before it was sent"))
+            call.finish(error=True)
+            return f
+
         self.logger.debug("[id:%s] %s call '%s' method", id_, self._name, method_name)
+        self._calls[id_] = call
         self._request_by_id[id_] = f = self._make_future()
         f.id = id_
-        with self._send_lock:
-            self._conn.send(MethodCall(id_, method_name, args, kwargs))
+        f.add_done_callback(partial(self._finish_future_call, id_))
+        try:
+            self._outbox.send(MethodCall(id_, method_name, args, kwargs, at, start_trace()))
+        except Shutdown as e:
+            self._request_by_id.pop(id_, None)
+            f.set_exception(e)
+
         return f
 
+    def _invoke_stream(self, method_name, *args, **kwargs) -> RPCStream:
+        id_ = self._new_id()
+        self.logger.debug("[id:%s] %s call '%s' streaming method", id_, self._name, method_name)
+        stream = RPCStream(
+            partial(self._send_msg, StreamCredit, id_), partial(self._cancel_stream, id_), timeout=self._timeout
+        )
+        self._stream_by_id[id_] = stream
+        self._calls[id_] = self._metrics[method_name].start()
+        try:
+            self._outbox.send(MethodCall(id_, method_name, args, kwargs, None, start_trace()))
+        except Shutdown as e:
+            self._stream_by_id.pop(id_, None)
+            self._finish_call(id_, error=True)
+            stream.finish(e)
+            return stream
+
+        # messages are processed in order, server knows about the stream by the time it gets credit
+        stream.open()
+        return stream
+
+    def _cancel_stream(self, id_):
+        if self._stream_by_id.pop(id_, None) is not None:
+            self._finish_call(id_)
+            self._send_msg(Cancellation, id_)
+
+    def _send_msg(self, msg_cls, *args):
+        try:
+            self._outbox.send(msg_cls(*args))
+        except Shutdown:
+            # credit and cancellation are moot once the connection is shut down
+            self.logger.debug("Dropped %s after shutdown", msg_cls.__name__)
+
+    def _on_sent(self, msgs, size):
+        for msg, share in zip(msgs, split(size, len(msgs))):
+            if isinstance(msg, MethodCall):
+                self._metrics[msg.method_name].add_bytes(sent=share)
+
+    def _on_send_error(self, msg, exc):
+        self.logger.error("[id:%s] Failed to send %s", msg.id, type(msg).__name__, exc_info=exc)
+        fut = self._request_by_id.pop(msg.id, None)
+        if fut is not None and not fut.done():
+            fut.set_exception(exc)
+
+        stream = self._stream_by_id.pop(msg.id, None)
+        if stream is not None:
+            self._finish_call(msg.id, error=True)
+            stream.finish(exc)
+
     def _shutdown(self):
         self._shutdown_event.set()
+        self._outbox.close()
+
+        for id_, stream in list(self._stream_by_id.items()):
+            self._finish_call(id_, error=True)
+            stream.finish(Shutdown())
+        self._stream_by_id.clear()
 
 
 class Message:
+    """
+    Messages are pickled as constructor arguments, fields of subclasses
+    follow *id* in order of constructor parameters
+    """
+
+    __slots__ = ("id",)
+
     def __init__(self, id_):
-        self.id = id
+        self.id = id_
+
+    def __reduce__(self):
+        return type(self), (self.id, *(getattr(self, name) for name in self.__slots__))
 
 
 class Signal:
+    __slots__ = ("payload",)
+
     def __init__(self, payload):
         self.payload = payload
 
+    def __reduce__(self):
+        return Signal, (self.payload,)
+
 
 class MethodCall(Message):
-    def __init__(self, id_, method_name, args, kwargs):
-        self.id = id_
+    __slots__ = ("method_name", "args", "kwargs", "deadline", "trace_id")
+
+    def __init__(self, id_, method_name, args, kwargs, deadline=None, trace_id=None):
+        super().__init__(id_)
         self.method_name = method_name
         self.args = args
         self.kwargs = kwargs
+        # processes on the same host share monotonic clock, so time spent in pipe counts against deadline
+        self.deadline = deadline
+        self.trace_id = trace_id
 
 
 class Cancellation(Message):
-    def __init__(self, id_):
-        self.id = id_
+    __slots__ = ()
 
 
 class MethodReturn(Message):
+    __slots__ = ("result",)
+
     def __init__(self, id_, result: Result):
-        self.id = id_
+        super().__init__(id_)
         self.result = result
 
 
+class StreamItem(Message):
+    __slots__ = ("value",)
+
+    def __init__(self, id_, value):
+        super().__init__(id_)
+        self.value = value
+
+
+class StreamEnd(Message):
+    __slots__ = ("result",)
+
+    def __init__(self, id_, result: Result):
+        super().__init__(id_)
+        self.result = result
+
+
+class StreamCredit(Message):
+    __slots__ = ("count",)
+
+    def __init__(self, id_, count: int):
+        super().__init__(id_)
+        self.count = count
+
+
+def unbatch(msgs) -> List[Any]:
+    """
+    Messages queued at the same time are sent together as a list
+    """
+    return msgs if isinstance(msgs, list) else [msgs]
+
+
+class _Outbox:
+    """
+    Sends messages on a background thread
+
+    Messages queued while previous send was in progress are coalesced
+    into a single pickle and write, order of messages is preserved.
+    """
+
+    def __init__(
+        self,
+        conn: Connection,
+        on_error: Callable[[Message, Exception], None],
+        name: str,
+        on_sent: Callable[[List[Message], int], None],
+    ) -> None:
+        """
+        :param on_sent: called with messages sent together and their size in bytes
+        """
+        self._conn = conn
+        self._on_error = on_error
+        self._on_sent = on_sent
+        self._queue = []
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = Thread(target=self._run, name=f"ClientSender[{name}]", daemon=True)
+        self._thread.start()
+
+    def send(self, msg: Message) -> None:
+        """
+        :raises Shutdown: if outbox was closed, message would never be sent
+        """
+        with self._cond:
+            if self._closed:
+                raise Shutdown()
+
+            self._queue.append(msg)
+            self._cond.notify()
+
+    def close(self) -> None:
+        """
+        Stop once everything queued so far is sent
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+
+                if not self._queue:
+                    return
+
+                msgs, self._queue = self._queue, []
+
+            try:
+                self._send(msgs)
+            except Exception as e:
+                if len(msgs) == 1:
+                    self._on_error(msgs[0], e)
+                else:
+                    self._send_each(msgs)
+
+    def _send(self, msgs: List[Message]) -> None:
+        # same as Connection.send, but size of pickle is known
+        payload = ForkingPickler.dumps(msgs[0] if len(msgs) == 1 else msgs)
+        self._conn.send_bytes(payload)
+        self._on_sent(msgs, len(payload))
+
+    def _send_each(self, msgs: List[Message]) -> None:
+        # one broken message (e.g. unpicklable argument) shouldn't take the rest of batch down with it
+        for msg in msgs:
+            try:
+                self._send([msg])
+            except Exception as e:
+                self._on_error(msg, e)
+
+
 class Stop(Exception):
     pass
 
@@ -226,12 +493,12 @@ class FutureStore:
         self._future_by_id = {}
         self._id_by_future = {}
 
-    def put(self, id_: str, fut: Future):
+    def put(self, id_: int, fut: Future):
         with self._lock:
             self._future_by_id[id_] = fut
             self._id_by_future[fut] = id_
 
-    def pop_id(self, id_: str) -> Optional[Future]:
+    def pop_id(self, id_: int) -> Optional[Future]:
         with self._lock:
             if id_ not in self._future_by_id:
                 return None
@@ -240,7 +507,7 @@ class FutureStore:
             del self._id_by_future[fut]
             return fut
 
-    def pop_future(self, fut: Future) -> Optional[str]:
+    def pop_future(self, fut: Future) -> Optional[int]:
         with self._lock:
             if fut not in self._id_by_future:
                 return None
@@ -251,16 +518,70 @@ class FutureStore:
 
 
 class MPServer:
+    """
+    Serves *api* over a pipe
+
+    By default calls are executed on the receiving loop one after another.
+    With *max_workers* > 0 calls are executed on a pool of worker threads, so that
+    blocking methods don't hold up others. Methods decorated with @serial keep
+    their order, cancellations are handled by the receiving loop right away.
+
+    :param max_workers: size of worker pool, 0 executes calls inline
+    """
+
     _sentinel = object()
 
-    def __init__(self, api, conn: Connection):
+    def __init__(self, api, conn: Connection, *, max_workers: int = 0):
+        if max_workers < 0:
+            raise ValueError(f"max_workers should be non-negative, got {max_workers}")
+
         self._api = api
+        self._stream_methods = {name for name, method in get_exposed_methods(api).items() if isstreamret(method)}
         self._futures = FutureStore()
+        self._streams = {}
         self._logger = None
         self._conn = conn
         self._results_queue = queue.Queue()
+        self._skipped = SkipCounter()
+        self._metrics = metrics.registry.server(type(api).__name__)
+        # started calls by id, until their result or end of stream is sent
+        self._calls: Dict[int, Call] = {}
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lanes: Dict[str, Lane] = {}
+        self._default_lane: Optional[Lane] = None
+        # ids of calls waiting for a worker, True if call was cancelled
+        self._queued: Dict[int, bool] = {}
+        self._queued_lock = threading.Lock()
+        self._wakeup_r: Optional[Connection] = None
+        self._wakeup_w: Optional[Connection] = None
+
+        if max_workers:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="MPServerWorker")
+            self._default_lane = Lane(self._executor, max_workers)
+            group_lanes: Dict[str, Lane] = {}
+            for name, group in get_serial_groups(api).items():
+                self._lanes[name] = group_lanes.setdefault(group, Lane(self._executor, 1))
+
+            # worker executing shutdown call stops receiving loop through this pipe
+            self._wakeup_r, self._wakeup_w = mp.Pipe(duplex=False)
+
         self._start_result_sender(conn)
 
+    @property
+    def skipped(self):
+        """
+        Number of calls dropped because they were cancelled or past deadline
+        """
+        return self._skipped.as_dict()
+
+    @property
+    def metrics(self) -> Metrics:
+        """
+        Stats of served calls, shared by servers of the same api class in this process
+        """
+        return self._metrics
+
     @property
     def logger(self):
         if self._logger is None:
@@ -272,31 +593,72 @@ class MPServer:
 
     def _start_result_sender(self, conn):
         def _sender():
-            while True:
-                try:
-                    result = self._results_queue.get()
-                    if result is self._sentinel:
+            stopped = False
+            while not stopped:
+                # everything queued by now goes out with a single send
+                msgs = [self._results_queue.get()]
+                while True:
+                    try:
+                        msgs.append(self._results_queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                for idx, msg in enumerate(msgs):
+                    if msg is self._sentinel:
+                        msgs, stopped = msgs[:idx], True
                         break
 
-                    conn.send(result)
+                try:
+                    if msgs:
+                        self._send_batch(conn, msgs)
                 except Exception:
                     self.logger.exception("Error in result sender")
+                    if len(msgs) > 1:
+                        self._send_each(conn, msgs)
 
         t = threading.Thread(target=_sender, name="MPResultSender")
         t.start()
 
+    def _send_batch(self, conn, msgs):
+        # same as Connection.send, but size of pickle is known
+        payload = ForkingPickler.dumps(msgs[0] if len(msgs) == 1 else msgs)
+        for msg, size in zip(msgs, split(len(payload), len(msgs))):
+            if not isinstance(msg, Message):
+                continue
+
+            # call is done once its result or end of stream is out
+            done = isinstance(msg, (MethodReturn, StreamEnd))
+            call = self._calls.pop(msg.id, None) if done else self._calls.get(msg.id)
+            if call is not None:
+                call.stats.add_bytes(sent=size)
+
+        conn.send_bytes(payload)
+
+    def _send_each(self, conn, msgs):
+        # one broken message (e.g. unpicklable result) shouldn't take the rest of batch down with it
+        for msg in msgs:
+            try:
+                self._send_batch(conn, [msg])
+            except Exception:
+                self.logger.exception("Error in result sender")
+
     def _send_result(self, fut):
         if fut.cancelled():
             return
 
         id_ = self._futures.pop_future(fut)
 
-        if id_:
+        if id_ is not None:
             self.logger.debug("[id: %s] Sending result", id_)
+            call = self._calls.get(id_)
             try:
-                self._send(MethodReturn(id_, Result.OK(fut.result())))
+                msg = MethodReturn(id_, Result.OK(fut.result()))
             except Exception as e:
-                self._send(MethodReturn(id_, Result.Error(e)))
+                msg = MethodReturn(id_, Result.Error(e))
+
+            if call is not None:
+                call.finish(error=msg.result.is_err)
+            self._send(msg)
         else:
             self.logger.warning("Discarding result for future %s", fut)
 
@@ -307,12 +669,24 @@ class MPServer:
 
     def _call_method(self, call: MethodCall):
         self.logger.debug("[id: %s] Recieved '%s' method call", call.id, call.method_name)
+        self._calls[call.id] = self._metrics[call.method_name].start()
         fut = self._make_future()
         self._futures.put(call.id, fut)
 
+        at = call.deadline
+        if expired(at):
+            self.logger.debug("[id: %s] Deadline exceeded, skipping", call.id)
+            self._skipped.expired()
+            fut.set_exception(DeadlineExceeded(f"Deadline of {call.method_name} call exceeded"))
+            return fut
+
         try:
             meth = getattr(self._api, call.method_name)
-            res = meth(*call.args, **call.kwargs)
+            with deadline_at(at), traced(call.trace_id), span(f"handle {call.method_name}"):
+                res = meth(*call.args, **call.kwargs)
+
+            if not isinstance(res, (Future, Shutdown)):
+                check_stream(call.method_name, call.method_name in self._stream_methods, res)
 
         except Exception as e:
             fut.set_exception(e)
@@ -324,38 +698,153 @@ class MPServer:
 
             if isinstance(res, Future):
                 fut.attach(res)
+            elif call.method_name in self._stream_methods:
+                # items are sent by stream producer, future only reports errors
+                self._futures.pop_id(call.id)
+                self._start_stream(call, res)
             else:
                 fut.set_result(res)
 
         return fut
 
+    def _start_stream(self, call: MethodCall, iterator):
+        def _emit_end(exc):
+            self._streams.pop(call.id, None)
+            rpc_call = self._calls.get(call.id)
+            if rpc_call is not None:
+                rpc_call.finish(error=exc is not None)
+            self._send(StreamEnd(call.id, Result.Error(exc) if exc else Result.OK(None)))
+
+        producer = StreamProducer(
+            iterator, lambda item: self._send(StreamItem(call.id, item)), _emit_end, name=call.method_name
+        )
+        self._streams[call.id] = producer
+        producer.start()
+
+    def _grant_credit(self, credit: StreamCredit):
+        producer = self._streams.get(credit.id)
+        # stream could have finished in the meantime
+        if producer is not None:
+            producer.grant(credit.count)
+
+    def _call_in_worker(self, call: MethodCall, queued_at: float):
+        record("queue wait", queued_at, time.monotonic(), call.trace_id)
+        with self._queued_lock:
+            cancelled = self._queued.pop(call.id, False)
+
+        if cancelled:
+            self.logger.debug("[id: %s] Cancelled before start, skipping", call.id)
+            self._skipped.cancelled()
+            return
+
+        try:
+            self._call_method(call)
+        except Stop:
+            self.logger.debug("[id: %s] Shutdown", call.id)
+            self._wakeup_w.send_bytes(b"")
+        except Exception:
+            self.logger.error("Error in worker", exc_info=1)
+
     def _cancel_request(self, cancel: Cancellation):
         self.logger.debug("[id: %s] Recieved cancel request", cancel.id)
+        with self._queued_lock:
+            if cancel.id in self._queued:
+                # worker skips it
+                self._queued[cancel.id] = True
+                return
+
+        producer = self._streams.pop(cancel.id, None)
+        if producer is not None:
+            producer.cancel()
+            self._finish_call(cancel.id)
+            self.logger.debug("[id: %s] Cancelled stream", cancel.id)
+            return
+
         fut = self._futures.pop_id(cancel.id)
-        if fut:
-            fut.cancel()
+        if fut and fut.cancel():
+            self._skipped.cancelled()
+            self._finish_call(cancel.id, error=True)
             self.logger.debug("[id: %s] Cancelled", cancel.id)
 
+    def _finish_call(self, id_, error: bool = False):
+        call = self._calls.pop(id_, None)
+        if call is not None:
+            call.finish(error)
+
+    def _stop(self):
+        for id_, producer in list(self._streams.items()):
+            producer.cancel()
+            self._finish_call(id_)
+
+        if self._executor is not None:
+            for lane in {self._default_lane, *self._lanes.values()}:
+                lane.clear()
+            with self._queued_lock:
+                self._queued.clear()
+            self._executor.shutdown(wait=False)
+
+        self._send(self._sentinel)
+
+    def _shutdown(self):
+        self._send(Signal(b"shutdown"))
+        self._stop()
+
+    def _handle_message(self, msg, size: int = 0):
+        """
+        :param size: share of received bytes attributed to the message
+        """
+        if isinstance(msg, MethodCall):
+            self._metrics[msg.method_name].add_bytes(received=size)
+            if self._executor is None:
+                self._call_method(msg)
+                return
+
+            with self._queued_lock:
+                self._queued[msg.id] = False
+
+            lane = self._lanes.get(msg.method_name, self._default_lane)
+            lane.submit(partial(self._call_in_worker, msg, time.monotonic()))
+
+        elif isinstance(msg, Cancellation):
+            self._cancel_request(msg)
+
+        elif isinstance(msg, StreamCredit):
+            self._grant_credit(msg)
+
     def listen(self):
         while True:
-            ready = self._conn.poll(timeout=1)
-            if not ready:
+            if self._wakeup_r is not None and self._wakeup_r in wait([self._conn, self._wakeup_r]):
+                self._shutdown()
+                return
+
+            try:
+                payload = self._conn.recv_bytes()
+
+            except EOFError:
+                # recv would fail right away from now on
+                self.logger.warning("Communication channel closed. Shutting Down.")
+                self._stop()
+                break
+
+            except Exception:
+                self.logger.error("Error in main loop", exc_info=1)
                 continue
 
             try:
-                msg = self._conn.recv()
+                msgs = unbatch(ForkingPickler.loads(payload))
+            except Exception:
+                # truncated pickle raises EOFError too, it mustn't be mistaken for closed channel
+                self.logger.error("Failed to unpickle message", exc_info=1)
+                continue
 
-                if isinstance(msg, MethodCall):
-                    try:
-                        fut = self._call_method(msg)
-                    except Stop:
-                        self.logger.debug("[id: %s] Shutdown", msg.id)
-                        self._send(Signal(b"shutdown"))
-                        self._send(self._sentinel)
-                        break
+            for msg, size in zip(msgs, split(len(payload), len(msgs))):
+                try:
+                    self._handle_message(msg, size)
 
-                elif isinstance(msg, Cancellation):
-                    self._cancel_request(msg)
+                except Stop:
+                    self.logger.debug("[id: %s] Shutdown", msg.id)
+                    self._shutdown()
+                    return
 
-            except Exception as e:
-                self.logger.error("Error in main loop", exc_info=1)
+                except Exception:
+                    self.logger.error("Error in main loop", exc_info=1)
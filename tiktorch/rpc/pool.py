@@ -0,0 +1,234 @@
+"""
+Pool of REQ sockets
+
+Clients using request-reply transport draw a socket for every request and give it back
+once the reply has arrived, so short-lived clients (heartbeats, launcher helpers) reuse
+connected sockets and the number of open sockets is bounded by requests in flight
+rather than by clients and threads that ever made a call.
+
+Sockets are pooled per connection config: context, endpoint, timeout and offered wire options.
+Idle sockets are closed when they haven't been used for *idle_timeout* seconds or when there are
+more than *max_idle_per_key* of one config or *max_idle* in total (least recently used first).
+Sockets which failed (e.g. timed out waiting for reply) are closed instead of being returned.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Hashable, Iterator, List, Optional, Tuple
+
+import zmq
+
+from .connections import IConnConf
+from .serialization import WireOptions
+
+logger = logging.getLogger(__name__)
+
+MAX_IDLE_PER_KEY = 8
+MAX_IDLE = 64
+IDLE_TIMEOUT = 60  # seconds
+LINGER = 2000  # ms
+
+
+class PooledSocket:
+    __slots__ = ("socket", "wire_options", "key", "generation", "released_at")
+
+    def __init__(self, socket: zmq.Socket, key: Hashable, generation: int) -> None:
+        self.socket = socket
+        self.key = key
+        self.generation = generation
+        self.wire_options: Optional[WireOptions] = None
+        self.released_at = 0.0
+
+    def is_healthy(self) -> bool:
+        # REQ socket which got its reply is ready to send next request
+        return not self.socket.closed and bool(self.socket.poll(0, zmq.POLLOUT))
+
+    def close(self) -> None:
+        if not self.socket.closed:
+            self.socket.close(linger=0)
+
+
+class SocketPool:
+    def __init__(
+        self, max_idle_per_key: int = MAX_IDLE_PER_KEY, max_idle: int = MAX_IDLE, idle_timeout: float = IDLE_TIMEOUT
+    ) -> None:
+        self.max_idle_per_key = max_idle_per_key
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self._reset()
+
+    def _reset(self) -> None:
+        self._lock = threading.Lock()
+        # idle sockets ordered from least to most recently released
+        self._idle: Dict[Hashable, Deque[PooledSocket]] = {}
+        self._idle_count = 0
+        # bumped by clear(), sockets of older generation are closed on release
+        self._generations: Dict[Hashable, int] = {}
+        self._stats = {"created": 0, "reused": 0, "discarded": 0, "evicted": 0}
+
+    @staticmethod
+    def key(conf: IConnConf) -> Tuple[zmq.Context, str, int, WireOptions]:
+        return conf.get_ctx(), conf.get_conn_str(), conf.get_timeout(), conf.get_wire_options()
+
+    @contextmanager
+    def socket(self, conf: IConnConf, setup: Callable[[zmq.Socket], WireOptions]) -> Iterator[PooledSocket]:
+        """
+        Borrow socket for one request, socket is discarded if the block raises
+
+        :param setup: called with newly connected socket, :returns wire options agreed for it
+        """
+        entry = self.acquire(conf, setup)
+        try:
+            yield entry
+        except BaseException:
+            self.discard(entry)
+            raise
+        else:
+            self.release(entry)
+
+    def wire_options(self, conf: IConnConf, setup: Callable[[zmq.Socket], WireOptions]) -> WireOptions:
+        """
+        :returns wire options agreed by sockets of *conf*, connects one if there is none idle
+        """
+        with self._lock:
+            idle = self._idle.get(self.key(conf))
+            if idle:
+                return idle[-1].wire_options
+
+        with self.socket(conf, setup) as entry:
+            return entry.wire_options
+
+    def acquire(self, conf: IConnConf, setup: Callable[[zmq.Socket], WireOptions]) -> PooledSocket:
+        key = self.key(conf)
+        stale: List[PooledSocket] = []
+        entry = None
+
+        with self._lock:
+            stale.extend(self._evict_expired(time.monotonic()))
+            idle = self._idle.get(key)
+            while idle:
+                # most recently used socket is the one most likely still connected
+                candidate = idle.pop()
+                self._idle_count -= 1
+                if candidate.is_healthy():
+                    self._stats["reused"] += 1
+                    entry = candidate
+                    break
+
+                self._stats["discarded"] += 1
+                stale.append(candidate)
+
+            if idle is not None and not idle:
+                del self._idle[key]
+
+            if entry is None:
+                self._stats["created"] += 1
+                generation = self._generations.get(key, 0)
+
+        self._close(stale)
+        if entry is not None:
+            return entry
+
+        ctx, conn_str, timeout, _offer = key
+        sock = ctx.socket(zmq.REQ)
+        sock.setsockopt(zmq.LINGER, LINGER)
+        sock.RCVTIMEO = timeout
+        sock.SNDTIMEO = timeout
+        sock.connect(conn_str)
+
+        entry = PooledSocket(sock, key, generation)
+        try:
+            # each socket is a separate peer for the server
+            entry.wire_options = setup(sock)
+        except BaseException:
+            self.discard(entry)
+            raise
+
+        return entry
+
+    def release(self, entry: PooledSocket) -> None:
+        stale: List[PooledSocket] = []
+        now = time.monotonic()
+
+        with self._lock:
+            if entry.generation != self._generations.get(entry.key, 0) or not entry.is_healthy():
+                self._stats["discarded"] += 1
+                stale.append(entry)
+            else:
+                entry.released_at = now
+                idle = self._idle.setdefault(entry.key, deque())
+                idle.append(entry)
+                self._idle_count += 1
+                if len(idle) > self.max_idle_per_key:
+                    stale.append(self._pop_oldest(entry.key))
+
+            stale.extend(self._evict_expired(now))
+            while self._idle_count > self.max_idle:
+                oldest_key = min(self._idle, key=lambda key: self._idle[key][0].released_at)
+                stale.append(self._pop_oldest(oldest_key))
+
+        self._close(stale)
+
+    def discard(self, entry: PooledSocket) -> None:
+        with self._lock:
+            self._stats["discarded"] += 1
+        entry.close()
+
+    def clear(self, conf: IConnConf) -> None:
+        """
+        Close sockets of *conf*, e.g. after server shut down, sockets currently in use are closed on release
+        """
+        key = self.key(conf)
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            stale = list(self._idle.pop(key, ()))
+            self._idle_count -= len(stale)
+
+        self._close(stale)
+
+    def close(self) -> None:
+        """
+        Close all idle sockets
+        """
+        with self._lock:
+            stale = [entry for idle in self._idle.values() for entry in idle]
+            self._idle.clear()
+            self._idle_count = 0
+
+        self._close(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"idle": self._idle_count, **self._stats}
+
+    def _pop_oldest(self, key: Hashable) -> PooledSocket:
+        idle = self._idle[key]
+        entry = idle.popleft()
+        if not idle:
+            del self._idle[key]
+        self._idle_count -= 1
+        self._stats["evicted"] += 1
+        return entry
+
+    def _evict_expired(self, now: float) -> List[PooledSocket]:
+        expired = []
+        deadline = now - self.idle_timeout
+        for key in list(self._idle):
+            while key in self._idle and self._idle[key][0].released_at < deadline:
+                expired.append(self._pop_oldest(key))
+        return expired
+
+    def _close(self, entries: List[PooledSocket]) -> None:
+        for entry in entries:
+            try:
+                entry.close()
+            except zmq.ZMQError:
+                logger.debug("Failed to close pooled socket", exc_info=True)
+
+
+pool = SocketPool()
+# sockets must not be used across fork, child starts with an empty pool
+os.register_at_fork(after_in_child=pool._reset)
@@ -1,6 +1,11 @@
+import dataclasses
+import struct
+import threading
 from collections import namedtuple
+from contextlib import contextmanager
+from functools import partial
 from logging import getLogger
-from typing import Any, Callable, Dict, Generic, Iterator, List, Mapping, Type, TypeVar
+from typing import Any, Callable, Dict, Generic, Iterator, List, Mapping, Optional, Tuple, Type, TypeVar
 
 import zmq
 from zmq.utils import jsonapi
@@ -8,6 +13,68 @@ from zmq.utils import jsonapi
 T = TypeVar("T")
 logger = getLogger(__name__)
 
+# latest version of binary header format, see SerializerRegistry
+BINARY_HEADER_VERSION = 1
+# first byte of binary header frame, type frames start with b"T"
+BINARY_MARKER = 0xB7
+# marker, type code, format version
+_binary_prefix = struct.Struct("<BBB")
+
+
+@dataclasses.dataclass(frozen=True)
+class WireOptions:
+    """
+    Serialization options of a connection
+
+    Set on connection config these are options offered to the peer,
+    options agreed upon during handshake are used for serialization.
+    Deserialization doesn't depend on options, encoding is recorded on the wire.
+
+    :param shm: pass large array buffers through shared memory if peer is on the same host
+    :param compression: names of compression codecs for large payload frames in order of preference,
+        agreed options contain at most one codec
+    :param binary_header: version of binary header format used by serializers supporting it,
+        0 means type tag frame followed by json metadata
+    :param deadlines: calls carry remaining time budget of their deadline, see tiktorch.rpc.deadline
+    :param tracing: calls carry trace id of request they are made for, see tiktorch.rpc.tracing
+    """
+
+    shm: bool = False
+    compression: Tuple[str, ...] = ()
+    binary_header: int = 0
+    deadlines: bool = False
+    tracing: bool = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dataclasses.asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "WireOptions":
+        known = {f.name for f in dataclasses.fields(cls)}
+        # json has no tuples
+        return cls(**{key: tuple(val) if isinstance(val, list) else val for key, val in data.items() if key in known})
+
+
+DEFAULT_WIRE_OPTIONS = WireOptions()
+_local = threading.local()
+
+
+def get_wire_options() -> WireOptions:
+    """
+    :returns options of connection current thread serializes data for
+    """
+    return getattr(_local, "wire_options", DEFAULT_WIRE_OPTIONS)
+
+
+@contextmanager
+def wire_options(options: WireOptions) -> Iterator[WireOptions]:
+    prev = get_wire_options()
+    _local.wire_options = options
+    try:
+        yield options
+    finally:
+        _local.wire_options = prev
+
 
 class ISerializer(Generic[T]):
     """
@@ -30,29 +97,92 @@ class ISerializer(Generic[T]):
         raise NotImplementedError
 
 
+class IBinarySerializer(ISerializer[T]):
+    """
+    Serializer which can pack metadata into binary header frame
+    """
+
+    @classmethod
+    def serialize_binary(cls, obj: T, version: int) -> Optional[Tuple[bytes, List[zmq.Frame]]]:
+        """
+        :returns packed metadata and frames following header frame,
+            None if object can't be described by binary header of given version
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def deserialize_binary(cls, header: memoryview, version: int, frames: "FusedFrameIterator") -> T:
+        """
+        :param header: packed metadata
+        """
+        raise NotImplementedError
+
+
 class SerializerRegistry:
-    Entry = namedtuple("Entry", ["serializer", "tag"])
+    Entry = namedtuple("Entry", ["serializer", "tag", "code"])
 
     """
     Contains all registered serializers for types
+
+    Object is encoded either as type frame b"T:<tag>" followed by serializer frames
+    or, if binary header was negotiated and serializer has type *code*, as binary header frame
+    (BINARY_MARKER, code, version, packed metadata) followed by the rest of serializer frames.
+    Both are dispatched on by dict lookup.
     """
 
     def __init__(self):
         self._entry_by_type: Dict[Any, self.Entry] = {}
-        self._entry_by_tag: Dict[Any, self.Entry] = {}
+        self._entry_by_header: Dict[bytes, self.Entry] = {}
+        self._entry_by_code: Dict[int, self.Entry] = {}
 
-    def register(self, type_: T, tag: bytes) -> Callable[[ISerializer[T]], Any]:
+    def register(self, type_: T, tag: bytes, code: Optional[int] = None) -> Callable[[ISerializer[T]], Any]:
         """
         Register serializer for given type
+
+        :param code: type code in binary header, serializer has to implement IBinarySerializer
         """
 
         def _reg_fn(cls: ISerializer[T]) -> ISerializer[T]:
-            self._entry_by_tag[tag] = self.Entry(cls, tag)
-            self._entry_by_type[type_] = self.Entry(cls, tag)
+            if code is not None:
+                if not issubclass(cls, IBinarySerializer):
+                    raise TypeError(f"{cls} should implement IBinarySerializer to have type code")
+                if not 0 <= code <= 0xFF:
+                    raise ValueError(f"Type code should fit into byte, got {code}")
+
+            entry = self.Entry(cls, tag, code)
+            self._entry_by_header[b"T:%s" % tag] = entry
+            self._entry_by_type[type_] = entry
+            if code is not None:
+                self._entry_by_code[code] = entry
             return cls
 
         return _reg_fn
 
+    def _serialize_entry(self, entry: Entry, obj: Any) -> Iterator[zmq.Frame]:
+        version = get_wire_options().binary_header
+        if version and entry.code is not None:
+            version = min(version, BINARY_HEADER_VERSION)
+            encoded = entry.serializer.serialize_binary(obj, version)
+            if encoded is not None:
+                header, frames = encoded
+                yield zmq.Frame(_binary_prefix.pack(BINARY_MARKER, entry.code, version) + header)
+                yield from frames
+                return
+
+        yield zmq.Frame(b"T:%s" % entry.tag)
+        yield from entry.serializer.serialize(obj)
+
+    def get_serializer(self, type_: Any) -> Optional[Callable[[Any], Iterator[zmq.Frame]]]:
+        """
+        :returns function serializing objects of exactly *type_* without registry lookup,
+            None if there is no serializer registered for *type_*
+        """
+        entry = self._entry_by_type.get(type_)
+        if not entry:
+            return None
+
+        return partial(self._serialize_entry, entry)
+
     def serialize(self, obj: Any) -> Iterator[zmq.Frame]:
         """
         Serialize single object of type *type_* to zmq.Frame stream
@@ -65,9 +195,7 @@ class SerializerRegistry:
             raise NotImplementedError(f"Serialization protocol not implemented for {type_}")
 
         logger.debug("Using %r serializer", entry.serializer)
-        yield zmq.Frame(b"T:%s" % entry.tag)
-
-        yield from entry.serializer.serialize(obj)
+        yield from self._serialize_entry(entry, obj)
 
     def deserialize(self, frames: Iterator[zmq.Frame]) -> Any:
         """
@@ -80,14 +208,25 @@ class SerializerRegistry:
         except StopIteration:
             raise DeserializationError("Failed to read header")
 
-        assert header.startswith(b"T:")
-        tag = header[2:]
-        entry = self._entry_by_tag.get(tag)
-        if not entry:
-            raise NotImplementedError(f"Serialization protocol not implemented for {tag}")
-        logger.debug("Using %r serializer", entry.serializer)
+        entry = self._entry_by_header.get(header)
+        if entry:
+            logger.debug("Using %r serializer", entry.serializer)
+            return entry.serializer.deserialize(FusedFrameIterator(entry.serializer, frames))
+
+        if header and header[0] == BINARY_MARKER and len(header) >= _binary_prefix.size:
+            _marker, code, version = _binary_prefix.unpack_from(header)
+            entry = self._entry_by_code.get(code)
+            if not entry:
+                raise NotImplementedError(f"Serialization protocol not implemented for type code {code}")
+            if version > BINARY_HEADER_VERSION:
+                raise DeserializationError(f"Unsupported binary header version {version}")
+
+            logger.debug("Using %r serializer", entry.serializer)
+            return entry.serializer.deserialize_binary(
+                memoryview(header)[_binary_prefix.size :], version, FusedFrameIterator(entry.serializer, frames)
+            )
 
-        return entry.serializer.deserialize(FusedFrameIterator(entry.serializer, frames))
+        raise NotImplementedError(f"Serialization protocol not implemented for {header!r}")
 
 
 class DeserializationError(Exception):
@@ -116,6 +255,7 @@ class FusedFrameIterator(Iterator[zmq.Frame]):
 root_reg = SerializerRegistry()
 serialize = root_reg.serialize
 deserialize = root_reg.deserialize
+get_serializer = root_reg.get_serializer
 register = root_reg.register
 # TODO Remove
 serializer_for = root_reg.register
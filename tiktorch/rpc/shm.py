@@ -0,0 +1,284 @@
+"""
+Shared memory transport for large buffers exchanged by processes on the same host
+
+Instead of copying array data through the socket sender places it into a POSIX shared
+memory segment and sends only the segment name.
+
+Lifetime rules:
+* segments are owned by the sender, it keeps a bounded pool of them and reuses them,
+  first byte of a segment marks it as busy (written by sender) or free (read by receiver)
+* receiver copies data out and marks segment as free, mappings are cached by receiver
+* busy segments not released within SEGMENT_TTL seconds (e.g. receiver died) are unlinked
+* pool is unlinked on sender exit, segments of crashed senders are unlinked by reclaim_stale()
+  when next pool is created on the host
+* if pool is exhausted buffer should be sent inline
+
+Segments are not tracked by multiprocessing resource tracker, processes forked by
+multiprocessing share the tracker and it can't tell segments of sender and receiver apart.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing import util
+from typing import Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+import numpy as np
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # python < 3.8
+    resource_tracker = shared_memory = None
+
+logger = logging.getLogger(__name__)
+
+# smaller buffers are cheaper to send inline
+MIN_SIZE = 64 * 1024
+MAX_SEGMENTS = 16
+MAX_ATTACHED = 32
+SEGMENT_TTL = 60  # seconds
+PREFIX = "tiktorch"
+SHM_DIR = "/dev/shm"
+# segment state is kept in the first byte, header size keeps data aligned
+HEADER_SIZE = 64
+FREE = 0
+BUSY = 1
+
+
+def is_available() -> bool:
+    return shared_memory is not None
+
+
+def _untrack(seg: "shared_memory.SharedMemory") -> "shared_memory.SharedMemory":
+    resource_tracker.unregister(seg._name, "shared_memory")
+    return seg
+
+
+def _create(size: int) -> "shared_memory.SharedMemory":
+    name = f"{PREFIX}_{os.getpid()}_{uuid4().hex[:16]}"
+    return _untrack(shared_memory.SharedMemory(name=name, create=True, size=size))
+
+
+def _attach(name: str) -> "shared_memory.SharedMemory":
+    # python < 3.13 registers attached segments as well
+    return _untrack(shared_memory.SharedMemory(name=name))
+
+
+def _unlink(seg: "shared_memory.SharedMemory") -> None:
+    seg.close()
+    # unlink() unregisters segment from resource tracker
+    resource_tracker.register(seg._name, "shared_memory")
+    seg.unlink()
+
+
+class _Segment:
+    __slots__ = ("shm", "capacity", "sent_at")
+
+    def __init__(self, capacity: int) -> None:
+        self.shm = _create(HEADER_SIZE + capacity)
+        self.capacity = capacity
+        self.sent_at = 0.0
+
+    @property
+    def free(self) -> bool:
+        return self.shm.buf[0] == FREE
+
+    def unlink(self) -> None:
+        _unlink(self.shm)
+
+
+class _Pool:
+    """
+    Segments owned by this process
+    """
+
+    def __init__(self, max_segments: int, ttl: float) -> None:
+        self._max_segments = max_segments
+        self._ttl = ttl
+        self._segments: List[_Segment] = []
+        self._lock = threading.Lock()
+
+    def _acquire(self, nbytes: int) -> Optional[_Segment]:
+        now = time.monotonic()
+        free = [seg for seg in self._segments if seg.free]
+        fitting = [seg for seg in free if seg.capacity >= nbytes]
+
+        if fitting:
+            return min(fitting, key=lambda seg: seg.capacity)
+
+        for seg in [seg for seg in self._segments if not seg.free and seg.sent_at + self._ttl < now]:
+            logger.warning("Shared memory segment %s wasn't released by receiver, unlinked", seg.shm.name)
+            self._segments.remove(seg)
+            seg.unlink()
+
+        if len(self._segments) >= self._max_segments:
+            if not free:
+                return None
+
+            smallest = min(free, key=lambda seg: seg.capacity)
+            self._segments.remove(smallest)
+            smallest.unlink()
+
+        # round up so segment can be reused for buffers of similar size
+        seg = _Segment(1 << (nbytes - 1).bit_length())
+        self._segments.append(seg)
+        return seg
+
+    def put(self, arr: np.ndarray) -> Optional[str]:
+        with self._lock:
+            seg = self._acquire(arr.nbytes)
+            if seg is None:
+                return None
+
+            seg.shm.buf[0] = BUSY
+            seg.sent_at = time.monotonic()
+
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=seg.shm.buf, offset=HEADER_SIZE)[...] = arr
+        return seg.shm.name
+
+    def close(self) -> None:
+        with self._lock:
+            segments, self._segments = self._segments, []
+
+        for seg in segments:
+            seg.unlink()
+
+
+class _Attachments:
+    """
+    Mappings of peer segments, segments are reused by sender so mappings are cached
+    """
+
+    def __init__(self, max_attached: int) -> None:
+        self._max_attached = max_attached
+        self._segments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def read(self, name: str, nbytes: int) -> bytearray:
+        """
+        Copy data out of segment and mark it as free
+        """
+        with self._lock:
+            seg = self._segments.get(name)
+            if seg is None:
+                seg = self._segments[name] = _attach(name)
+                while len(self._segments) > self._max_attached:
+                    _, evicted = self._segments.popitem(last=False)
+                    evicted.close()
+            else:
+                self._segments.move_to_end(name)
+
+            with seg.buf[HEADER_SIZE : HEADER_SIZE + nbytes] as buf:
+                data = bytearray(buf)
+
+            seg.buf[0] = FREE
+
+        return data
+
+
+_pool: Optional[_Pool] = None
+_attachments = _Attachments(MAX_ATTACHED)
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> _Pool:
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                reclaim_stale()
+                _pool = _Pool(MAX_SEGMENTS, SEGMENT_TTL)
+                # unlike atexit also runs on exit of multiprocessing children
+                util.Finalize(_pool, _pool.close, exitpriority=0)
+
+    return _pool
+
+
+def _reset_after_fork() -> None:
+    # segments of parent process are not owned by the child
+    global _pool, _attachments, _pool_lock
+    _pool = None
+    _attachments = _Attachments(MAX_ATTACHED)
+    _pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def put(arr: np.ndarray) -> Optional[str]:
+    """
+    Copy array data to shared memory segment
+
+    :returns name of segment or None if pool is exhausted
+    """
+    return _get_pool().put(arr)
+
+
+def take(name: str, nbytes: int) -> bytearray:
+    """
+    Copy *nbytes* of data out of shared memory segment and release it
+    """
+    return _attachments.read(name, nbytes)
+
+
+@contextmanager
+def probe() -> Iterator[Tuple[str, str]]:
+    """
+    Segment used by peer to check that it shares memory with us
+
+    :returns name of segment and its token
+    """
+    token = uuid4().hex.encode("ascii")
+    seg = _create(len(token))
+    seg.buf[: len(token)] = token
+    try:
+        yield seg.name, token.decode("ascii")
+    finally:
+        _unlink(seg)
+
+
+def check_probe(name: str, token: str) -> bool:
+    """
+    :returns True if probe segment created by peer is accessible and contains expected token
+    """
+    if not is_available():
+        return False
+
+    try:
+        seg = _attach(name)
+    except (OSError, ValueError):
+        return False
+
+    try:
+        return bytes(seg.buf[: len(token)]) == token.encode("ascii")
+    finally:
+        seg.close()
+
+
+def reclaim_stale() -> None:
+    """
+    Unlink segments left behind by processes which are no longer running
+    """
+    if not is_available() or not os.path.isdir(SHM_DIR):
+        return
+
+    for fname in os.listdir(SHM_DIR):
+        parts = fname.split("_")
+        if len(parts) != 3 or parts[0] != PREFIX or not parts[1].isdigit():
+            continue
+
+        try:
+            os.kill(int(parts[1]), 0)
+        except ProcessLookupError:
+            try:
+                _unlink(_attach(fname))
+            except FileNotFoundError:
+                continue
+            logger.info("Reclaimed stale shared memory segment %s", fname)
+        except PermissionError:
+            # process is running under another user
+            pass
@@ -0,0 +1,303 @@
+"""
+Server-streaming calls
+
+Exposed method annotated to return Iterator[T] (or Generator) is acknowledged right away,
+its items are pushed to the client over notification channel as they are produced.
+
+Flow control is credit based: producer pulls next item from the iterator only if consumer
+granted credit for it, consumer grants credit for consumed items in batches.
+This keeps at most *window* items buffered or in flight and doesn't compute items
+no one is going to read.
+"""
+import asyncio
+import collections.abc
+import inspect
+import logging
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Generic, Iterator, List, Optional, Tuple, TypeVar
+
+from .exceptions import Timeout
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# number of items producer can run ahead of consumer
+STREAM_WINDOW = 16
+
+
+def isstream(obj: Any) -> bool:
+    return isinstance(obj, collections.abc.Iterator)
+
+
+def isstreamret(func: Callable) -> bool:
+    """
+    :returns whether func is declared to return a stream, methods without return annotation
+        inherit it from the method they override (e.g. of the interface they implement)
+    """
+    ret = inspect.signature(func).return_annotation
+    if ret is inspect.Signature.empty and inspect.ismethod(func):
+        for cls in inspect.getmro(type(func.__self__)):
+            declared = cls.__dict__.get(func.__name__)
+            if callable(declared) and inspect.signature(declared).return_annotation is not inspect.Signature.empty:
+                return isstreamret(declared)
+
+    origin = getattr(ret, "__origin__", None)
+
+    if origin in (collections.abc.Iterator, collections.abc.Generator):
+        return True
+
+    return inspect.isclass(origin or ret) and issubclass(origin or ret, RPCStream)
+
+
+def check_stream(name: str, declared: bool, value: Any) -> None:
+    """
+    :param declared: whether method *name* is declared to return a stream
+    :raises TypeError: if method returned a stream without declaring it or the other way around
+    """
+    if declared and not isstream(value):
+        raise TypeError(f"{name} is declared to return a stream, got {type(value).__name__}")
+    if not declared and isstream(value):
+        raise TypeError(f"{name} returned {type(value).__name__}, declare Iterator return type to stream it")
+
+
+class RPCStream(Generic[T]):
+    """
+    Items of server-streaming call
+
+    Iterate over it (or async iterate) to get items in order they were produced.
+    Closing stream before it is exhausted cancels producer.
+
+    :param grant: called with number of consumed items to let producer continue
+    :param cancel: called when stream is closed before producer finished
+    :param timeout: seconds to wait for next item, None waits indefinitely
+    :param async_grant: coroutine version of *grant* used by async iteration,
+        by default *grant* is called in executor
+    """
+
+    def __init__(
+        self,
+        grant: Callable[[int], None],
+        cancel: Callable[[], None],
+        window: int = STREAM_WINDOW,
+        timeout: Optional[float] = None,
+        async_grant: Optional[Callable[[int], Awaitable[None]]] = None,
+    ) -> None:
+        if window < 1:
+            raise ValueError(f"Stream window should be positive, got {window}")
+
+        self._grant = grant
+        self._async_grant = async_grant
+        self._cancel = cancel
+        self._window = window
+        self._timeout = timeout
+        self._items: Deque[Any] = deque()
+        self._done = False
+        self._exc: Optional[BaseException] = None
+        self._consumed = 0
+        self._cond = threading.Condition()
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    # producer side, called by transport
+
+    def open(self) -> None:
+        """
+        Let producer start, called once call was acknowledged
+        """
+        self._grant(self._window)
+
+    async def open_async(self) -> None:
+        await self._async_grant(self._window)
+
+    def put(self, item: T) -> None:
+        with self._cond:
+            if self._done:
+                return
+
+            self._items.append(item)
+            self._wakeup()
+
+    def finish(self, exc: Optional[BaseException] = None) -> None:
+        """
+        Mark stream as complete, *exc* is raised to consumer after remaining items
+        """
+        with self._cond:
+            if self._done:
+                return
+
+            self._done = True
+            self._exc = exc
+            self._wakeup()
+
+    def _wakeup(self) -> None:
+        self._cond.notify_all()
+        for loop, waiter in self._waiters:
+            loop.call_soon_threadsafe(_resolve, waiter)
+        self._waiters.clear()
+
+    # consumer side
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def _take(self) -> Tuple[Any, int]:
+        """
+        :returns next item and number of items credit should be granted for
+        """
+        if self._items:
+            item = self._items.popleft()
+            self._consumed += 1
+            # granting credit for every item would cost a message per item
+            if self._consumed >= max(self._window // 2, 1) and not self._done:
+                credit, self._consumed = self._consumed, 0
+                return item, credit
+
+            return item, 0
+
+        if self._exc is not None:
+            raise self._exc
+
+        raise StopIteration
+
+    def __iter__(self) -> Iterator[T]:
+        return self
+
+    def __next__(self) -> T:
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items or self._done, timeout=self._timeout):
+                raise Timeout()
+
+            item, credit = self._take()
+
+        if credit:
+            self._grant(credit)
+
+        return item
+
+    def __aiter__(self) -> "RPCStream[T]":
+        return self
+
+    async def __anext__(self) -> T:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            with self._cond:
+                if self._items or self._done:
+                    try:
+                        item, credit = self._take()
+                    except StopIteration:
+                        raise StopAsyncIteration from None
+                    break
+
+                waiter = loop.create_future()
+                self._waiters.append((loop, waiter))
+
+            try:
+                await asyncio.wait_for(waiter, self._timeout)
+            except asyncio.TimeoutError:
+                raise Timeout() from None
+
+        if credit and self._async_grant is not None:
+            await self._async_grant(credit)
+        elif credit:
+            # granting credit is a blocking call
+            await loop.run_in_executor(None, self._grant, credit)
+
+        return item
+
+    def close(self) -> None:
+        """
+        Stop consuming, cancels producer if it hasn't finished yet
+        """
+        with self._cond:
+            if self._done:
+                self._items.clear()
+                return
+
+            self._done = True
+            self._items.clear()
+            self._wakeup()
+
+        self._cancel()
+
+    def __enter__(self) -> "RPCStream[T]":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def _resolve(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class StreamProducer:
+    """
+    Pulls items from *iterator* on a separate thread while consumer has credit for them
+
+    :param emit_item: sends item to consumer
+    :param emit_end: sends end of stream, with exception if iterator failed
+    """
+
+    def __init__(
+        self,
+        iterator: Iterator[Any],
+        emit_item: Callable[[Any], None],
+        emit_end: Callable[[Optional[Exception]], None],
+        name: str = "",
+    ) -> None:
+        self._iterator = iterator
+        self._emit_item = emit_item
+        self._emit_end = emit_end
+        self._credit = 0
+        self._cancelled = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=f"StreamProducer[{name}]")
+        self._thread.daemon = True
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def grant(self, count: int) -> None:
+        with self._cond:
+            self._credit += count
+            self._cond.notify()
+
+    def cancel(self) -> None:
+        with self._cond:
+            self._cancelled = True
+            self._cond.notify()
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._credit or self._cancelled)
+                    if self._cancelled:
+                        logger.debug("Stream cancelled")
+                        return
+
+                    self._credit -= 1
+
+                try:
+                    item = next(self._iterator)
+                except StopIteration:
+                    self._emit_end(None)
+                    return
+
+                self._emit_item(item)
+
+        except Exception as e:
+            logger.exception("Stream producer failed")
+            self._emit_end(e)
+
+        finally:
+            close = getattr(self._iterator, "close", None)
+            if close is not None:
+                close()
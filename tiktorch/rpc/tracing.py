@@ -0,0 +1,219 @@
+"""
+Request tracing
+
+Opt-in, enabled by TIKTORCH_TRACE_DIR environment variable or by enable(), which sets
+the variable so that child processes trace too. Each request gets a trace id when
+a client sends it, the id travels with calls made on behalf of the request
+(across zmq and mp RPC) and every span recorded along the way is tagged with it.
+
+Spans are written per process to <trace dir>/trace-<pid>.jsonl, timestamps come
+from monotonic clock shared by processes of one host. Merge them into a single
+Chrome/Perfetto trace (chrome://tracing, ui.perfetto.dev):
+
+    python -m tiktorch.rpc.tracing /tmp/traces -o trace.json
+"""
+import argparse
+import contextvars
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing import current_process
+from multiprocessing.util import Finalize
+from typing import Any, Dict, Iterator, List, Optional
+from uuid import uuid4
+
+TRACE_DIR_ENV = "TIKTORCH_TRACE_DIR"
+# events are written out in chunks, the rest on process exit
+_FLUSH_EVERY = 1000
+
+_current: contextvars.ContextVar = contextvars.ContextVar("trace", default=None)
+
+
+class _Recorder:
+    def __init__(self, directory: str) -> None:
+        self.pid = os.getpid()
+        self.directory = directory
+        self._path = os.path.join(directory, f"trace-{self.pid}.jsonl")
+        self._lock = threading.Lock()
+        self._events: List[Dict[str, Any]] = []
+        self._threads = set()
+        self._meta("process_name", 0, current_process().name)
+        # runs on exit of both main and multiprocessing child processes
+        Finalize(self, self.flush, exitpriority=0)
+
+    def _meta(self, name: str, tid: int, value: str) -> None:
+        self._events.append({"name": name, "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": value}})
+
+    def add(self, name: str, start: float, end: float, args: Dict[str, Any]) -> None:
+        tid = threading.get_ident()
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": self.pid,
+            "tid": tid,
+            "args": args,
+        }
+
+        with self._lock:
+            if tid not in self._threads:
+                self._threads.add(tid)
+                self._meta("thread_name", tid, threading.current_thread().name)
+
+            self._events.append(event)
+            if len(self._events) < _FLUSH_EVERY:
+                return
+
+        self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            events, self._events = self._events, []
+            if events:
+                with open(self._path, "a") as f:
+                    f.writelines(json.dumps(event) + "\n" for event in events)
+
+
+_recorder: Optional[_Recorder] = None
+_recorder_lock = threading.Lock()
+
+
+def _get_recorder() -> Optional[_Recorder]:
+    global _recorder
+
+    directory = os.environ.get(TRACE_DIR_ENV)
+    if not directory:
+        return None
+
+    def _stale(recorder):
+        # forked child gets its own file
+        return recorder is None or recorder.pid != os.getpid() or recorder.directory != directory
+
+    recorder = _recorder
+    if _stale(recorder):
+        with _recorder_lock:
+            if _stale(_recorder):
+                if _recorder is not None and _recorder.pid == os.getpid():
+                    _recorder.flush()
+                os.makedirs(directory, exist_ok=True)
+                _recorder = _Recorder(directory)
+            recorder = _recorder
+
+    return recorder
+
+
+def enable(directory: str) -> None:
+    """
+    Record spans of this process and processes started by it to *directory*
+    """
+    os.environ[TRACE_DIR_ENV] = directory
+
+
+def enabled() -> bool:
+    return bool(os.environ.get(TRACE_DIR_ENV))
+
+
+def get_trace_id() -> Optional[str]:
+    """
+    :returns trace id of request handled in current context, None if there is none
+    """
+    return _current.get()
+
+
+def new_trace_id() -> str:
+    return uuid4().hex[:16]
+
+
+@contextmanager
+def traced(trace_id: Optional[str]) -> Iterator[Optional[str]]:
+    """
+    Attribute spans in this context to request *trace_id*
+    """
+    token = _current.set(trace_id)
+    try:
+        yield trace_id
+    finally:
+        _current.reset(token)
+
+
+def start_trace() -> Optional[str]:
+    """
+    :returns trace id for outgoing call, new one if the call isn't made on behalf of a traced request
+    """
+    trace_id = _current.get()
+    if trace_id is None and enabled():
+        trace_id = new_trace_id()
+    return trace_id
+
+
+def record(name: str, start: float, end: float, trace_id: Optional[str] = None, **args: Any) -> None:
+    """
+    Record span measured by caller (e.g. time spent in a queue), times are time.monotonic() values
+    """
+    trace_id = trace_id or _current.get()
+    if trace_id is None:
+        return
+
+    recorder = _get_recorder()
+    if recorder is not None:
+        recorder.add(name, start, end, {"trace_id": trace_id, **args})
+
+
+@contextmanager
+def span(name: str, trace_id: Optional[str] = None, **args: Any) -> Iterator[None]:
+    """
+    Record duration of the block if it's executed on behalf of traced request
+    """
+    trace_id = trace_id or _current.get()
+    if trace_id is None or not enabled():
+        yield
+        return
+
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        record(name, start, time.monotonic(), trace_id, **args)
+
+
+def flush() -> None:
+    """
+    Write out spans recorded so far by this process
+    """
+    if _recorder is not None and _recorder.pid == os.getpid():
+        _recorder.flush()
+
+
+def merge(directory: str, output: str) -> int:
+    """
+    Merge traces of all processes in *directory* into Chrome trace file *output*
+
+    :returns number of events
+    """
+    events = []
+    for path in sorted(glob.glob(os.path.join(directory, "trace-*.jsonl"))):
+        with open(path) as f:
+            events.extend(json.loads(line) for line in f if line.strip())
+
+    with open(output, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    return len(events)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="trace directory of traced processes")
+    parser.add_argument("-o", "--output", default="trace.json")
+    args = parser.parse_args()
+
+    count = merge(args.directory, args.output)
+    print(f"Merged {count} events into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,13 +11,26 @@ def _map_future(fut: Future, func: Callable[[T], S]) -> "RPCFuture[S]":
     new_fut: RPCFuture[S] = RPCFuture()
 
     def _do_map(f):
+        if new_fut.done():
+            return
+
+        if f.cancelled():
+            new_fut.cancel()
+            return
+
         try:
             res = func(f.result())
             new_fut.set_result(res)
         except Exception as e:
             new_fut.set_exception(e)
 
+    def _propagate_cancel(f):
+        # no one is interested in source result anymore
+        if f.cancelled():
+            fut.cancel()
+
     fut.add_done_callback(_do_map)
+    new_fut.add_done_callback(_propagate_cancel)
     return new_fut
 
 
@@ -106,14 +119,22 @@ class RPCFuture(Future, Generic[T]):
         return _map_future(self, func)
 
 
+try:
+    # py3.9+: Future.__class_getitem__ takes precedence over Generic and returns types.GenericAlias
+    from types import GenericAlias as _BuiltinGenericAlias
+except ImportError:
+    _BuiltinGenericAlias = _GenericAlias
+
+
 def _checkgenericfut(type_: Type) -> bool:
     # XXX: py3.7 regression isclass returns False on parametrized generics
-    if not isinstance(type_, (type, _GenericAlias)):
+    if not isinstance(type_, (type, _GenericAlias, _BuiltinGenericAlias)):
         return False
 
     origin = getattr(type_, "__origin__", None)
 
-    return origin and issubclass(origin, RPCFuture)
+    # origin of e.g. Optional[float] is typing.Union, which isn't a class
+    return inspect.isclass(origin) and issubclass(origin, RPCFuture)
 
 
 def isfutureret(func: Callable):
@@ -1,41 +1,232 @@
-from concurrent.futures import Future
-from threading import Lock
+import enum
+import heapq
+import itertools
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock, local
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
 
 from tiktorch.rpc.types import RPCFuture
 
-_undef = object()
+
+@enum.unique
+class Policy(enum.Enum):
+    """
+    Order in which queued calls of the same priority are submitted
+    """
+
+    FIFO = "fifo"
+    # newest first, e.g. tiles of the region user currently looks at
+    LIFO = "lifo"
 
 
 class BatchedExecutor:
-    def __init__(self, batch_size=20):
-        self._batch_size = batch_size
+    """
+    Submits calls returning futures keeping a window of them in flight, the rest is queued
+
+    Window adapts to completion latency (AIMD): it grows by one per window of calls completed
+    within *tolerance* times the lowest latency seen, and shrinks by *backoff* factor (at most
+    once per window of completions) when calls take longer, which means they started queueing
+    up on the server. So the server is kept busy without building up a backlog that only adds
+    latency. Baseline latency drifts up slowly to follow changes of load or model.
+
+    Queued calls are submitted highest priority first, calls of same priority in *policy* order.
+    """
+
+    # relative growth of baseline latency per completed call
+    BASELINE_DRIFT = 0.001
+    # weight of last sample in smoothed latency
+    SMOOTHING = 0.1
+
+    def __init__(
+        self,
+        batch_size: int = 20,
+        *,
+        min_window: int = 1,
+        max_window: int = 256,
+        policy: Policy = Policy.LIFO,
+        adaptive: bool = True,
+        tolerance: float = 2.0,
+        backoff: float = 0.75,
+    ) -> None:
+        """
+        :param batch_size: initial window, fixed limit if not *adaptive*
+        """
+        if not 1 <= min_window <= batch_size <= max_window:
+            raise ValueError(
+                f"Expected 1 <= min_window <= batch_size <= max_window, got {min_window}, {batch_size}, {max_window}"
+            )
+
+        self._window = float(batch_size)
+        self._min_window = min_window
+        self._max_window = max_window
+        self._policy = Policy(policy)
+        self._adaptive = adaptive
+        self._tolerance = tolerance
+        self._backoff = backoff
+
         self._lock = Lock()
         self._in_flight_count = 0
-        self._pending = []
+        self._pending: List[Tuple[int, int, Tuple[Callable, tuple, dict, RPCFuture]]] = []
+        self._seq = itertools.count()
+        self._since_decrease = 0
+        self._baseline: Optional[float] = None
+        self._latency: Optional[float] = None
+        self._local = local()
+
+    @property
+    def window(self) -> int:
+        """
+        Number of calls allowed in flight
+        """
+        return int(self._window)
 
-    def _is_valid_return(self, value):
-        if not isinstance(value, Future):
-            raise ValueError("Expected all submitted jobs to return Future")
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
 
-    def _submit_new_request(self, res=_undef):
+    def stats(self) -> Dict[str, Any]:
+        """
+        :returns
+            window: number of calls allowed in flight
+            in_flight: number of calls submitted and not completed
+            queued: number of calls waiting for submission
+            latency_ms: smoothed completion latency
+            baseline_ms: latency of unloaded server as estimated by executor
+        """
         with self._lock:
-            if res is not _undef:
-                self._in_flight_count -= 1
+            return {
+                "window": self.window,
+                "in_flight": self._in_flight_count,
+                "queued": len(self._pending),
+                "latency_ms": (self._latency or 0) * 1000,
+                "baseline_ms": (self._baseline or 0) * 1000,
+            }
 
-            if self._pending and self._in_flight_count < self._batch_size:
-                fn, args, kwargs, user_fut = self._pending.pop()
+    def submit(self, function: Callable[..., Future], *args, priority: int = 0, **kwargs) -> RPCFuture:
+        """
+        :param priority: queued calls of higher priority are submitted first
+        """
+        f = RPCFuture()
+        seq = next(self._seq)
+        # heap pops smallest, newest call has smallest key in LIFO mode
+        key = seq if self._policy == Policy.FIFO else -seq
+        with self._lock:
+            heapq.heappush(self._pending, (-priority, key, (function, args, kwargs, f)))
 
-                remote_fut = fn(*args, **kwargs)
-                self._is_valid_return(remote_fut)
-                remote_fut.add_done_callback(self._submit_new_request)
+        self._submit_new_requests()
+        return f
+
+    def _submit_new_requests(self) -> None:
+        # calls completing synchronously would otherwise recurse through done callbacks
+        if getattr(self._local, "submitting", False):
+            return
+
+        self._local.submitting = True
+        try:
+            self._submit_loop()
+        finally:
+            self._local.submitting = False
+
+    def _submit_loop(self) -> None:
+        while True:
+            with self._lock:
+                if not self._pending or self._in_flight_count >= self.window:
+                    return
 
-                user_fut.attach(remote_fut)
+                _, _, (fn, args, kwargs, user_fut) = heapq.heappop(self._pending)
                 self._in_flight_count += 1
 
-        return res
+            # called without lock, done callback runs right away if call completed synchronously
+            started = time.monotonic()
+            try:
+                remote_fut = fn(*args, **kwargs)
+                if not isinstance(remote_fut, Future):
+                    raise ValueError("Expected all submitted jobs to return Future")
+            except Exception as e:
+                user_fut.set_exception(e)
+                self._on_done(started, None)
+                continue
 
-    def submit(self, function, *args, **kwargs):
-        f = RPCFuture()
-        self._pending.append((function, args, kwargs, f))
-        self._submit_new_request()
-        return f
+            user_fut.attach(remote_fut)
+            remote_fut.add_done_callback(lambda fut, started=started: self._on_done(started, fut))
+
+    def _on_done(self, started: float, fut: Optional[Future]) -> None:
+        latency = time.monotonic() - started
+        with self._lock:
+            self._in_flight_count -= 1
+            if fut is not None:
+                self._adapt(latency)
+
+        self._submit_new_requests()
+
+    def _adapt(self, latency: float) -> None:
+        if self._latency is None:
+            self._latency = latency
+        else:
+            self._latency += self.SMOOTHING * (latency - self._latency)
+
+        if self._baseline is None:
+            self._baseline = latency
+        else:
+            self._baseline = min(latency, self._baseline * (1 + self.BASELINE_DRIFT))
+
+        if not self._adaptive:
+            return
+
+        self._since_decrease += 1
+        if latency <= self._tolerance * self._baseline:
+            self._window = min(self._window + 1 / self._window, self._max_window)
+        elif self._since_decrease >= self._window:
+            self._window = max(self._window * self._backoff, self._min_window)
+            self._since_decrease = 0
+
+
+class Lane:
+    """
+    Runs calls on a shared executor keeping at most *limit* of them in flight,
+    calls over the limit are queued and started in order of arrival
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor, limit: int) -> None:
+        if limit < 1:
+            raise ValueError(f"Lane limit should be positive, got {limit}")
+
+        self._executor = executor
+        self._limit = limit
+        self._running = 0
+        self._backlog: Deque[Callable[[], None]] = deque()
+        self._lock = Lock()
+
+    def submit(self, fn: Callable[[], None]) -> None:
+        with self._lock:
+            if self._running >= self._limit:
+                self._backlog.append(fn)
+                return
+
+            self._running += 1
+
+        self._start(fn)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._backlog.clear()
+
+    def _start(self, fn: Callable[[], None]) -> None:
+        try:
+            self._executor.submit(fn).add_done_callback(self._on_done)
+        except RuntimeError:
+            # executor was shut down
+            with self._lock:
+                self._running -= 1
+
+    def _on_done(self, _fut: Future) -> None:
+        with self._lock:
+            if not self._backlog:
+                self._running -= 1
+                return
+
+            fn = self._backlog.popleft()
+
+        self._start(fn)
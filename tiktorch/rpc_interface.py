@@ -1,4 +1,4 @@
-from typing import List, Tuple, Union
+from typing import Any, Dict, List, Tuple, Union
 
 from tiktorch.rpc import RPCFuture, RPCInterface, exposed
 from tiktorch.types import LabeledNDArrayBatch, Model, ModelState, NDArray, NDArrayBatch, SetDeviceReturnType
@@ -17,6 +17,11 @@ class IFlightControl(RPCInterface):
     def shutdown(self) -> None:
         raise NotImplementedError
 
+    # per process and total rpc metrics of server and its child processes, see tiktorch.rpc.metrics
+    @exposed
+    def get_rpc_stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
 
 class INeuralNetworkAPI(RPCInterface):
     @exposed
@@ -32,6 +37,16 @@ class INeuralNetworkAPI(RPCInterface):
     def forward(self, batch: NDArray) -> RPCFuture[NDArray]:
         raise NotImplementedError
 
+    @exposed
+    def forward_tiled(self, image: NDArray, blend: bool = False) -> RPCFuture[NDArray]:
+        """
+        Predict image of arbitrary size, tiling and stitching is done by the server
+
+        :param image: channel axis first, followed by 2 or 3 spatial axes
+        :param blend: overlap tiles and blend their predictions to hide seams
+        """
+        raise NotImplementedError
+
     # training
     @exposed
     def pause_training(self) -> None:
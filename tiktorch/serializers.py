@@ -1,25 +1,161 @@
-from typing import Iterator, Tuple
+import struct
+from typing import Iterator, List, Optional, Tuple
 
 import numpy as np
 import zmq
 from zmq.utils import jsonapi
 
-from .rpc.serialization import FusedFrameIterator, ISerializer, serializer_for
+from .rpc import compression, shm
+from .rpc.serialization import FusedFrameIterator, IBinarySerializer, ISerializer, get_wire_options, serializer_for
 from .types import Model, ModelState, NDArray, NDArrayBatch, SetDeviceReturnType
 
+# Binary header v1 array record:
+# dtype code, ndim, number of id elements (-1 if id is None), buffer flags, shape and id as int64,
+# for each set flag length prefixed name of shm segment / compression codec
+_array_head = struct.Struct("<BBbB")
+_values_by_count = {}
+_count = struct.Struct("<I")
+_FLAG_SHM = 1
+_FLAG_CODEC = 2
+# little endian on the wire, other dtypes fall back to json metadata
+_DTYPES = [
+    np.dtype(name).newbyteorder("<")
+    for name in (
+        "bool",
+        "int8",
+        "uint8",
+        "int16",
+        "uint16",
+        "int32",
+        "uint32",
+        "int64",
+        "uint64",
+        "float16",
+        "float32",
+        "float64",
+    )
+]
+_DTYPE_CODES = {dtype: code for code, dtype in enumerate(_DTYPES)}
+
+
+def _make_ndarray(meta: dict, frame: zmq.Frame) -> NDArray:
+    shape = meta["shape"]
+    id_ = meta["id"]
+
+    if "shm" in meta:
+        dtype = np.dtype(meta["dtype"])
+        count = int(np.prod(shape))
+        arr = np.frombuffer(shm.take(meta["shm"], count * dtype.itemsize), dtype=dtype)
+    else:
+        arr = np.frombuffer(_frame_data(frame, meta.get("codec")), dtype=meta["dtype"])
 
-def _make_ndarray(dtype: str, shape: Tuple[int, ...], id_: Tuple[int, ...], frame: zmq.Frame) -> NDArray:
-    arr = np.frombuffer(frame.buffer, dtype=dtype)
     arr.shape = shape
     return NDArray(arr, id_ and tuple(id_))
 
 
-@serializer_for(NDArrayBatch, tag=b"ndbatch")
-class NDArrayBatchSerializer(ISerializer[NDArrayBatch]):
+def _buffer_frame(arr: np.ndarray, meta: dict) -> zmq.Frame:
+    """
+    Large buffers are passed through shared memory if it was negotiated for connection
+    and pool has a free segment, in that case *meta* records segment name and frame is empty
+    """
+    if arr.nbytes >= shm.MIN_SIZE and get_wire_options().shm:
+        name = shm.put(arr)
+        if name is not None:
+            meta["shm"] = name
+            return zmq.Frame()
+
+    return _compressed_frame(arr, meta)
+
+
+def _compressed_frame(data, meta: dict, key: str = "codec") -> zmq.Frame:
+    """
+    Compress data with codec negotiated for connection, codec is recorded in *meta* under *key*
+    """
+    codecs = get_wire_options().compression
+    if codecs:
+        compressed = compression.compress(codecs[0], data)
+        if compressed is not None:
+            meta[key] = codecs[0]
+            return zmq.Frame(compressed)
+
+    return zmq.Frame(data)
+
+
+def _frame_data(frame: zmq.Frame, codec: Optional[str]):
+    if codec:
+        return compression.decompress(codec, frame.buffer)
+
+    return frame.buffer
+
+
+def _values(count: int) -> struct.Struct:
+    packer = _values_by_count.get(count)
+    if packer is None:
+        packer = _values_by_count[count] = struct.Struct(f"<{count}q")
+
+    return packer
+
+
+def _pack_array(arr: np.ndarray, id_: Optional[Tuple[int, ...]], meta: Optional[dict] = None) -> Optional[bytes]:
+    """
+    :param meta: buffer location as recorded by _buffer_frame
+    :returns binary record of array, None if array can't be described by binary header
+    """
+    code = _DTYPE_CODES.get(arr.dtype)
+    if code is None:
+        return None
+
+    ids = () if id_ is None else id_
+    flags = 0
+    names = b""
+    for flag, key in ((_FLAG_SHM, "shm"), (_FLAG_CODEC, "codec")):
+        if meta and key in meta:
+            flags |= flag
+            name = meta[key].encode("ascii")
+            names += bytes((len(name),)) + name
+
+    try:
+        head = _array_head.pack(code, arr.ndim, -1 if id_ is None else len(ids), flags)
+        return head + _values(arr.ndim + len(ids)).pack(*arr.shape, *ids) + names
+    except struct.error:
+        # id is not a short tuple of int64
+        return None
+
+
+def _unpack_array(buf: memoryview, offset: int, frame: zmq.Frame) -> Tuple[NDArray, int]:
+    """
+    :returns array described by record at *offset* and offset of next record
+    """
+    code, ndim, nids, flags = _array_head.unpack_from(buf, offset)
+    offset += _array_head.size
+
+    values = _values(ndim + max(nids, 0)).unpack_from(buf, offset)
+    offset += 8 * len(values)
+    shape = values[:ndim]
+    id_ = values[ndim:] if nids >= 0 else None
+
+    if not flags:
+        arr = np.frombuffer(frame.buffer, dtype=_DTYPES[code])
+        arr.shape = shape
+        return NDArray(arr, id_), offset
+
+    meta = {"dtype": _DTYPES[code], "shape": shape, "id": id_}
+    for flag, key in ((_FLAG_SHM, "shm"), (_FLAG_CODEC, "codec")):
+        if flags & flag:
+            size = buf[offset]
+            meta[key] = bytes(buf[offset + 1 : offset + 1 + size]).decode("ascii")
+            offset += 1 + size
+
+    return _make_ndarray(meta, frame), offset
+
+
+@serializer_for(NDArrayBatch, tag=b"ndbatch", code=2)
+class NDArrayBatchSerializer(IBinarySerializer[NDArrayBatch]):
     """
     Serialization/deserialization protocol for NDArrayBatch
     First frame contains metadata encoded and json
     Rest of the frames contain raw buffer data
+    Binary header contains number of arrays followed by their records
     """
 
     @classmethod
@@ -29,25 +165,56 @@ class NDArrayBatchSerializer(ISerializer[NDArrayBatch]):
 
         arrays = []
         for item, buf_frame in zip(meta, frames):
-            nd_array = _make_ndarray(item["dtype"], item["shape"], item["id"], buf_frame)
+            nd_array = _make_ndarray(item, buf_frame)
             arrays.append(nd_array)
 
         return NDArrayBatch(arrays)
 
     @classmethod
     def serialize(cls, obj: NDArrayBatch) -> Iterator[zmq.Frame]:
-        yield zmq.Frame(jsonapi.dumps(obj.array_metas()))
+        meta = obj.array_metas()
+        buf_frames = [_buffer_frame(arr, item) for arr, item in zip(obj.as_numpy(), meta)]
+
+        yield zmq.Frame(jsonapi.dumps(meta))
+        yield from buf_frames
+
+    @classmethod
+    def deserialize_binary(cls, header: memoryview, version: int, frames: FusedFrameIterator) -> NDArrayBatch:
+        (count,) = _count.unpack_from(header)
+        offset = _count.size
+
+        arrays = []
+        for _ in range(count):
+            arr, offset = _unpack_array(header, offset, next(frames))
+            arrays.append(arr)
+
+        return NDArrayBatch(arrays)
+
+    @classmethod
+    def serialize_binary(cls, obj: NDArrayBatch, version: int) -> Optional[Tuple[bytes, List[zmq.Frame]]]:
+        arrays = [(item.as_numpy(), item.id) for item in obj]
+        # records are checked before any buffer is placed into shared memory
+        records = [_pack_array(arr, id_) for arr, id_ in arrays]
+        if None in records:
+            return None
+
+        buf_frames = []
+        for idx, (arr, id_) in enumerate(arrays):
+            meta = {}
+            buf_frames.append(_buffer_frame(arr, meta))
+            if meta:
+                records[idx] = _pack_array(arr, id_, meta)
 
-        for arr in obj.as_numpy():
-            yield zmq.Frame(arr)
+        return _count.pack(len(records)) + b"".join(records), buf_frames
 
 
-@serializer_for(NDArray, tag=b"ndarray")
-class NDArraySerializer(ISerializer[NDArray]):
+@serializer_for(NDArray, tag=b"ndarray", code=1)
+class NDArraySerializer(IBinarySerializer[NDArray]):
     """
     Serialization/deserialization protocol for NDArray
     First frame contains metadata encoded and json
     Next frame contains raw buffer data
+    Binary header contains record of the array
     """
 
     @classmethod
@@ -56,13 +223,31 @@ class NDArraySerializer(ISerializer[NDArray]):
         meta = jsonapi.loads(meta_frame.bytes)
 
         buf_frame = next(frames)
-        return _make_ndarray(meta["dtype"], meta["shape"], meta["id"], buf_frame)
+        return _make_ndarray(meta, buf_frame)
 
     @classmethod
     def serialize(cls, obj: NDArray) -> Iterator[zmq.Frame]:
         meta = {"id": obj.id, "shape": obj.shape, "dtype": str(obj.dtype)}
+        buf_frame = _buffer_frame(obj.as_numpy(), meta)
+
         yield zmq.Frame(jsonapi.dumps(meta))
-        yield zmq.Frame(obj.as_numpy())
+        yield buf_frame
+
+    @classmethod
+    def deserialize_binary(cls, header: memoryview, version: int, frames: FusedFrameIterator) -> NDArray:
+        arr, _offset = _unpack_array(header, 0, next(frames))
+        return arr
+
+    @classmethod
+    def serialize_binary(cls, obj: NDArray, version: int) -> Optional[Tuple[bytes, List[zmq.Frame]]]:
+        arr = obj.as_numpy()
+        record = _pack_array(arr, obj.id)
+        if record is None:
+            return None
+
+        meta = {}
+        buf_frame = _buffer_frame(arr, meta)
+        return (_pack_array(arr, obj.id, meta) if meta else record), [buf_frame]
 
 
 @serializer_for(SetDeviceReturnType, tag=b"setdevices")
@@ -90,28 +275,32 @@ class SetDeviceReturnTypeSerializer(ISerializer[SetDeviceReturnType]):
 class ModelStateSerializer(ISerializer[ModelState]):
     @classmethod
     def serialize(cls, obj: ModelState) -> Iterator[zmq.Frame]:
-        yield zmq.Frame(
-            jsonapi.dumps(
-                {
-                    "epoch": obj.epoch,
-                    "loss": obj.loss,
-                    "num_iterations_done": obj.num_iterations_done,
-                    "num_iterations_max": obj.num_iterations_max,
-                }
-            )
-        )
-        yield zmq.Frame(obj.model_state)
-        yield zmq.Frame(obj.optimizer_state)
+        meta = {
+            "epoch": obj.epoch,
+            "loss": obj.loss,
+            "num_iterations_done": obj.num_iterations_done,
+            "num_iterations_max": obj.num_iterations_max,
+        }
+        codecs = {}
+        model_state = _compressed_frame(obj.model_state, codecs, "model_state")
+        optimizer_state = _compressed_frame(obj.optimizer_state, codecs, "optimizer_state")
+        if codecs:
+            meta["codecs"] = codecs
+
+        yield zmq.Frame(jsonapi.dumps(meta))
+        yield model_state
+        yield optimizer_state
 
     @classmethod
     def deserialize(cls, frames: "FusedFrameIterator") -> ModelState:
         frm = next(frames)
         epoch_loss = jsonapi.loads(frm.bytes)
+        codecs = epoch_loss.pop("codecs", {})
 
-        model_state = next(frames)
-        optimizer_state = next(frames)
+        model_state = _frame_data(next(frames), codecs.get("model_state"))
+        optimizer_state = _frame_data(next(frames), codecs.get("optimizer_state"))
 
-        return ModelState(**epoch_loss, model_state=model_state.bytes, optimizer_state=optimizer_state.bytes)
+        return ModelState(**epoch_loss, model_state=bytes(model_state), optimizer_state=bytes(optimizer_state))
 
 
 @serializer_for(Model, tag=b"model")
@@ -1 +1 @@
-from .base import TikTorchServer
+from .base import TikTorchServer, embedded_server
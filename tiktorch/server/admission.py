@@ -0,0 +1,161 @@
+"""
+Admission control for queued requests
+
+Every process bounds the requests it queues by number (*max_depth*) and by size of their
+payload in bytes (*max_bytes*). When a new request doesn't fit, the overload policy decides:
+
+    reject       new request fails with Overloaded right away
+    shed_oldest  oldest queued requests fail with Overloaded to make room for the new one
+
+Requests larger than *max_bytes* on their own are always rejected. Admitted, rejected and
+shed requests are counted, so clients polling the stats can back off before they get rejected.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Generic, Hashable, List, Optional, Tuple, TypeVar
+
+from tiktorch.configkeys import INFERENCE_MAX_QUEUE_DEPTH, INFERENCE_MAX_QUEUED_BYTES, INFERENCE_OVERLOAD
+from tiktorch.rpc import Overloaded
+from tiktorch.tiktypes import TikTensor
+
+logger = logging.getLogger(__name__)
+
+REJECT = "reject"
+SHED_OLDEST = "shed_oldest"
+POLICIES = (REJECT, SHED_OLDEST)
+
+T = TypeVar("T")
+
+
+class Admission(Generic[T]):
+    """
+    Bookkeeping of queued requests, values are handed back when request leaves the queue
+    """
+
+    def __init__(
+        self,
+        max_depth: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        policy: str = REJECT,
+        name: str = "queue",
+    ) -> None:
+        """
+        :param max_depth: maximum number of queued requests, unbounded if None
+        :param max_bytes: maximum total payload of queued requests, unbounded if None
+        :param policy: what to do with a request that doesn't fit, REJECT or SHED_OLDEST
+        :param name: used in error messages and logs
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown overload policy {policy!r}, expected one of {POLICIES}")
+
+        self.max_depth = max_depth
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.name = name
+
+        self._lock = threading.Lock()
+        # key -> (value, nbytes), oldest first
+        self._queued: "OrderedDict[Hashable, Tuple[T, int]]" = OrderedDict()
+        self._queued_bytes = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._shed = 0
+
+    @classmethod
+    def from_config(cls, config: dict, name: str) -> "Admission":
+        return cls(
+            max_depth=config.get(INFERENCE_MAX_QUEUE_DEPTH),
+            max_bytes=config.get(INFERENCE_MAX_QUEUED_BYTES),
+            policy=config.get(INFERENCE_OVERLOAD) or REJECT,
+            name=name,
+        )
+
+    def admit(self, key: Hashable, value: T, nbytes: int = 0) -> List[T]:
+        """
+        Queue request or raise Overloaded
+
+        :returns values of requests shed to make room for this one, caller has to fail them
+        """
+        shed: List[T] = []
+        with self._lock:
+            if self.max_bytes is not None and nbytes > self.max_bytes:
+                self._rejected += 1
+                raise Overloaded(f"{self.name}: request of {nbytes} bytes exceeds limit of {self.max_bytes} bytes")
+
+            if not self._fits(nbytes):
+                # with max_depth of 0 there is nothing to shed
+                if self.policy == REJECT or not self._queued:
+                    self._rejected += 1
+                    raise Overloaded(
+                        f"{self.name}: {len(self._queued)} requests ({self._queued_bytes} bytes) queued already"
+                    )
+
+                while self._queued and not self._fits(nbytes):
+                    _key, (shed_value, shed_nbytes) = self._queued.popitem(last=False)
+                    self._queued_bytes -= shed_nbytes
+                    shed.append(shed_value)
+
+                self._shed += len(shed)
+
+            self._queued[key] = (value, nbytes)
+            self._queued_bytes += nbytes
+            self._admitted += 1
+
+        if shed:
+            logger.debug("%s: shed %d oldest requests", self.name, len(shed))
+
+        return shed
+
+    def release(self, key: Hashable) -> Optional[T]:
+        """
+        Remove request from queue
+
+        :returns value passed to admit or None if request was shed or released already
+        """
+        with self._lock:
+            entry = self._queued.pop(key, None)
+            if entry is None:
+                return None
+
+            value, nbytes = entry
+            self._queued_bytes -= nbytes
+            return value
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :returns
+            queued, queued_bytes: requests currently queued and their payload
+            admitted: number of requests queued so far
+            rejected: number of requests failed with Overloaded instead of being queued
+            shed: number of queued requests failed with Overloaded to make room for newer ones
+        """
+        with self._lock:
+            return {
+                "queued": len(self._queued),
+                "queued_bytes": self._queued_bytes,
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "shed": self._shed,
+            }
+
+    def _fits(self, nbytes: int) -> bool:
+        if self.max_depth is not None and len(self._queued) >= self.max_depth:
+            return False
+        if self.max_bytes is not None and self._queued_bytes + nbytes > self.max_bytes:
+            return False
+        return True
+
+
+def fail(fut: Future, msg: str) -> None:
+    """
+    Fail pending future of shed request, futures cancelled in the meantime are left alone
+    """
+    if fut.set_running_or_notify_cancel():
+        fut.set_exception(Overloaded(msg))
+
+
+def nbytes(data: TikTensor) -> int:
+    tensor = data.as_torch()
+    return tensor.element_size() * tensor.nelement()
@@ -4,14 +4,30 @@ import logging.handlers
 import os
 import threading
 import time
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Generator, Iterable, List, Optional, Tuple, Union
+from typing import Any, Dict, Generator, Iterable, Iterator, List, Optional, Tuple, Type, Union
+from uuid import uuid4
 
 import numpy
 import torch
+import zmq
 from inferno.io.transform import Compose
 from tiktorch.configkeys import DIRECTORY, LOGGING, TESTING, TRANSFORMS
-from tiktorch.rpc import Client, RPCFuture, Server, Shutdown, TCPConnConf
+from tiktorch.rpc import (
+    BINARY_HEADER_VERSION,
+    Client,
+    InprocConnConf,
+    IPCConnConf,
+    RPCFuture,
+    Server,
+    Shutdown,
+    TCPConnConf,
+    WireOptions,
+    compression,
+    metrics,
+    tracing,
+)
 from tiktorch.rpc.mp import MPClient, create_client
 from tiktorch.rpc_interface import IFlightControl, INeuralNetworkAPI
 from tiktorch.tiktypes import LabeledTikTensor, LabeledTikTensorBatch, TikTensor, TikTensorBatch
@@ -37,6 +53,19 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 KILL_TIMEOUT = 60  # seconds
+STATS_TIMEOUT = 10  # seconds
+RPC_WORKERS = 4
+# methods changing server state are executed one at a time in order of arrival
+SERIAL_METHODS = (
+    "load_model",
+    "update_config",
+    "pause_training",
+    "resume_training",
+    "update_training_data",
+    "update_validation_data",
+    "remove_data",
+    "shutdown",
+)
 
 
 class Watchdog:
@@ -72,7 +101,12 @@ class TikTorchServer(INeuralNetworkAPI, IFlightControl):
         self.logger = logging.getLogger("tiktorch.server")
         self._log_listener: Optional[logging.handlers.QueueListener] = None
         self._handler: Optional[IHandler] = None
+        self.test_transforms: Dict[str, dict] = {}
         self._last_ping = 0
+        # calls using handler run concurrently, swapping the model waits for them to finish
+        self._model_cond = threading.Condition()
+        self._model_users = 0
+        self._swapping_model = False
 
     @property
     def handler(self):
@@ -85,6 +119,38 @@ class TikTorchServer(INeuralNetworkAPI, IFlightControl):
 
         self._handler: IHandler = new_handler
 
+    @contextmanager
+    def _using_model(self) -> Iterator[Tuple[IHandler, Dict[str, dict]]]:
+        """
+        :returns handler and test transforms of current model, which are not swapped until the context exits
+        """
+        with self._model_cond:
+            self._model_cond.wait_for(lambda: not self._swapping_model)
+            self._model_users += 1
+            handler, test_transforms = self.handler, self.test_transforms
+
+        try:
+            yield handler, test_transforms
+        finally:
+            with self._model_cond:
+                self._model_users -= 1
+                self._model_cond.notify_all()
+
+    def _set_model(self, handler: IHandler, test_transforms: Dict[str, dict]) -> None:
+        """
+        Replace handler and test transforms once calls using the current ones are done
+        """
+        with self._model_cond:
+            # new calls wait for the swap, so a steady stream of them doesn't starve it
+            self._swapping_model = True
+            try:
+                self._model_cond.wait_for(lambda: not self._model_users)
+                self.handler = handler
+                self.test_transforms = test_transforms
+            finally:
+                self._swapping_model = False
+                self._model_cond.notify_all()
+
     @staticmethod
     def get_cuda_and_handler_device_names(devices: Iterable[str]) -> Tuple[List[str], List[str]]:
         add_cpu = False
@@ -172,7 +238,7 @@ class TikTorchServer(INeuralNetworkAPI, IFlightControl):
             raise ValueError(incomplete_msg)
 
         # todo: move test_transforms elsewhere
-        self.test_transforms = model.config.get(TESTING, {}).get(TRANSFORMS, {"Normalize": {}})
+        test_transforms = model.config.get(TESTING, {}).get(TRANSFORMS, {"Normalize": {}})
 
         if not devices:
             devices = ["cpu"]
@@ -203,9 +269,10 @@ class TikTorchServer(INeuralNetworkAPI, IFlightControl):
             err_fut.set_exception(e)
             return err_fut
         else:
-            self.handler = create_client(IHandler, server_conn)
+            handler = create_client(IHandler, server_conn)
+            self._set_model(handler, test_transforms)
             try:
-                tik_fut = self.handler.set_devices(handler_devices)
+                tik_fut = handler.set_devices(handler_devices)
             except Exception as e:
                 self.logger.exception("set_devices failed")
                 err_fut = RPCFuture()
@@ -221,11 +288,17 @@ class TikTorchServer(INeuralNetworkAPI, IFlightControl):
         return [c.name for c in mp.active_children()]
 
     def forward(self, image: NDArray) -> RPCFuture[NDArray]:
-        # todo: do transform in separate thread
-        transform = Compose(*[get_transform(name, **kwargs) for name, kwargs in self.test_transforms.items()])
-        return self.handler.forward(
-            data=TikTensor(transform(image.as_numpy()).astype(numpy.float32), id_=image.id)
-        ).map(lambda val: NDArray(val.as_numpy(), id_=val.id))
+        with self._using_model() as (handler, test_transforms):
+            # todo: do transform in separate thread
+            transform = Compose(*[get_transform(name, **kwargs) for name, kwargs in test_transforms.items()])
+            data = TikTensor(transform(image.as_numpy()).astype(numpy.float32), id_=image.id)
+            return handler.forward(data=data).map(lambda val: NDArray(val.as_numpy(), id_=val.id))
+
+    def forward_tiled(self, image: NDArray, blend: bool = False) -> RPCFuture[NDArray]:
+        with self._using_model() as (handler, test_transforms):
+            transform = Compose(*[get_transform(name, **kwargs) for name, kwargs in test_transforms.items()])
+            data = TikTensor(transform(image.as_numpy()).astype(numpy.float32), id_=image.id)
+            return handler.forward_tiled(data=data, blend=blend).map(lambda val: NDArray(val.as_numpy(), id_=val.id))
 
     def update_training_data(self, data: NDArrayBatch, labels: NDArrayBatch) -> None:
         self.handler.update_training_data(TikTensorBatch(data), TikTensorBatch(labels))
@@ -249,8 +322,19 @@ class TikTorchServer(INeuralNetworkAPI, IFlightControl):
     def last_ping(self) -> Optional[float]:
         return self._last_ping
 
+    def get_rpc_stats(self) -> Dict[str, Any]:
+        processes = {"server": metrics.registry.snapshot()}
+        if self.handler is not None:
+            try:
+                processes.update(self.handler.get_rpc_stats.async_().result(timeout=STATS_TIMEOUT))
+            except Exception as e:
+                self.logger.warning("Failed to get rpc stats of handler: %s", e)
+
+        return {"processes": processes, "total": metrics.merge(processes.values())}
+
     def get_model_state(self) -> ModelState:
-        return self.handler.get_state()
+        with self._using_model() as (handler, _test_transforms):
+            return handler.get_state()
 
     def remove_data(self, dataset_name: str, ids: List[str]) -> None:
         return self.handler.remove_data(dataset_name, ids)
@@ -269,17 +353,42 @@ class TikTorchServer(INeuralNetworkAPI, IFlightControl):
 
 
 class ServerProcess:
-    def __init__(self, address: str, port: str, notify_port: str, kill_timeout: int):
+    def __init__(
+        self,
+        address: str,
+        port: str,
+        notify_port: str,
+        kill_timeout: int,
+        workers: int = RPC_WORKERS,
+        ipc_path: Optional[str] = None,
+    ):
+        """
+        :param ipc_path: listen on unix domain socket files instead of tcp address and ports
+        """
         self._addr = address
         self._port = port
         self._notify_port = notify_port
         self._kill_timeout = kill_timeout
+        self._workers = workers
+        self._ipc_path = ipc_path
 
     def listen(self, provider_cls: INeuralNetworkAPI = TikTorchServer):
         api_provider = provider_cls()
 
-        conf = TCPConnConf(self._addr, self._port, self._notify_port)
-        srv = Server(api_provider, conf)
+        # shared memory is used only if client offers it and turns out to be on the same host,
+        # compression codec is chosen by client, binary header, deadlines and trace ids are used if client supports them
+        wire_options = WireOptions(
+            shm=True,
+            compression=tuple(compression.available()),
+            binary_header=BINARY_HEADER_VERSION,
+            deadlines=True,
+            tracing=True,
+        )
+        if self._ipc_path:
+            conf = IPCConnConf(self._ipc_path, wire_options=wire_options)
+        else:
+            conf = TCPConnConf(self._addr, self._port, self._notify_port, wire_options=wire_options)
+        srv = Server(api_provider, conf, max_workers=self._workers, serial_methods=SERIAL_METHODS)
         client = Client(IFlightControl(), conf)
 
         watchdog = Watchdog(client, self._kill_timeout)
@@ -288,6 +397,50 @@ class ServerProcess:
         srv.listen()
 
 
+@contextmanager
+def embedded_server(
+    provider_cls: Type[INeuralNetworkAPI] = TikTorchServer,
+    *,
+    ctx: Optional[zmq.Context] = None,
+    workers: int = RPC_WORKERS,
+    timeout: Optional[int] = None,
+) -> Iterator[INeuralNetworkAPI]:
+    """
+    Run server on a background thread of this process instead of a separate server process
+
+    Client and server talk over inproc sockets of shared *ctx*, frames are handed over by reference,
+    so arrays received by the server are read-only views of arrays passed by the caller.
+    These must not be modified until the call returns or its future is resolved.
+
+        with embedded_server() as client:
+            client.load_model(model, state, devices).result()
+            client.forward(NDArray(arr)).result()
+
+    :param timeout: in ms, of calls made by returned client
+    :returns client of server, server is shut down on exit
+    """
+    ctx = ctx or zmq.Context.instance()
+    name = f"tiktorch-{uuid4().hex}"
+    # shared memory and compression would only add copies
+    wire_options = WireOptions(binary_header=BINARY_HEADER_VERSION, deadlines=True, tracing=True)
+    conf = InprocConnConf(name, f"{name}-notify", ctx, timeout=timeout, wire_options=wire_options)
+
+    srv = Server(provider_cls(), conf, max_workers=workers, serial_methods=SERIAL_METHODS)
+    thread = threading.Thread(target=srv.listen, name="EmbeddedServer", daemon=True)
+    thread.start()
+
+    try:
+        yield Client(INeuralNetworkAPI(), conf)
+    finally:
+        # shutdown call would never return if server thread has died
+        if thread.is_alive():
+            try:
+                Client(IFlightControl(), conf).shutdown()
+            except Shutdown:
+                pass
+        thread.join()
+
+
 def main():
     # Output pid for process tracking
     print(os.getpid(), flush=True)
@@ -299,11 +452,27 @@ def main():
     parsey.add_argument("--debug", action="store_true")
     parsey.add_argument("--dummy", action="store_true")
     parsey.add_argument("--kill-timeout", type=int, default=KILL_TIMEOUT)
+    parsey.add_argument("--workers", type=int, default=RPC_WORKERS, help="rpc worker threads, 0 to serve inline")
+    parsey.add_argument("--trace-dir", type=str, default=None, help="record request traces of all server processes")
+    parsey.add_argument("--ipc-path", type=str, default=None, help="listen on unix domain socket instead of tcp")
 
     args = parsey.parse_args()
-    print(f"Starting server on {args.addr}:{args.port}")
+    if args.trace_dir:
+        tracing.enable(args.trace_dir)
 
-    srv = ServerProcess(address=args.addr, port=args.port, notify_port=args.notify_port, kill_timeout=args.kill_timeout)
+    if args.ipc_path:
+        print(f"Starting server on ipc://{args.ipc_path}")
+    else:
+        print(f"Starting server on {args.addr}:{args.port}")
+
+    srv = ServerProcess(
+        address=args.addr,
+        port=args.port,
+        notify_port=args.notify_port,
+        kill_timeout=args.kill_timeout,
+        workers=args.workers,
+        ipc_path=args.ipc_path,
+    )
 
     if args.dummy:
         from tiktorch.dev.dummy_server import DummyServerForFrontendDev
@@ -0,0 +1,259 @@
+"""
+Batch size control for inference
+
+The best batch size is learned per device and input shape. Starting from the initial batch
+size, it is doubled as long as the measured throughput (items per second) of full batches
+improves by more than *tolerance*, and settles on the best one measured otherwise. Running
+out of memory caps the batch size below the failing one, other errors don't affect it.
+
+Learned limits can be persisted to a json file, keyed by a hash of the model architecture,
+so that later sessions start with the best batch size right away:
+
+    {model hash: {device: {"1x256x256": {"batch_size": 8, "oom_at": 16}}}}
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 100
+# full batches measured before batch size is judged
+MIN_SAMPLES = 3
+TOLERANCE = 0.05
+SMOOTHING = 0.3
+
+Shape = Tuple[int, ...]
+
+
+def is_out_of_memory(exc: BaseException) -> bool:
+    if isinstance(exc, MemoryError):
+        return True
+
+    # torch.cuda.OutOfMemoryError is a RuntimeError as well, cpu allocator raises plain RuntimeError
+    msg = str(exc)
+    return isinstance(exc, RuntimeError) and any(
+        text in msg for text in ("out of memory", "can't allocate memory", "not enough memory")
+    )
+
+
+def model_hash(model: torch.nn.Module, init_kwargs: Optional[dict] = None) -> str:
+    """
+    :returns hash of model class and shapes of its parameters and buffers, weights are not included
+    """
+    description = [type(model).__module__, type(model).__qualname__, repr(sorted((init_kwargs or {}).items()))]
+    for name, tensor in model.state_dict().items():
+        description.append(f"{name}:{tuple(tensor.shape)}:{tensor.dtype}")
+
+    return hashlib.sha256("\n".join(description).encode("utf-8")).hexdigest()
+
+
+class _Limit:
+    __slots__ = ("current", "best", "oom_at", "converged", "throughput", "samples")
+
+    def __init__(self, batch_size: int, oom_at: Optional[int] = None, converged: bool = False) -> None:
+        # batch size in use, while exploring it's the candidate being measured
+        self.current = batch_size
+        self.best = batch_size
+        # smallest batch size which ran out of memory
+        self.oom_at = oom_at
+        self.converged = converged
+        # smoothed items per second and number of full batches measured by batch size
+        self.throughput: Dict[int, float] = {}
+        self.samples: Dict[int, int] = {}
+
+
+class BatchSizeController:
+    def __init__(
+        self,
+        initial: int = 1,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        cache_file: Optional[str] = None,
+        model_key: Optional[str] = None,
+        tolerance: float = TOLERANCE,
+    ) -> None:
+        """
+        :param initial: batch size to start with for device and shape not seen before
+        :param cache_file: json file learned limits are read from and written to, nothing is persisted if None
+        :param model_key: hash of model the limits are learned for, see model_hash
+        :param tolerance: relative throughput gain required to prefer larger batch size
+        """
+        if cache_file is not None and model_key is None:
+            raise ValueError("model_key is required to persist batch sizes")
+
+        self.initial = max(1, min(initial, max_batch_size))
+        self.max_batch_size = max_batch_size
+        self.cache_file = cache_file
+        self.model_key = model_key
+        self.tolerance = tolerance
+
+        self._lock = threading.Lock()
+        self._limits: Dict[Tuple[str, Shape], _Limit] = {}
+        self._load()
+
+    def batch_size(self, device: torch.device, shape: Sequence[int]) -> int:
+        """
+        :returns batch size to use for next batch of *shape* on *device*
+        """
+        with self._lock:
+            return self._get(device, shape).current
+
+    def record(self, device: torch.device, shape: Sequence[int], batch_size: int, elapsed: float) -> None:
+        """
+        Report successful forward pass of *batch_size* items which took *elapsed* seconds
+        """
+        save = False
+        with self._lock:
+            limit = self._get(device, shape)
+            # smaller batches (not enough requests queued) don't tell about batch size in use
+            if limit.converged or batch_size != limit.current or elapsed <= 0:
+                return
+
+            items_per_s = batch_size / elapsed
+            samples = limit.samples.get(batch_size, 0)
+            if samples:
+                items_per_s = SMOOTHING * items_per_s + (1 - SMOOTHING) * limit.throughput[batch_size]
+            limit.throughput[batch_size] = items_per_s
+            limit.samples[batch_size] = samples + 1
+            if samples + 1 < MIN_SAMPLES:
+                return
+
+            if batch_size == limit.best or items_per_s > limit.throughput[limit.best] * (1 + self.tolerance):
+                limit.best = batch_size
+                candidate = min(2 * batch_size, self.max_batch_size)
+                if limit.oom_at is not None:
+                    candidate = min(candidate, limit.oom_at - 1)
+
+                if candidate > batch_size:
+                    limit.current = candidate
+                else:
+                    limit.converged = True
+            else:
+                limit.current = limit.best
+                limit.converged = True
+
+            if limit.converged:
+                logger.info("batch size for %s on %s settled at %d", _shape_key(shape), device, limit.best)
+                save = True
+
+        if save:
+            self.save()
+
+    def out_of_memory(self, device: torch.device, shape: Sequence[int], batch_size: int) -> int:
+        """
+        Report that forward pass of *batch_size* items ran out of memory
+
+        :returns batch size to retry with
+        """
+        with self._lock:
+            limit = self._get(device, shape)
+            limit.oom_at = batch_size if limit.oom_at is None else min(limit.oom_at, batch_size)
+            if limit.best >= batch_size:
+                # limit learned before (e.g. by other session) doesn't hold anymore
+                limit.best = max(1, batch_size // 2)
+                limit.throughput.clear()
+                limit.samples.clear()
+
+            limit.current = limit.best
+            limit.converged = True
+            logger.info(
+                "batch size %d for %s on %s ran out of memory, using %d",
+                batch_size,
+                _shape_key(shape),
+                device,
+                limit.current,
+            )
+            retry = limit.current
+
+        self.save()
+        return retry
+
+    def stats(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """
+        :returns {device: {shape: {batch_size, oom_at, converged, items_per_s}}}
+        """
+        with self._lock:
+            stats: Dict[str, Dict[str, Dict[str, Any]]] = {}
+            for (device, shape), limit in self._limits.items():
+                stats.setdefault(device, {})[_shape_key(shape)] = {
+                    "batch_size": limit.current,
+                    "oom_at": limit.oom_at,
+                    "converged": limit.converged,
+                    "items_per_s": limit.throughput.get(limit.current, 0.0),
+                }
+            return stats
+
+    def save(self) -> None:
+        """
+        Write limits settled so far to cache file, limits of other models in the file are kept
+        """
+        if self.cache_file is None:
+            return
+
+        with self._lock:
+            learned: Dict[str, Dict[str, Dict[str, Any]]] = {}
+            for (device, shape), limit in self._limits.items():
+                if limit.converged:
+                    learned.setdefault(device, {})[_shape_key(shape)] = {
+                        "batch_size": limit.best,
+                        "oom_at": limit.oom_at,
+                    }
+
+            try:
+                cache = self._read_cache()
+                cache[self.model_key] = learned
+                directory = os.path.dirname(os.path.abspath(self.cache_file))
+                os.makedirs(directory, exist_ok=True)
+                # replace file at once, other sessions may read it concurrently
+                fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".batch_sizes-")
+                with os.fdopen(fd, "w") as f:
+                    json.dump(cache, f, indent=2, sort_keys=True)
+                os.replace(tmp_path, self.cache_file)
+            except OSError:
+                logger.warning("Failed to write batch size cache %s", self.cache_file, exc_info=True)
+
+    def _load(self) -> None:
+        if self.cache_file is None:
+            return
+
+        try:
+            for device, by_shape in self._read_cache().get(self.model_key, {}).items():
+                for shape_key, learned in by_shape.items():
+                    shape = tuple(int(size) for size in shape_key.split("x"))
+                    batch_size = max(1, min(int(learned["batch_size"]), self.max_batch_size))
+                    self._limits[(device, shape)] = _Limit(batch_size, oom_at=learned.get("oom_at"), converged=True)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            logger.warning("Ignoring malformed batch size cache %s", self.cache_file, exc_info=True)
+            self._limits.clear()
+
+        if self._limits:
+            logger.debug("loaded %d batch size limits from %s", len(self._limits), self.cache_file)
+
+    def _read_cache(self) -> Dict[str, Any]:
+        try:
+            with open(self.cache_file) as f:
+                cache = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            logger.warning("Ignoring unreadable batch size cache %s", self.cache_file, exc_info=True)
+            return {}
+
+        return cache if isinstance(cache, dict) else {}
+
+    def _get(self, device: torch.device, shape: Sequence[int]) -> _Limit:
+        key = (str(device), tuple(shape))
+        limit = self._limits.get(key)
+        if limit is None:
+            limit = self._limits[key] = _Limit(self.initial)
+        return limit
+
+
+def _shape_key(shape: Sequence[int]) -> str:
+    return "x".join(str(size) for size in shape)
@@ -0,0 +1,157 @@
+"""
+Dynamic batching of queued requests
+
+Workers block in get_batch until requests arrive. A batch is handed out as soon as it is
+full or its oldest request has been queued for *max_delay* seconds, whichever comes first,
+so a single request waits at most *max_delay* for company and idle workers don't spin.
+
+Items are put into buckets (e.g. by shape and dtype of request), a batch is made of items
+of one bucket only. Full buckets are served first, otherwise the bucket with the oldest item.
+
+Waiting workers take turns in the order they asked for work: only the first one collects
+a batch, the others queue behind it. A worker which just finished a batch asks again at
+the end of the line, so with several devices batches are spread evenly over them.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Generic, Hashable, List, Optional, Tuple, TypeVar, Union
+
+from tiktorch.rpc.metrics import Histogram
+
+MAX_DELAY = 0.005  # seconds
+
+T = TypeVar("T")
+
+
+class Batcher(Generic[T]):
+    def __init__(self, max_delay: float = MAX_DELAY) -> None:
+        """
+        :param max_delay: longest time in seconds the oldest queued item waits for batch to fill up
+        """
+        self.max_delay = max_delay
+        self._cond = threading.Condition()
+        # bucket -> key -> (item, queued at), oldest first
+        self._buckets: "Dict[Hashable, OrderedDict[Hashable, Tuple[T, float]]]" = {}
+        self._bucket_of: Dict[Hashable, Hashable] = {}
+        self._waiting: Deque[object] = deque()
+        self._interrupts = 0
+        self._batch_size = Histogram()
+        self._queue_delay_us = Histogram()
+
+    def __len__(self) -> int:
+        return len(self._bucket_of)
+
+    def put(self, key: Hashable, item: T, bucket: Hashable = None) -> None:
+        """
+        :param bucket: items of different buckets are never batched together
+        """
+        with self._cond:
+            self._buckets.setdefault(bucket, OrderedDict())[key] = (item, time.monotonic())
+            self._bucket_of[key] = bucket
+            self._cond.notify_all()
+
+    def discard(self, key: Hashable) -> bool:
+        """
+        Remove item which is no longer worth computing (e.g. cancelled)
+
+        :returns True if item was queued
+        """
+        with self._cond:
+            if key not in self._bucket_of:
+                return False
+
+            bucket = self._bucket_of.pop(key)
+            queue = self._buckets[bucket]
+            del queue[key]
+            if not queue:
+                del self._buckets[bucket]
+            return True
+
+    def interrupt(self) -> None:
+        """
+        Wake up all workers waiting in get_batch, they return an empty batch
+        """
+        with self._cond:
+            self._interrupts += 1
+            self._cond.notify_all()
+
+    def get_batch(self, max_size: Union[int, Callable[[Hashable], int]], timeout: Optional[float] = None) -> List[T]:
+        """
+        Wait for turn and for batch to be full or its oldest item to be due
+
+        :param max_size: maximum number of items in batch, or function returning it for a bucket
+        :param timeout: seconds to wait for the first item, waits indefinitely if None
+        :returns items of one bucket in order they were queued, empty on timeout or interrupt
+        """
+        token = object()
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._cond:
+            interrupts = self._interrupts
+            self._waiting.append(token)
+            try:
+                while True:
+                    if self._interrupts != interrupts:
+                        return []
+
+                    now = time.monotonic()
+                    if self._waiting[0] is token and self._buckets:
+                        due, bucket, flush_at = self._next_bucket(max_size, now)
+                        if due:
+                            break
+
+                        self._cond.wait(flush_at - now)
+                    elif deadline is not None and now >= deadline:
+                        return []
+                    else:
+                        self._cond.wait(None if deadline is None else deadline - now)
+
+                batch = []
+                queue = self._buckets[bucket]
+                size = self._max_size(max_size, bucket)
+                while queue and len(batch) < size:
+                    key, (item, queued_at) = queue.popitem(last=False)
+                    del self._bucket_of[key]
+                    self._queue_delay_us.record((now - queued_at) * 1e6)
+                    batch.append(item)
+
+                if not queue:
+                    del self._buckets[bucket]
+
+                self._batch_size.record(len(batch))
+                return batch
+            finally:
+                self._waiting.remove(token)
+                # next worker in line may take its turn
+                self._cond.notify_all()
+
+    @staticmethod
+    def _max_size(max_size: Union[int, Callable[[Hashable], int]], bucket: Hashable) -> int:
+        return max_size(bucket) if callable(max_size) else max_size
+
+    def _next_bucket(self, max_size: Union[int, Callable[[Hashable], int]], now: float) -> Tuple[bool, Hashable, float]:
+        """
+        :returns whether a bucket is due, the bucket to serve and when it is due
+        """
+        heads = []
+        for bucket, queue in self._buckets.items():
+            _item, queued_at = next(iter(queue.values()))
+            heads.append((len(queue) >= self._max_size(max_size, bucket), queued_at, bucket))
+
+        full = [(queued_at, bucket) for is_full, queued_at, bucket in heads if is_full]
+        if full:
+            return True, min(full, key=lambda head: head[0])[1], now
+
+        _is_full, queued_at, bucket = min(heads, key=lambda head: head[1])
+        flush_at = queued_at + self.max_delay
+        return now >= flush_at, bucket, flush_at
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        :returns
+            batch_size: histogram of number of items in batches handed out
+            queue_delay_us: histogram of time items spent queued in microseconds
+        """
+        with self._cond:
+            return {"batch_size": self._batch_size.as_dict(), "queue_delay_us": self._queue_delay_us.as_dict()}
@@ -45,7 +45,7 @@ from tiktorch.configkeys import (
     TRAINING_SHAPE_LOWER_BOUND,
     TRAINING_SHAPE_UPPER_BOUND,
 )
-from tiktorch.rpc import RPCFuture, RPCInterface, Shutdown, exposed
+from tiktorch.rpc import RPCFuture, RPCInterface, Shutdown, exposed, metrics
 from tiktorch.rpc.mp import MPServer
 from tiktorch.types import Point
 from tiktorch.utils import add_logger
@@ -88,6 +88,10 @@ class IDryRun(RPCInterface):
     def shutdown(self) -> Shutdown:
         raise NotImplementedError
 
+    @exposed
+    def get_rpc_stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
 
 def run(conn: Connection, config: dict, model: torch.nn.Module, log_queue: Optional[mp.Queue] = None):
     log.configure(log_queue)
@@ -450,6 +454,9 @@ class DryRunProcess(IDryRun):
 
         return None
 
+    def get_rpc_stats(self) -> Dict[str, Any]:
+        return metrics.registry.snapshot()
+
     def shutdown(self) -> Shutdown:
         self.logger.debug("Shutting down...")
         self.shutdown_event.set()
@@ -2,14 +2,19 @@ import importlib
 import io
 import logging
 import logging.config
+import operator
 import os.path
 import queue
 import shutil
 import sys
 import tempfile
 import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial, reduce
 from multiprocessing.connection import Connection, wait
-from typing import Any, Callable, Dict, Generic, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Union
+from typing import Any, Callable, Deque, Dict, Generic, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Union
 
 import torch
 from torch import multiprocessing as mp
@@ -17,6 +22,8 @@ from torch import multiprocessing as mp
 from tiktorch import log
 from tiktorch.configkeys import (
     BATCH_SIZE,
+    INFERENCE_MAX_QUEUE_DEPTH,
+    INFERENCE_MAX_QUEUED_BYTES,
     LOSS_CRITERION_CONFIG,
     MODEL_CLASS_NAME,
     MODEL_INIT_KWARGS,
@@ -32,8 +39,9 @@ from tiktorch.configkeys import (
     TRAINING_SHAPE_UPPER_BOUND,
     VALIDATION,
 )
-from tiktorch.rpc import RPCFuture, RPCInterface, Timeout, exposed
+from tiktorch.rpc import Overloaded, RPCFuture, RPCInterface, Timeout, exposed, metrics
 from tiktorch.rpc.mp import MPClient, MPServer, Shutdown, create_client
+from tiktorch.server import admission, tiling
 from tiktorch.tiktypes import LabeledTikTensor, LabeledTikTensorBatch, TikTensor, TikTensorBatch
 from tiktorch.types import ModelState, Point
 from tiktorch.utils import add_logger, get_error_msg_for_incomplete_config, get_error_msg_for_invalid_config
@@ -44,6 +52,8 @@ from .inference import IInference
 from .inference import run as run_inference
 from tiktorch.server.training import start_training_process
 
+STATS_TIMEOUT = 5  # seconds
+
 
 class IHandler(RPCInterface):
     @exposed
@@ -67,6 +77,10 @@ class IHandler(RPCInterface):
     def forward(self, data: TikTensor) -> RPCFuture[TikTensor]:
         raise NotImplementedError
 
+    @exposed
+    def forward_tiled(self, data: TikTensor, blend: bool = False) -> RPCFuture[TikTensor]:
+        raise NotImplementedError
+
     # Training
     @exposed
     def resume_training(self) -> None:
@@ -92,6 +106,14 @@ class IHandler(RPCInterface):
     def remove_data(self, dataset_name: str, ids: List[str]) -> None:
         raise NotImplementedError
 
+    @exposed
+    def get_admission_stats(self) -> Dict[str, Dict[str, int]]:
+        raise NotImplementedError
+
+    @exposed
+    def get_rpc_stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
 
 def run(
     conn: Connection,
@@ -145,6 +167,12 @@ class HandlerProcess(IHandler):
         self.idle_devices: List[torch.device] = []
         self.training_devices: List[torch.device] = []
         self.inference_devices: List[torch.device] = []
+        # forward requests waiting for the inference process
+        self.admission = admission.Admission.from_config(config, name="handler")
+        # submits tiles of forward_tiled requests and stitches their predictions
+        self.tiled_executor = ThreadPoolExecutor(
+            max_workers=tiling.MAX_TILED_REQUESTS, thread_name_prefix="ForwardTiled"
+        )
 
         self.tempdir = tempfile.mkdtemp()
         user_module_name = "usermodel"
@@ -292,6 +320,8 @@ class HandlerProcess(IHandler):
                 else:
                     assert self.shrinkage == shrinkage
 
+                self.inference.set_valid_shapes([tuple(shape) for shape in self.valid_shapes])
+
             # wait for old devices to be free
             # todo: wait for old devices to be free (when they are returned as futures)
             # freed_training_devices_fut.result()
@@ -408,6 +438,9 @@ class HandlerProcess(IHandler):
         except TimeoutError as e:
             self.logger.error(e)
 
+        # queued tiled requests fail once inference process is gone, running ones aren't waited for
+        self.tiled_executor.shutdown(wait=False)
+
         timeout = 20
         # shutdown processes
         try:
@@ -484,7 +517,151 @@ class HandlerProcess(IHandler):
             self.new_device_names.put("whatever_just_update_idle_because_this_is_not_a_tuple_nor_None")
 
         self.logger.debug("forward")
-        return self.inference.forward(data)
+        fut = RPCFuture()
+        try:
+            shed = self.admission.admit(fut, fut, admission.nbytes(data))
+        except Overloaded as e:
+            fut.set_exception(e)
+            return fut
+
+        for shed_fut in shed:
+            admission.fail(shed_fut, "handler: request shed to make room for newer requests")
+
+        remote = self.inference.forward(data)
+        remote.add_done_callback(partial(self._forward_done, fut))
+        # shed or cancelled requests are cancelled in inference process as well
+        fut.add_done_callback(lambda _: remote.cancel())
+        return fut
+
+    def _forward_done(self, fut: RPCFuture[TikTensor], remote: Future) -> None:
+        # released already if request was shed or cancelled
+        if self.admission.release(fut) is None:
+            return
+
+        if remote.cancelled():
+            fut.cancel()
+        elif not fut.set_running_or_notify_cancel():
+            return
+        elif remote.exception() is not None:
+            fut.set_exception(remote.exception())
+        else:
+            fut.set_result(remote.result())
+
+    def forward_tiled(self, data: TikTensor, blend: bool = False) -> RPCFuture[TikTensor]:
+        """
+        Predict image of arbitrary size by tiling it into valid shapes
+
+        :param data: image with channel axis first, followed by 2 or 3 spatial axes
+        :param blend: overlap tiles and blend their predictions instead of abutting them
+        """
+        if not self.inference_devices:
+            self.new_device_names.put("whatever_just_update_idle_because_this_is_not_a_tuple_nor_None")
+
+        self.logger.debug("forward tiled")
+        fut = RPCFuture()
+        if self.valid_shapes is None or self.shrinkage is None:
+            fut.set_exception(ValueError("Valid shapes are unknown before dry run, set devices first"))
+            return fut
+
+        try:
+            shed = self.admission.admit(fut, fut, admission.nbytes(data))
+        except Overloaded as e:
+            fut.set_exception(e)
+            return fut
+
+        for shed_fut in shed:
+            admission.fail(shed_fut, "handler: request shed to make room for newer requests")
+
+        self.tiled_executor.submit(add_logger(self.logger)(self._forward_tiled_worker), data, blend, fut)
+        return fut
+
+    def _forward_tiled_worker(self, data: TikTensor, blend: bool, fut: RPCFuture[TikTensor]) -> None:
+        error: Optional[Exception] = None
+        try:
+            pred = self._forward_tiles(data, blend, fut)
+        except Exception as e:
+            error = e
+
+        # released already if request was shed
+        if self.admission.release(fut) is None or not fut.set_running_or_notify_cancel():
+            return
+
+        if error is None:
+            fut.set_result(pred)
+        else:
+            fut.set_exception(error)
+
+    def _tile_window(self, tile_bytes: int) -> int:
+        """
+        :returns number of tiles of one image kept in flight, within limits of inference admission
+        """
+        window = tiling.MAX_TILES_IN_FLIGHT
+        max_depth = self.config.get(INFERENCE_MAX_QUEUE_DEPTH)
+        if max_depth is not None:
+            window = min(window, max_depth)
+        max_bytes = self.config.get(INFERENCE_MAX_QUEUED_BYTES)
+        if max_bytes is not None:
+            window = min(window, max_bytes // tile_bytes)
+
+        return max(window, 1)
+
+    def _forward_tiles(self, data: TikTensor, blend: bool, fut: RPCFuture[TikTensor]) -> Optional[TikTensor]:
+        """
+        Submit tiles to inference process, at most MAX_TILES_IN_FLIGHT at once
+
+        Inference queue is shared with other requests, tiles rejected by its admission are resubmitted
+        with fewer tiles in flight. Once no tile is left in flight rejected one is resubmitted after
+        a backoff, request fails after TILE_RETRIES backoffs without any tile predicted in between.
+
+        :returns stitched prediction, None if fut is done before all tiles are submitted
+        """
+        image = data.as_numpy()
+        tiles = tiling.Tiling.for_valid_shapes(
+            tuple(image.shape), [tuple(shape) for shape in self.valid_shapes], tuple(self.shrinkage), blend
+        )
+        window = self._tile_window(image.itemsize * reduce(operator.mul, tiles.tile_shape, 1))
+        self.logger.debug("forward %d tiles of shape %s, %d at once", len(tiles), tiles.tile_shape, window)
+        stitcher = tiling.Stitcher(tiles, blend)
+        pending = (TikTensor(tile, id_=start) for start, tile in tiles.tiles(image))
+        rejected: Deque[TikTensor] = deque()
+        in_flight: Deque[Tuple[TikTensor, Future]] = deque()
+        backoffs = 0
+        try:
+            while True:
+                while len(in_flight) < window:
+                    tile = rejected.popleft() if rejected else next(pending, None)
+                    if tile is None:
+                        break
+                    if fut.done():
+                        return None
+
+                    in_flight.append((tile, self.inference.forward(tile)))
+
+                if not in_flight:
+                    break
+
+                tile, remote = in_flight.popleft()
+                try:
+                    pred = remote.result()
+                except Overloaded:
+                    window = max(window // 2, 1)
+                    if not in_flight:
+                        # nothing of ours to wait for, queue is filled by other requests
+                        backoffs += 1
+                        if backoffs > tiling.TILE_RETRIES:
+                            raise
+
+                        time.sleep(tiling.TILE_BACKOFF * 2 ** (backoffs - 1))
+                    rejected.append(tile)
+                    continue
+
+                backoffs = 0
+                stitcher.add(tile.id, pred.as_numpy())
+        finally:
+            for _tile, remote in in_flight:
+                remote.cancel()
+
+        return TikTensor(stitcher.result(), id_=data.id)
 
     # training
     def resume_training(self) -> None:
@@ -509,6 +686,33 @@ class HandlerProcess(IHandler):
     def remove_data(self, dataset_name: str, ids: List[str]) -> None:
         return self.training.remove_data(dataset_name, ids)
 
+    def get_admission_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        :returns admission stats of this and inference process, see Admission.stats
+        """
+        return {"handler": self.admission.stats(), "inference": self.inference.get_admission_stats()}
+
+    def get_rpc_stats(self) -> Dict[str, Any]:
+        """
+        :returns rpc metrics snapshot of this and every running child process by process name
+        """
+        stats = {"handler": metrics.registry.snapshot()}
+        children = [
+            ("inference", self._inference_proc, self.inference),
+            ("training", self._training_proc, self.training),
+            ("dry_run", self._dry_run_proc, self.dry_run),
+        ]
+        for name, proc, client in children:
+            if not proc.is_alive():
+                continue
+
+            try:
+                stats[name] = client.get_rpc_stats.async_().result(timeout=STATS_TIMEOUT)
+            except Exception as e:
+                self.logger.warning("Failed to get rpc stats of %s process: %s", name, e)
+
+        return stats
+
     # def request_state(self) -> None:
     #     model_state = pickle.dumps(self.model.state_dict())
     #     optimizer_state = pickle.dumps(self.model.optimizer.state_dict())
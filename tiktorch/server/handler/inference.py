@@ -1,8 +1,11 @@
+import functools
 import logging
 import multiprocessing as mp
+import operator
 import os
 import queue
 import threading
+import time
 import traceback
 from concurrent.futures import Future, ThreadPoolExecutor
 from multiprocessing.connection import Connection
@@ -26,9 +29,20 @@ from typing import (
 import torch.nn
 
 from tiktorch import log
-from tiktorch.configkeys import INFERENCE_BATCH_SIZE
-from tiktorch.rpc import RPCFuture, RPCInterface, Shutdown, exposed
+from tiktorch.configkeys import (
+    INFERENCE_BATCH_SIZE,
+    INFERENCE_BATCH_SIZE_CACHE,
+    INFERENCE_MAX_BATCH_DELAY,
+    INFERENCE_MAX_BATCH_SIZE,
+    INFERENCE_PAD_TO_VALID_SHAPE,
+    MODEL_INIT_KWARGS,
+)
+from tiktorch.rpc import RPCFuture, RPCInterface, Shutdown, exposed, metrics
+from tiktorch.rpc.deadline import SkipCounter, expired, get_deadline
+from tiktorch.rpc.exceptions import DeadlineExceeded, Overloaded
 from tiktorch.rpc.mp import MPServer
+from tiktorch.rpc.tracing import get_trace_id, record
+from tiktorch.server import admission, batch_control, batching
 from tiktorch.tiktypes import TikTensor, TikTensorBatch
 from tiktorch.utils import add_logger
 
@@ -50,6 +64,26 @@ class IInference(RPCInterface):
     def forward(self, data: TikTensor) -> RPCFuture[TikTensor]:
         raise NotImplementedError
 
+    @exposed
+    def get_skipped(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    @exposed
+    def set_valid_shapes(self, shapes: Sequence[Sequence[int]]) -> None:
+        raise NotImplementedError
+
+    @exposed
+    def get_admission_stats(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    @exposed
+    def get_forward_stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    @exposed
+    def get_rpc_stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
 
 def run(conn: Connection, config: dict, model: torch.nn.Module, log_queue: Optional[mp.Queue] = None):
     log.configure(log_queue)
@@ -68,11 +102,30 @@ class InferenceProcess(IInference):
         self.logger.info("started")
         self.config = config
         self.training_model = model
+        self.stats_lock = threading.Lock()
+        self.replica_build_us = metrics.Histogram()
+        self.compute_us = metrics.Histogram()
 
         self.shutdown_event = threading.Event()
 
-        self.batch_size: int = config.get(INFERENCE_BATCH_SIZE, None)
-        self.forward_queue = queue.Queue()
+        # learned per device and input shape, starting from INFERENCE_BATCH_SIZE
+        # 'inference_max_cpu_batch_size' is the former name of INFERENCE_MAX_BATCH_SIZE
+        self.batch_sizes = batch_control.BatchSizeController(
+            initial=config.get(INFERENCE_BATCH_SIZE) or 1,
+            max_batch_size=config.get(INFERENCE_MAX_BATCH_SIZE)
+            or config.get("inference_max_cpu_batch_size", batch_control.MAX_BATCH_SIZE),
+            cache_file=config.get(INFERENCE_BATCH_SIZE_CACHE),
+            model_key=batch_control.model_hash(model, config.get(MODEL_INIT_KWARGS)),
+        )
+        # futures of forward requests, their data is kept by admission until a worker takes them
+        max_delay = config.get(INFERENCE_MAX_BATCH_DELAY)
+        self.batcher = batching.Batcher(batching.MAX_DELAY if max_delay is None else max_delay)
+        # requests are batched by shape, smaller ones are padded to a valid shape if enabled
+        self.pad_to_valid_shape = bool(config.get(INFERENCE_PAD_TO_VALID_SHAPE))
+        self.valid_shapes: List[Tuple[int, ...]] = []
+        self.admission = admission.Admission.from_config(config, name="inference")
+        # forward requests dropped before compute
+        self.skipped = SkipCounter()
         self.shutdown_worker_events = {}
         self.forward_worker_threads = {}
         self.devices = set()
@@ -111,6 +164,8 @@ class InferenceProcess(IInference):
             assert d in self.forward_worker_threads
             self.shutdown_worker_events[d].set()
 
+        self.batcher.interrupt()
+
         for d in devices:
             self.forward_worker_threads[d].join()
             del self.forward_worker_threads[d]
@@ -132,24 +187,78 @@ class InferenceProcess(IInference):
 
         self.devices.update(devices)
 
-    def _forward_worker(self, device: torch.device) -> None:
-        local_data = threading.local()
-        local_data.increase_batch_size = True
-        if self.batch_size is None:
-            local_data.batch_size = 1
+    def _build_replica(self, device: torch.device) -> torch.nn.Module:
+        """
+        :returns copy of training model in eval mode on *device*
+        """
+        start = time.monotonic()
+        # TODO: Maybe use todevice
+        if device.type == "cuda":
+            with torch.cuda.device(device.index):
+                model = self.training_model.__class__(**self.config.get("model_init_kwargs", {}))
         else:
-            local_data.batch_size = self.batch_size
+            model = self.training_model.__class__(**self.config.get("model_init_kwargs", {}))
 
+        model.load_state_dict(self.training_model.state_dict())
+        model.eval()
+        model = model.to(device=device)
+
+        elapsed = time.monotonic() - start
+        with self.stats_lock:
+            self.replica_build_us.record(elapsed * 1e6)
+        self.logger.debug("built replica on %s in %.3fs", device, elapsed)
+        return model
+
+    def _forward_worker(self, device: torch.device) -> None:
+        local_data = threading.local()
+        # replica is owned by this worker and freed when device is removed
+        local_data.model = self._build_replica(device)
+        try:
+            self._forward_loop(device, local_data)
+        finally:
+            local_data.model = None
+            if device.type == "cuda":
+                with torch.cuda.device(device.index):
+                    torch.cuda.empty_cache()
+
+    def _forward_loop(self, device: torch.device, local_data: threading.local) -> None:
         while not self.shutdown_worker_events[device].is_set() and not self.shutdown_event.is_set():
-            data_batch, fut_batch = [], []
-            while not self.forward_queue.empty() and len(data_batch) < local_data.batch_size:
-                data, fut = self.forward_queue.get()
+            # blocks until batch is full or due, timeout and interrupt let worker check for shutdown
+            queued_batch = self.batcher.get_batch(
+                lambda bucket: self.batch_sizes.batch_size(device, bucket[0]), timeout=1
+            )
+            data_batch, fut_batch, trace_batch, padding_batch = [], [], [], []
+            assembly_start = time.monotonic()
+            for fut in queued_batch:
+                item = self.admission.release(fut)
+                if item is None:
+                    # shed to make room for newer requests or cancelled while queued
+                    continue
+
+                data, fut, at, trace_id, queued_at, padding = item
+                record("queue wait", queued_at, assembly_start, trace_id, device=str(device))
+                # running future can't be cancelled anymore
+                if not fut.set_running_or_notify_cancel():
+                    self.skipped.cancelled()
+                    continue
+
+                if expired(at):
+                    self.skipped.expired()
+                    fut.set_exception(DeadlineExceeded(f"Deadline of forward exceeded for {data.id}"))
+                    continue
+
                 data_batch.append(data)
                 fut_batch.append(fut)
+                trace_batch.append(trace_id)
+                padding_batch.append(padding)
 
             if data_batch:
-                local_data.batch_size, local_data.increase_batch_size = self._forward(
-                    TikTensorBatch(data_batch), fut_batch, device, local_data.batch_size, local_data.increase_batch_size
+                assembly_end = time.monotonic()
+                for trace_id in trace_batch:
+                    record("batch assembly", assembly_start, assembly_end, trace_id, batch=len(data_batch))
+
+                self._forward(
+                    local_data.model, TikTensorBatch(data_batch), fut_batch, device, trace_batch, padding_batch
                 )
 
     def set_devices(self, devices: Collection[torch.device]) -> RPCFuture[Set[torch.device]]:
@@ -158,11 +267,43 @@ class InferenceProcess(IInference):
         return fut
 
     def get_idle(self) -> bool:
-        return self.forward_queue.empty()
+        return not self.batcher
+
+    def get_skipped(self) -> Dict[str, int]:
+        return self.skipped.as_dict()
+
+    def set_valid_shapes(self, shapes: Sequence[Sequence[int]]) -> None:
+        """
+        :param shapes: shapes of input (without batch dimension) the model was validated for by the dry run
+        """
+        self.valid_shapes = [tuple(shape) for shape in shapes]
+
+    def get_admission_stats(self) -> Dict[str, int]:
+        return self.admission.stats()
+
+    def get_forward_stats(self) -> Dict[str, Any]:
+        """
+        :returns
+            replica_build_us: histogram of time spent building device replicas of the model
+            compute_us: histogram of time spent in forward passes of the model
+            batch_size, queue_delay_us: histograms of batches handed to device workers, see Batcher.stats
+            batch_sizes: batch size in use by device and input shape, see BatchSizeController.stats
+        """
+        with self.stats_lock:
+            return {
+                "replica_build_us": self.replica_build_us.as_dict(),
+                "compute_us": self.compute_us.as_dict(),
+                **self.batcher.stats(),
+                "batch_sizes": self.batch_sizes.stats(),
+            }
+
+    def get_rpc_stats(self) -> Dict[str, Any]:
+        return metrics.registry.snapshot()
 
     def shutdown(self) -> Shutdown:
         self.logger.debug("Shutting down...")
         self.shutdown_event.set()
+        self.batcher.interrupt()
         try:
             self.device_setter_thread.join(timeout=20)
         except TimeoutError as e:
@@ -174,109 +315,131 @@ class InferenceProcess(IInference):
             except TimeoutError as e:
                 self.logger.error(e)
 
-        self.logger.debug("Shutdown complete")
+        self.logger.debug("Shutdown complete, skipped forward requests: %s", self.skipped.as_dict())
         return Shutdown()
 
     def forward(self, data: TikTensor) -> RPCFuture[TikTensor]:
         fut = RPCFuture()
-        self.forward_queue.put((data, fut))
+        padding = None
+        if self.pad_to_valid_shape:
+            data, padding = self._pad(data)
+
+        try:
+            # queue wait is reported for traced requests
+            shed = self.admission.admit(
+                fut, (data, fut, get_deadline(), get_trace_id(), time.monotonic(), padding), admission.nbytes(data)
+            )
+        except Overloaded as e:
+            fut.set_exception(e)
+            return fut
+
+        for _data, shed_fut, *_ in shed:
+            self.batcher.discard(shed_fut)
+            admission.fail(shed_fut, "inference: request shed to make room for newer requests")
+
+        # cancelled requests free their slot right away
+        fut.add_done_callback(self._release_cancelled)
+        # tensors of different shape or dtype can't be stacked into one batch
+        self.batcher.put(fut, fut, bucket=(tuple(data.shape), data.dtype))
         return fut
 
-    def _forward(
-        self, data: TikTensorBatch, fut: List[Future], device: torch.device, batch_size: int, increase_batch_size: bool
-    ) -> Tuple[int, bool]:
+    def _pad(self, data: TikTensor) -> Tuple[TikTensor, Optional[Tuple[int, ...]]]:
         """
-        :param data: input data to neural network
+        Pad data at the end of every axis to the smallest valid shape it fits into
+
+        :returns padded data and padding of every axis, None if there is no larger valid shape
         """
-        self.logger.debug("this is forward")
-        # TODO: Maybe use todevice
-        # TODO(novikov): Move model creation to worker
-        if device.type == "cuda":
-            with torch.cuda.device(device.index):
-                model = self.training_model.__class__(**self.config.get("model_init_kwargs", {}))
-        else:
-            model = self.training_model.__class__(**self.config.get("model_init_kwargs", {}))
+        shape = tuple(data.shape)
+        if shape in self.valid_shapes:
+            return data, None
+
+        fitting = [
+            valid
+            for valid in self.valid_shapes
+            if len(valid) == len(shape) and all(v >= s for v, s in zip(valid, shape))
+        ]
+        if not fitting:
+            return data, None
+
+        target = min(fitting, key=lambda valid: functools.reduce(operator.mul, valid, 1))
+        padding = tuple(t - s for t, s in zip(target, shape))
+        # torch pads last axis first
+        pad = [amount for axis_padding in reversed(padding) for amount in (0, axis_padding)]
+        return TikTensor(torch.nn.functional.pad(data.as_torch(), pad), id_=data.id), padding
+
+    @staticmethod
+    def _crop(pred: torch.Tensor, padding: Optional[Tuple[int, ...]]) -> torch.Tensor:
+        """
+        Remove prediction of padding added by _pad, axes of prediction correspond to axes of input
+        """
+        if padding is None:
+            return pred
 
-        model.load_state_dict(self.training_model.state_dict())
-        model.eval()
-        model = model.to(device=device)
+        return pred[tuple(slice(0, size - amount) for size, amount in zip(pred.shape, padding))]
+
+    def _release_cancelled(self, fut: Future) -> None:
+        if fut.cancelled() and self.admission.release(fut) is not None:
+            self.batcher.discard(fut)
+            self.skipped.cancelled()
 
+    def _forward(
+        self,
+        model: torch.nn.Module,
+        data: TikTensorBatch,
+        fut: List[Future],
+        device: torch.device,
+        trace_ids: Sequence[Optional[str]] = (),
+        paddings: Sequence[Optional[Tuple[int, ...]]] = (),
+    ) -> None:
+        """
+        :param model: replica of model on device
+        :param data: input data to neural network, all of the same shape
+        :param trace_ids: trace ids of requests in data, compute time is recorded for them
+        :param paddings: padding added to requests in data, cropped from their prediction
+        """
         keys: List = [d.id for d in data]
         data: List[torch.Tensor] = data.as_torch()
-
-        self.logger.debug("forward with batch_size %d (increasing: %s)", batch_size, increase_batch_size)
+        shape = tuple(data[0].shape)
 
         start = 0
-        last_batch_size = batch_size
-
-        def create_end_generator(start, end, batch_size):
-            for batch_end in range(start + batch_size, end, batch_size):
-                yield batch_end
-
-            yield end
-
-        end_generator = create_end_generator(start, len(keys), batch_size)
         while start < len(keys):
-            end = next(end_generator)
+            batch_size = self.batch_sizes.batch_size(device, shape)
+            end = min(start + batch_size, len(keys))
+            self.logger.debug("forward %d of %d with batch size %d", end - start, len(keys), batch_size)
             try:
+                compute_start = time.monotonic()
                 with torch.no_grad():
                     pred = model(torch.stack(data[start:end]).to(dtype=torch.float, device=device)).cpu()
+                compute_end = time.monotonic()
             except Exception as e:
-                if batch_size > last_batch_size:
-                    self.logger.info(
-                        "forward pass with batch size %d threw exception '%s'. Using previous batch size %d again.",
-                        batch_size,
-                        e,
-                        last_batch_size,
-                    )
-                    batch_size = last_batch_size
-                    increase_batch_size = False
-                else:
-                    last_batch_size = batch_size
-                    batch_size //= 2
-                    if batch_size == 0:
-                        self.logger.error(
-                            "Forward pass with batch size %d threw exception '%s'\nwith traceback: %s. Processed %d/%d",
-                            last_batch_size,
-                            e,
-                            traceback.format_exception(type(e), e, e.__traceback__),
-                            start,
-                            len(keys),
-                        )
-                        for i in range(start, len(keys)):
-                            fut[i].set_exception(e)
-
-                        break
-
-                    increase_batch_size = True
-                    self.logger.info(
-                        "forward pass with batch size %d threw exception '%s'. Trying again with smaller batch_size %d",
-                        last_batch_size,
-                        e,
-                        batch_size,
-                    )
-                end_generator = create_end_generator(start, len(keys), batch_size)
+                if end - start > 1 and batch_control.is_out_of_memory(e):
+                    # retry same requests with smaller batch size
+                    self.batch_sizes.out_of_memory(device, shape, end - start)
+                    if device.type == "cuda":
+                        with torch.cuda.device(device.index):
+                            torch.cuda.empty_cache()
+                    continue
+
+                # smaller batches don't help with other errors
+                self.logger.error(
+                    "Forward pass with batch size %d threw exception '%s'\nwith traceback: %s. Processed %d/%d",
+                    end - start,
+                    e,
+                    traceback.format_exception(type(e), e, e.__traceback__),
+                    start,
+                    len(keys),
+                )
+                for i in range(start, end):
+                    fut[i].set_exception(e)
             else:
+                self.batch_sizes.record(device, shape, end - start, compute_end - compute_start)
+                with self.stats_lock:
+                    self.compute_us.record((compute_end - compute_start) * 1e6)
+                for trace_id in trace_ids[start:end]:
+                    record("compute", compute_start, compute_end, trace_id, device=str(device), batch=end - start)
+
                 for i in range(start, end):
-                    try:
-                        fut[i].set_result(TikTensor(pred[i], id_=keys[i]))
-                    except Exception as e:
-                        self.logger.error(
-                            "start: %s, end: %s, pred: %s, keys: %s, i: %s", start, end, pred.shape, len(keys), i
-                        )
-                        self.logger.exception(e)
-                        raise e
-                last_batch_size = batch_size
-                if increase_batch_size and end - start >= batch_size:  # do not increase batch size after successfully
-                    #                                                    computing an incomplete batch
-                    max_cpu_batch_size = self.config.get("inference_max_cpu_batch_size", 100)
-                    if batch_size >= max_cpu_batch_size:
-                        self.logger.info("Reached 'inference_max_cpu_batch_size' of %d", max_cpu_batch_size)
-                        increase_batch_size = False
-                    else:
-                        batch_size += 1
-                        end_generator = create_end_generator(end, len(keys), batch_size)
-
-                start = end
-
-        return batch_size, increase_batch_size
+                    padding = paddings[i] if paddings else None
+                    fut[i].set_result(TikTensor(self._crop(pred[i], padding), id_=keys[i]))
+
+            start = end
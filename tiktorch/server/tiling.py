@@ -0,0 +1,183 @@
+"""
+Tiled inference of images larger than the network input
+
+The image (channel axis first, followed by 2 or 3 spatial axes) is cut into tiles of a valid
+input shape. A network shrinks its input by *shrinkage* along every spatial axis, so the
+prediction of a tile covers its center only: the tile minus a halo of shrinkage // 2 voxels
+at the start and the remainder at the end. The image is reflect padded by the halo, which
+makes the valid regions of all tiles cover the whole image.
+
+Tiles are laid out on a regular grid of their valid regions, the last tile along an axis is
+moved back to end with the image, so it may overlap its neighbour. Overlapping predictions
+are averaged, with *blend* tiles overlap by a fraction of their size and are weighted by a
+window decreasing linearly towards the tile border to hide seams.
+"""
+import functools
+import operator
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy
+
+BLEND_OVERLAP = 0.25  # fraction of valid region of tile overlapping its neighbours when blending
+MAX_TILES_IN_FLIGHT = 64  # tiles of one image queued for inference at once
+MAX_TILED_REQUESTS = 4  # images tiled at once by handler, further requests wait for a worker
+TILE_RETRIES = 5  # backoffs after tiles rejected by inference admission before tiled request fails
+TILE_BACKOFF = 0.01  # seconds to wait before resubmitting rejected tile, doubled on every retry
+
+Shape = Tuple[int, ...]
+Region = Tuple[slice, ...]
+
+
+def halo(shrinkage: Sequence[int]) -> List[Tuple[int, int]]:
+    """
+    :param shrinkage: difference of input and output size of every spatial axis
+    :returns context needed before and after valid region of every spatial axis
+    """
+    return [(amount // 2, amount - amount // 2) for amount in shrinkage]
+
+
+def _grid(size: int, tile: int, step: int) -> List[int]:
+    """
+    :returns start of every tile along an axis, last tile ends with axis or at tile if axis is shorter
+    """
+    last = max(size - tile, 0)
+    return list(range(0, last, step)) + [last]
+
+
+def _prod(shape: Sequence[int]) -> int:
+    return functools.reduce(operator.mul, shape, 1)
+
+
+class Tiling:
+    def __init__(self, shape: Shape, tile_shape: Shape, shrinkage: Shape, overlap: Optional[Shape] = None) -> None:
+        """
+        :param shape: shape of image, channel axis first
+        :param tile_shape: valid input shape of network, channel axis first
+        :param shrinkage: shrinkage of network, first value (channel axis) is ignored
+        :param overlap: overlap of valid regions of neighbouring tiles along every spatial axis
+        """
+        if len(shape) != len(tile_shape) or len(shape) != len(shrinkage):
+            raise ValueError(f"Image of shape {shape} doesn't match tile shape {tile_shape} and shrinkage {shrinkage}")
+        if shape[0] != tile_shape[0]:
+            raise ValueError(f"Image has {shape[0]} channels, network expects {tile_shape[0]}")
+
+        self.shape = tuple(shape)
+        self.tile_shape = tuple(tile_shape)
+        self.halo = halo(shrinkage[1:])
+        self.output_shape = tuple(t - lo - hi for t, (lo, hi) in zip(tile_shape[1:], self.halo))
+        self.overlap = (0,) * len(self.output_shape) if overlap is None else tuple(overlap)
+        if any(out <= 0 for out in self.output_shape):
+            raise ValueError(f"Tile shape {tile_shape} leaves no valid region with shrinkage {shrinkage}")
+        if any(not 0 <= ov < out for ov, out in zip(self.overlap, self.output_shape)):
+            raise ValueError(f"Overlap {self.overlap} has to be smaller than valid region {self.output_shape}")
+
+        steps = [out - ov for out, ov in zip(self.output_shape, self.overlap)]
+        grids = [_grid(size, out, step) for size, out, step in zip(shape[1:], self.output_shape, steps)]
+        # valid regions may extend beyond image if image is smaller than a single valid region
+        self.padded_shape = tuple(max(size, out) for size, out in zip(shape[1:], self.output_shape))
+        self.starts: List[Shape] = [()]
+        for grid in grids:
+            self.starts = [start + (s,) for start in self.starts for s in grid]
+
+    @classmethod
+    def for_valid_shapes(
+        cls, shape: Shape, valid_shapes: Sequence[Shape], shrinkage: Shape, blend: bool = False
+    ) -> "Tiling":
+        """
+        Choose valid shape computing the least voxels in total to cover image, larger tiles on a tie
+
+        :param blend: tiles overlap by BLEND_OVERLAP of their valid region
+        """
+        candidates = []
+        for tile_shape in valid_shapes:
+            try:
+                tiling = cls(shape, tile_shape, shrinkage)
+                if blend:
+                    overlap = tuple(int(out * BLEND_OVERLAP) for out in tiling.output_shape)
+                    tiling = cls(shape, tile_shape, shrinkage, overlap)
+            except ValueError:
+                continue
+
+            candidates.append((len(tiling) * _prod(tile_shape), -_prod(tile_shape), tiling))
+
+        if not candidates:
+            raise ValueError(f"None of the valid shapes {list(valid_shapes)} can be used for image of shape {shape}")
+
+        return min(candidates, key=lambda candidate: candidate[:2])[2]
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def region(self, start: Shape) -> Region:
+        """
+        :returns valid region of tile starting at start within padded prediction
+        """
+        return tuple(slice(s, s + out) for s, out in zip(start, self.output_shape))
+
+    def tiles(self, image: numpy.ndarray) -> Iterator[Tuple[Shape, numpy.ndarray]]:
+        """
+        :returns start and input data of every tile
+        """
+        if tuple(image.shape) != self.shape:
+            raise ValueError(f"Image of shape {image.shape} doesn't match tiling for shape {self.shape}")
+
+        padding = [(0, 0)] + [
+            (lo, hi + padded - size) for (lo, hi), padded, size in zip(self.halo, self.padded_shape, self.shape[1:])
+        ]
+        padded_image = numpy.pad(image, padding, mode="reflect")
+        for start in self.starts:
+            tile = padded_image[(slice(None),) + tuple(slice(s, s + t) for s, t in zip(start, self.tile_shape[1:]))]
+            yield start, numpy.ascontiguousarray(tile)
+
+    def window(self, blend: bool) -> numpy.ndarray:
+        """
+        :returns weight of every voxel of valid region of a tile
+        """
+        weights = numpy.ones(self.output_shape, dtype=numpy.float32)
+        if not blend:
+            return weights
+
+        for axis, (out, ov) in enumerate(zip(self.output_shape, self.overlap)):
+            idx = numpy.arange(out)
+            ramp = numpy.minimum(numpy.minimum(idx + 1, out - idx), ov + 1) / (ov + 1)
+            weights *= ramp.reshape([-1 if a == axis else 1 for a in range(len(self.output_shape))])
+
+        return weights
+
+
+class Stitcher:
+    """
+    Accumulate predictions of tiles to prediction of whole image
+    """
+
+    def __init__(self, tiling: Tiling, blend: bool = False) -> None:
+        self.tiling = tiling
+        self._window = tiling.window(blend)
+        self._weights = numpy.zeros(tiling.padded_shape, dtype=numpy.float32)
+        self._sum: Optional[numpy.ndarray] = None
+
+    def add(self, start: Shape, pred: numpy.ndarray) -> None:
+        """
+        :param pred: prediction of tile starting at start, channel axis first
+        """
+        if tuple(pred.shape[1:]) != self.tiling.output_shape:
+            raise ValueError(
+                f"Prediction of shape {tuple(pred.shape)} doesn't match valid region {self.tiling.output_shape}"
+            )
+
+        if self._sum is None:
+            self._sum = numpy.zeros((pred.shape[0],) + self.tiling.padded_shape, dtype=numpy.float32)
+
+        region = self.tiling.region(start)
+        self._sum[(slice(None),) + region] += pred * self._window
+        self._weights[region] += self._window
+
+    def result(self) -> numpy.ndarray:
+        """
+        :returns prediction of image, channel axis first
+        """
+        if self._sum is None or not self._weights.all():
+            raise ValueError("Prediction of some tiles is missing")
+
+        crop = tuple(slice(0, size) for size in self.tiling.shape[1:])
+        return self._sum[(slice(None),) + crop] / self._weights[crop]
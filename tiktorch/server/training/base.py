@@ -52,7 +52,7 @@ from tiktorch.configkeys import (
     TRANSFORMS,
     VALIDATION,
 )
-from tiktorch.rpc import RPCFuture, RPCInterface, Shutdown, exposed
+from tiktorch.rpc import RPCFuture, RPCInterface, Shutdown, exposed, metrics
 from tiktorch.rpc.mp import MPServer
 from tiktorch.server.utils import get_transform
 from tiktorch.tiktypes import LabeledTikTensorBatch, TikTensor, TikTensorBatch
@@ -64,6 +64,9 @@ from .interface import ITraining
 from . import worker
 
 
+# set_devices and get_state block for long, other calls shouldn't wait for them
+RPC_WORKERS = 4
+
 # inferno names
 INFERNO_LOGGER_CONFIG = "logger_config"
 INFERNO_MAX_NUM_EPOCHS = "max_num_epochs"
@@ -95,7 +98,7 @@ def run(
 
     log.configure(log_queue)
     training_proc = TrainingProcess(config, model, optimizer_state)
-    srv = MPServer(training_proc, conn)
+    srv = MPServer(training_proc, conn, max_workers=RPC_WORKERS)
     srv.listen()
 
 
@@ -332,6 +335,9 @@ class TrainingProcess(ITraining):
     def get_idle(self) -> bool:
         return self._worker.get_idle()
 
+    def get_rpc_stats(self) -> Dict[str, Any]:
+        return metrics.registry.snapshot()
+
     def shutdown(self) -> Shutdown:
         self._worker.shutdown()
         return Shutdown()
@@ -1,14 +1,15 @@
-from typing import List
+from typing import Any, Dict, List
 
 import torch
 
-from tiktorch.rpc import RPCInterface, RPCFuture, exposed, Shutdown
+from tiktorch.rpc import RPCInterface, RPCFuture, exposed, serial, Shutdown
 from tiktorch.tiktypes import TikTensorBatch
 from tiktorch.types import ModelState
 
 
 class ITraining(RPCInterface):
     @exposed
+    @serial
     def set_devices(self, devices: List[torch.device]) -> List[torch.device]:
         raise NotImplementedError
 
@@ -17,10 +18,12 @@ class ITraining(RPCInterface):
         raise NotImplementedError
 
     @exposed
+    @serial("control")
     def resume_training(self) -> None:
         raise NotImplementedError
 
     @exposed
+    @serial("control")
     def pause_training(self) -> None:
         raise NotImplementedError
 
@@ -29,10 +32,12 @@ class ITraining(RPCInterface):
         raise NotImplementedError
 
     @exposed
+    @serial("data")
     def update_dataset(self, name: str, data: TikTensorBatch, labels: TikTensorBatch) -> None:
         raise NotImplementedError
 
     @exposed
+    @serial("data")
     def update_config(self, partial_config: dict) -> None:
         raise NotImplementedError
 
@@ -41,9 +46,14 @@ class ITraining(RPCInterface):
         raise NotImplementedError
 
     @exposed
+    @serial("data")
     def remove_data(self, name: str, ids: List[str]) -> None:
         raise NotImplementedError
 
     @exposed
     def wait_for_idle(self) -> RPCFuture:
         raise NotImplementedError
+
+    @exposed
+    def get_rpc_stats(self) -> Dict[str, Any]:
+        raise NotImplementedError